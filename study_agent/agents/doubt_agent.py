@@ -1,65 +1,232 @@
-# agents/doubt_agent.py
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-import pickle
-from utils.prompts import DOUBT_PROMPT
-from utils.llm_clients import model 
-import os
-import google.generativeai as genai  # <-- THIS LINE IS THE FIX for Error 2
-
-VECTOR_STORE_PATH = "vector_store/study_material.index"
-CHUNKS_PATH = "vector_store/chunks.pkl"
-
-class DoubtAgent:
-    """
-    Answers contextual doubts using RAG with a Gemini model.
-    """
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        self.embedding_model = SentenceTransformer(model_name)
-        try:
-            self.vector_store = faiss.read_index(VECTOR_STORE_PATH)
-            with open(CHUNKS_PATH, 'rb') as f:
-                self.text_chunks = pickle.load(f)
-            print("DoubtAgent: Initialized and loaded vector store.")
-        except Exception as e:
-            print(f"DDoubtAgent: Error loading vector store. Has it been created? {e}")
-            self.vector_store = None
-            self.text_chunks = []
-
-    def answer_question(self, query):
-        if not self.vector_store:
-            return "The study material has not been processed yet. Please upload a PDF first."
-        if not model:
-             return "The Gemini LLM model is not initialized. Please check your API key."
-
-        print(f"DoubtAgent: Answering query: {query}")
-        
-        # 1. Retrieve relevant chunks
-        context_chunks = self._retrieve_context(query)
-        context = "\n\n".join(context_chunks)
-        
-        # 2. Generate answer
-        prompt = DOUBT_PROMPT.format(context=context, query=query)
-        
-        # --- This block is now for Gemini ---
-        try:
-            response = model.generate_content(
-                prompt,
-                # Now the 'genai' import above makes this line work
-                generation_config=genai.types.GenerationConfig(temperature=0.1)
-            )
-            answer = response.text
-            return answer
-        except Exception as e:
-            print(f"Error in DoubtAgent LLM call (Gemini): {e}")
-            return "Sorry, I encountered an error trying to answer your question."
-        # --- End Gemini block ---
-
-    def _retrieve_context(self, query, k=3):
-        """Finds the top-k most relevant text chunks."""
-        query_embedding = self.embedding_model.encode([query]).astype('float32')
-        distances, indices = self.vector_store.search(query_embedding, k)
-        
-        retrieved_chunks = [self.text_chunks[i] for i in indices[0]]
-        return retrieved_chunks
+# agents/doubt_agent.py
+import numpy as np
+from utils.prompts import DOUBT_PROMPT
+from utils.llm_clients import get_text_response_from_llm, stream_text_from_llm, run_concurrently
+from utils.answer_cache import answer_cache
+from utils.registry import get_embedding_model, get_vector_store, get_llm_model, EMBEDDING_MODEL_NAME
+from utils import metrics
+import os
+import time
+
+# Questions embedded, searched and sent to the LLM together by answer_questions
+ANSWER_BATCH_SIZE = int(os.environ.get("ANSWER_BATCH_SIZE", 256))
+
+ERROR_ANSWER = "Sorry, I encountered an error trying to answer your question."
+# Appended to a streamed answer that an error cut short, set apart from the partial text
+STREAM_ERROR_NOTE = "\n\n---\n*The answer was cut off by an error. Please ask again.*"
+
+class DoubtAgent:
+    """
+    Answers contextual doubts using RAG with a Gemini model.
+    The embedding model, vector store and LLM are shared process-wide
+    (see utils/registry.py), so creating an agent is cheap.
+    """
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME):
+        self.model_name = model_name
+        try:
+            self.vector_store = get_vector_store()
+            if self.vector_store is not None:
+                print("DoubtAgent: Initialized and loaded vector store.")
+        except Exception as e:
+            print(f"DDoubtAgent: Error loading vector store. Has it been created? {e}")
+            self.vector_store = None
+        self.last_metrics = {}  # Latency of the last streamed answer
+
+    @property
+    def embedding_model(self):
+        return get_embedding_model(self.model_name)
+
+    def _refresh_vector_store(self):
+        """Picks up a newer vector store saved by a later upload (cheap if unchanged)."""
+        try:
+            self.vector_store = get_vector_store()
+        except Exception as e:
+            print(f"DoubtAgent: Error reloading vector store: {e}")
+
+    def answer_question(self, query, stream=False, cancel_event=None):
+        """
+        Answers a doubt from the notes. With stream=True, returns a generator
+        of text increments instead (see stream_answer).
+        """
+        if stream:
+            return self.stream_answer(query, cancel_event=cancel_event)
+
+        error, cached, prompt, cache_args = self._prepare_answer(query)
+        if error or cached is not None:
+            return error or cached
+        
+        # --- This block is now for Gemini ---
+        try:
+            # Served from the persistent LLM cache when this exact prompt was asked before
+            start_time = time.time()
+            answer = get_text_response_from_llm(
+                prompt,
+                generation_config={"temperature": 0.1}
+            )
+            query_embedding, chunk_ids, store_version = cache_args
+            answer_cache.put(query, query_embedding, chunk_ids, answer, time.time() - start_time, store_version)
+            metrics.observe("doubt_answer_seconds", time.time() - start_time, mode="blocking")
+            return answer
+        except Exception as e:
+            print(f"Error in DoubtAgent LLM call (Gemini): {e}")
+            return ERROR_ANSWER
+        # --- End Gemini block ---
+
+    def stream_answer(self, query, cancel_event=None):
+        """
+        Yields the answer in increments as the model generates it. Stops early,
+        without caching the partial answer, once cancel_event is set. If the
+        model fails mid-answer, the last increment is STREAM_ERROR_NOTE.
+        Afterwards self.last_metrics holds time-to-first-token, total latency
+        and the error, if any.
+        """
+        start_time = time.time()
+        self.last_metrics = {"ttft_s": None, "total_s": None, "cached": False, "cancelled": False, "error": None}
+        error, cached, prompt, cache_args = self._prepare_answer(query)
+        if error or cached is not None:
+            self.last_metrics.update(ttft_s=time.time() - start_time, total_s=time.time() - start_time,
+                                     cached=cached is not None)
+            yield error or cached
+            return
+
+        pieces = []
+        llm_start = time.time()
+        try:
+            for piece in stream_text_from_llm(prompt, generation_config={"temperature": 0.1}, cancel_event=cancel_event):
+                if self.last_metrics["ttft_s"] is None:
+                    self.last_metrics["ttft_s"] = time.time() - start_time
+                pieces.append(piece)
+                yield piece
+        except Exception as e:
+            print(f"Error in DoubtAgent LLM call (Gemini): {e}")
+            self.last_metrics["error"] = str(e) or type(e).__name__
+            yield STREAM_ERROR_NOTE if pieces else ERROR_ANSWER
+            return
+        finally:
+            self.last_metrics["total_s"] = time.time() - start_time
+            if self.last_metrics["ttft_s"] is not None:
+                metrics.observe("doubt_first_token_seconds", self.last_metrics["ttft_s"])
+            metrics.observe("doubt_answer_seconds", self.last_metrics["total_s"], mode="stream")
+
+        if cancel_event is not None and cancel_event.is_set():
+            self.last_metrics["cancelled"] = True
+            print("DoubtAgent: Answer cancelled.")
+            return
+        query_embedding, chunk_ids, store_version = cache_args
+        answer_cache.put(query, query_embedding, chunk_ids, "".join(pieces), time.time() - llm_start, store_version)
+        print(f"DoubtAgent: Streamed answer (first token after {self.last_metrics['ttft_s'] or 0:.2f}s, "
+              f"total {self.last_metrics['total_s']:.2f}s).")
+
+    def _prepare_answer(self, query):
+        """
+        Retrieval half of answering: returns (error, cached answer, prompt,
+        (query embedding, chunk IDs, store version)); at most one of the
+        first three is set.
+        """
+        self._refresh_vector_store()
+        if self.vector_store is None or self.vector_store.index is None:
+            return "The study material has not been processed yet. Please upload a PDF first.", None, None, None
+        if not get_llm_model():
+             return "The Gemini LLM model is not initialized. Please check your API key.", None, None, None
+
+        print(f"DoubtAgent: Answering query: {query}")
+        
+        # 1. Retrieve relevant chunks (IDs only; the text is read on a cache miss)
+        with metrics.span("doubt_retrieve"):
+            query_embedding = self._encode(query)
+            chunk_ids = self._search(query_embedding)
+        cache_args = (query_embedding, chunk_ids, self.vector_store.index_file)
+
+        # A similar question with the same context was answered before
+        cached = answer_cache.lookup(*cache_args)
+        metrics.inc("doubt_questions_total", source="llm" if cached is None else "answer_cache")
+        if cached is not None:
+            print("DoubtAgent: Answered from the semantic answer cache.")
+            return None, cached, None, cache_args
+
+        context = "\n\n".join(self.vector_store.get_chunks(chunk_ids))
+        
+        # 2. Build the answer prompt
+        prompt = DOUBT_PROMPT.format(context=context, query=query)
+        return None, None, prompt, cache_args
+
+    def answer_questions(self, queries, k=3, batch_size=ANSWER_BATCH_SIZE, max_concurrency=None):
+        """
+        Batch version of answer_question for question banks. Yields one
+        {"question", "answer", "chunk_ids", "cached"} dict per query, in order,
+        as each batch completes. Per batch: one vectorized encode, one FAISS
+        search, one read of the distinct chunks hit, and concurrent LLM calls
+        for the distinct (question, context) prompts not in the answer cache.
+        """
+        self._refresh_vector_store()
+        error = None
+        if self.vector_store is None or self.vector_store.index is None:
+            error = "The study material has not been processed yet. Please upload a PDF first."
+        elif not get_llm_model():
+            error = "The Gemini LLM model is not initialized. Please check your API key."
+
+        queries = list(queries)
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            if error:
+                for query in batch:
+                    yield {"question": query, "answer": error, "chunk_ids": [], "cached": False}
+                continue
+            yield from self._answer_batch(batch, k, max_concurrency)
+
+    def _answer_batch(self, queries, k, max_concurrency):
+        # 1. Retrieve: one encode and one search for the whole batch
+        with metrics.span("doubt_retrieve_batch"):
+            embeddings = self.embedding_model.encode(queries).astype('float32')
+            distances, indices = self.vector_store.index.search(embeddings, k)
+        chunk_ids = [[int(i) for i in row if i != -1] for row in indices]
+
+        store_version = self.vector_store.index_file
+        answers = [answer_cache.lookup(embedding, ids, store_version) for embedding, ids in zip(embeddings, chunk_ids)]
+        cached = [answer is not None for answer in answers]
+        metrics.inc("doubt_questions_total", sum(cached), source="answer_cache")
+        metrics.inc("doubt_questions_total", len(cached) - sum(cached), source="llm")
+
+        # 2. Each distinct chunk is read once, each distinct prompt is sent once
+        misses = [i for i, answer in enumerate(answers) if answer is None]
+        needed = list(dict.fromkeys(chunk_id for i in misses for chunk_id in chunk_ids[i]))
+        texts = self.vector_store.get_chunk_map(needed)
+        prompts = {}
+        for i in misses:
+            context = "\n\n".join(texts[chunk_id] for chunk_id in chunk_ids[i] if chunk_id in texts)
+            prompts.setdefault(DOUBT_PROMPT.format(context=context, query=queries[i]), []).append(i)
+
+        def generate(prompt):
+            start_time = time.time()
+            try:
+                answer = get_text_response_from_llm(prompt, generation_config={"temperature": 0.1})
+            except Exception as e:
+                print(f"Error in DoubtAgent LLM call (Gemini): {e}")
+                return None, 0.0
+            return answer, time.time() - start_time
+
+        # 3. Concurrent LLM calls; only successful answers are cached
+        for (prompt, rows), (answer, latency) in zip(prompts.items(), run_concurrently(generate, prompts, max_concurrency)):
+            first = rows[0]
+            # Not cached if some of the context was gone (deleted by another process)
+            if answer is not None and all(chunk_id in texts for chunk_id in chunk_ids[first]):
+                answer_cache.put(queries[first], embeddings[first], chunk_ids[first], answer, latency, store_version)
+            for i in rows:
+                answers[i] = answer if answer is not None else ERROR_ANSWER
+
+        for i, query in enumerate(queries):
+            yield {"question": query, "answer": answers[i], "chunk_ids": chunk_ids[i], "cached": cached[i]}
+
+    def _encode(self, query):
+        return self.embedding_model.encode([query]).astype('float32')[0]
+
+    def _search(self, query_embedding, k=3):
+        """IDs of the top-k most relevant chunks."""
+        distances, indices = self.vector_store.index.search(query_embedding.reshape(1, -1), k)
+        # FAISS returns chunk IDs across the whole library (-1 = fewer than k hits)
+        return [int(i) for i in indices[0] if i != -1]
+
+    def _retrieve_context(self, query, k=3):
+        """Finds the top-k most relevant text chunks."""
+        # Only the text of these hits is read from the database
+        return self.vector_store.get_chunks(self._search(self._encode(query), k))
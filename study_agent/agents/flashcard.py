@@ -1,34 +1,53 @@
-# agents/flashcard.py
-from utils.llm_clients import get_json_response_from_llm
-from utils.prompts import FLASHCARD_PROMPT
-import json
-import os
-
-OUTPUT_PATH = "outputs/flashcards.json"
-
-class FlashcardAgent:
-    """
-    Generates Q/A flashcards from text chunks.
-    """
-    def __init__(self):
-        self.flashcards = []
-        print("FlashcardAgent: Initialized.")
-
-    def generate_flashcards(self, text_chunks):
-        print(f"FlashcardAgent: Generating flashcards for {len(text_chunks)} chunks...")
-        
-        for chunk in text_chunks:
-            prompt = FLASHCARD_PROMPT.format(text_chunk=chunk)
-            response_json = get_json_response_from_llm(prompt)
-            
-            if response_json and isinstance(response_json, list):
-                self.flashcards.extend(response_json)
-        
-        self._save_flashcards()
-        print(f"FlashcardAgent: Generated {len(self.flashcards)} flashcards.")
-        return self.flashcards
-
-    def _save_flashcards(self):
-        os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-        with open(OUTPUT_PATH, 'w', encoding='utf-8') as f:
-            json.dump(self.flashcards, f, indent=2)
\ No newline at end of file
+# agents/flashcard.py
+from utils.llm_clients import get_json_responses_from_llm, collect_json_items
+from utils.prompts import FLASHCARD_PROMPT, AVOID_QUESTIONS
+from utils.json_salvage import clean_flashcard, clean_items
+from utils.database import add_flashcards # <-- IMPORT DB FUNCTION
+from utils import metrics
+
+FLASHCARDS_PER_CHUNK = 5
+
+def flashcard_prompt(text_chunk, count=FLASHCARDS_PER_CHUNK, existing=()):
+    """The flashcard prompt for count cards, telling the model to skip the existing ones."""
+    avoid = AVOID_QUESTIONS.format(questions="\n".join(f"- {card['question']}" for card in existing)) if existing else ""
+    return FLASHCARD_PROMPT.format(text_chunk=text_chunk, count=count, avoid=avoid)
+
+class FlashcardAgent:
+    """
+    Generates Q/A flashcards from text chunks and appends them to the
+    central database, linked to their chunk and document.
+    """
+    def __init__(self, document_name=None):
+        self.document_name = document_name
+        self.total = 0  # Cards added by this agent
+        print("FlashcardAgent: Initialized.")
+
+    def generate_flashcards(self, text_chunks):
+        print(f"FlashcardAgent: Generating flashcards for {len(text_chunks)} chunks...")
+
+        # All chunks are sent concurrently; responses come back in chunk order
+        prompts = [flashcard_prompt(chunk) for chunk in text_chunks]
+        responses = get_json_responses_from_llm(prompts)
+        # Cards missing from damaged or short responses are asked for again
+        card_lists = collect_json_items(text_chunks, responses, FLASHCARDS_PER_CHUNK, flashcard_prompt,
+                                        clean_flashcard, "flashcard")
+        return self.add_flashcards(text_chunks, card_lists)
+
+    def add_flashcards(self, text_chunks, flashcard_lists):
+        """
+        Saves one list of flashcards per chunk, e.g. the output
+        of StudyPackAgent's combined generation.
+        """
+        # Only well-formed items reach the database
+        items = []
+        for chunk, response_json in zip(text_chunks, flashcard_lists):
+            cards, _ = clean_items(response_json, clean_flashcard)
+            if cards:
+                items.append((chunk, cards))
+        added = add_flashcards(self.document_name, items)
+        self.total += added
+        metrics.inc("flashcards_added_total", added)
+        metrics.inc("chunks_without_flashcards_total", len(text_chunks) - len(items))
+
+        print(f"FlashcardAgent: Generated {added} flashcards ({self.total} so far).")
+        return added
@@ -1,33 +1,66 @@
-# agents/quiz.py
-from utils.llm_clients import get_json_response_from_llm
-from utils.prompts import QUIZ_PROMPT
-from utils.database import add_topic_and_quizzes # <-- IMPORT DB FUNCTION
-import json
-import os
-
-class QuizAgent:
-    """
-    Generates MCQs and saves them to the central database
-    to enable performance tracking.
-    """
-    def __init__(self):
-        print("QuizAgent: Initialized.")
-
-    def generate_and_store_quizzes(self, text_chunks):
-        """
-        Generates quizzes and saves them to the DB, linked to their chunk.
-        """
-        print(f"QuizAgent: Generating and storing quizzes for {len(text_chunks)} chunks...")
-        
-        total_quizzes = 0
-        for chunk in text_chunks:
-            prompt = QUIZ_PROMPT.format(text_chunk=chunk)
-            response_json = get_json_response_from_llm(prompt)
-            
-            if response_json and isinstance(response_json, list):
-                # Add this chunk and its quizzes to the database
-                add_topic_and_quizzes(chunk, response_json)
-                total_quizzes += len(response_json)
-        
-        print(f"QuizAgent: Generated and stored {total_quizzes} quizzes in the database.")
+# agents/quiz.py
+from utils.llm_clients import get_json_responses_from_llm, collect_json_items
+from utils.prompts import QUIZ_PROMPT, AVOID_QUESTIONS
+from utils.json_salvage import clean_quiz, clean_items
+from utils.database import add_topics_and_quizzes # <-- IMPORT DB FUNCTION
+from utils import metrics
+import json
+import os
+
+QUIZZES_PER_CHUNK = 3
+
+def quiz_prompt(text_chunk, count=QUIZZES_PER_CHUNK, existing=()):
+    """The quiz prompt for count questions, telling the model to skip the existing ones."""
+    avoid = AVOID_QUESTIONS.format(questions="\n".join(f"- {quiz['question']}" for quiz in existing)) if existing else ""
+    return QUIZ_PROMPT.format(text_chunk=text_chunk, count=count, avoid=avoid)
+
+class QuizAgent:
+    """
+    Generates MCQs and saves them to the central database
+    to enable performance tracking.
+    """
+    def __init__(self, buffered=False):
+        # When buffered, store_quizzes only collects quizzes and flush()
+        # writes all of them in one transaction (e.g. once per document)
+        self.buffered = buffered
+        self._pending = []
+        print("QuizAgent: Initialized.")
+
+    def generate_and_store_quizzes(self, text_chunks):
+        """
+        Generates quizzes and saves them to the DB, linked to their chunk.
+        """
+        print(f"QuizAgent: Generating and storing quizzes for {len(text_chunks)} chunks...")
+        
+        # All chunks are sent concurrently; responses come back in chunk order
+        prompts = [quiz_prompt(chunk) for chunk in text_chunks]
+        responses = get_json_responses_from_llm(prompts)
+        # Questions missing from damaged or short responses are asked for again
+        quiz_lists = collect_json_items(text_chunks, responses, QUIZZES_PER_CHUNK, quiz_prompt, clean_quiz, "quiz")
+        return self.store_quizzes(text_chunks, quiz_lists)
+
+    def store_quizzes(self, text_chunks, quiz_lists):
+        """
+        Saves one list of quizzes per chunk to the DB, e.g. the output
+        of StudyPackAgent's combined generation.
+        """
+        # Only well-formed items reach the database
+        items = []
+        for chunk, response_json in zip(text_chunks, quiz_lists):
+            quizzes, _ = clean_items(response_json, clean_quiz)
+            if quizzes:
+                items.append((chunk, quizzes))
+        metrics.inc("chunks_without_quizzes_total", len(text_chunks) - len(items))
+        self._pending.extend(items)
+        if self.buffered:
+            return sum(len(quiz_list) for _, quiz_list in items)
+        return self.flush()
+
+    def flush(self):
+        """Writes all collected quizzes (and their chunks) to the database in one transaction."""
+        pending, self._pending = self._pending, []
+        total_quizzes = add_topics_and_quizzes(pending)
+        metrics.inc("quizzes_stored_total", total_quizzes)
+        
+        print(f"QuizAgent: Generated and stored {total_quizzes} quizzes in the database.")
         return total_quizzes
\ No newline at end of file
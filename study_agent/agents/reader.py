@@ -1,61 +1,215 @@
-# agents/reader.py
-from utils.pdf_utils import extract_text_from_pdf, chunk_text
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-import os
-import pickle
-
-VECTOR_STORE_PATH = "vector_store/study_material.index"
-CHUNKS_PATH = "vector_store/chunks.pkl"
-
-class ReaderAgent:
-    """
-    Reads, cleans text (with OCR), and creates vector embeddings for RAG.
-    """
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        self.text_chunks = []
-        self.embedding_model = SentenceTransformer(model_name)
-        self.vector_store = None
-        print("ReaderAgent: Initialized.")
-
-    def process_pdf(self, pdf_path):
-        """
-        Main workflow for the agent.
-        """
-        print(f"ReaderAgent: Processing {pdf_path}...")
-        
-        # 1. Extract text (now with OCR)
-        raw_text = extract_text_from_pdf(pdf_path)
-        
-        # 2. Process and chunk text
-        self.text_chunks = chunk_text(raw_text)
-        
-        if not self.text_chunks:
-            print("ReaderAgent: No text chunks found. Aborting.")
-            return False
-        
-        print(f"ReaderAgent: Extracted {len(self.text_chunks)} text chunks.")
-        
-        # 3. Create vector embeddings (for Doubt Agent)
-        self._create_vector_store()
-        
-        return self.text_chunks
-
-    def _create_vector_store(self):
-        """Creates and saves a FAISS vector store."""
-        print("ReaderAgent: Creating vector embeddings...")
-        embeddings = self.embedding_model.encode(self.text_chunks, show_progress_bar=True)
-        
-        dimension = embeddings.shape[1]
-        self.vector_store = faiss.IndexFlatL2(dimension)
-        self.vector_store.add(np.array(embeddings).astype('float32'))
-        
-        # Save the vector store and chunks
-        os.makedirs(os.path.dirname(VECTOR_STORE_PATH), exist_ok=True)
-        faiss.write_index(self.vector_store, VECTOR_STORE_PATH)
-        
-        with open(CHUNKS_PATH, 'wb') as f:
-            pickle.dump(self.text_chunks, f)
-            
-        print(f"ReaderAgent: Vector store and chunks saved.")
\ No newline at end of file
+# agents/reader.py
+from utils.pdf_utils import iter_pages_from_pdf, clean_text, find_headers_footers, strip_headers_footers, HEADER_FOOTER_VERSION
+from utils.chunker import chunk_text, chunk_settings
+from utils.llm_clients import estimate_tokens
+from utils.page_cache import PageCache, content_hash
+from utils.near_duplicates import NearDuplicateIndex
+from utils.registry import get_embedding_model, EMBEDDING_MODEL_NAME
+from utils.vector_store import VectorStore
+from utils.database import delete_document_flashcards, named_lock
+from utils import metrics
+import numpy as np
+import os
+
+VECTOR_STORE_LOCK = "vector_store"  # Serializes vector store updates across processes
+
+class ReaderAgent:
+    """
+    Reads, cleans text (with OCR), and creates vector embeddings for RAG.
+    Each PDF is added to the shared multi-document vector store under its
+    file name; uploading a file with the same name replaces that document.
+    """
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME):
+        self.model_name = model_name
+        self.text_chunks = []  # This document's chunks
+        self.new_chunks = []  # Chunks from pages not processed in a previous upload
+        self.vector_store = None  # VectorStore for the whole library, loaded when saving
+        self.document_name = None
+        self.page_cache = PageCache()
+        self.near_duplicates = NearDuplicateIndex()
+        self.stats = {}
+        self._pending_pages = []
+        self._page_hashes = []  # Every page of this document, new or reused
+        self._chunk_settings = ""
+        self._duplicate_of = {}  # chunk_hash -> chunk_hash of the near-identical chunk whose embedding it reuses
+        print("ReaderAgent: Initialized.")
+
+    @property
+    def embedding_model(self):
+        # Shared with DoubtAgent; loaded once per process on first use
+        return get_embedding_model(self.model_name)
+
+    def process_pdf(self, pdf_path):
+        """
+        Main workflow for the agent (non-streaming).
+        Pages seen in an earlier upload are reused from the page cache; only
+        changed or new pages are extracted, chunked and sent downstream
+        (their chunks end up in self.new_chunks, minus near-duplicates of
+        material that already has a topic).
+        """
+        # 1+2. Extract text (now with OCR) and chunk it, page by page
+        all_chunks, self.new_chunks = [], []
+        for page, chunks, is_new in self.iter_page_chunks(pdf_path):
+            all_chunks.extend(chunks)
+            if is_new:
+                self.new_chunks.extend(chunk for chunk, duplicate_of in zip(chunks, self.find_duplicates(chunks))
+                                       if duplicate_of is None)
+        
+        if not all_chunks:
+            print("ReaderAgent: No text chunks found. Aborting.")
+            return False
+        
+        print(f"ReaderAgent: Extracted {len(all_chunks)} text chunks ({len(self.new_chunks)} new).")
+        
+        # 3. Create vector embeddings (for Doubt Agent)
+        print("ReaderAgent: Creating vector embeddings...")
+        self.add_to_vector_store(all_chunks)
+        self.save_vector_store()
+        
+        return self.text_chunks
+
+    def iter_page_chunks(self, pdf_path):
+        """
+        Streams a PDF page by page, yielding (page, chunks, is_new) as soon as
+        each page is extracted. Pages fully processed in an earlier upload come
+        straight from the page cache with is_new=False. Updates self.stats.
+        """
+        print(f"ReaderAgent: Processing {pdf_path}...")
+        self.document_name = os.path.basename(pdf_path)
+        self.text_chunks = []
+        self._pending_pages = []
+        self._page_hashes = []
+        self._duplicate_of = {}
+        self.stats = {"pages_reused": 0, "pages_recomputed": 0, "chunks_reused": 0, "chunks_recomputed": 0,
+                      "chunks_duplicate": 0, "embeddings_reused": 0}
+
+        # Running headers/footers are left out of the chunks
+        with metrics.span("find_headers_footers"):
+            furniture = find_headers_footers(pdf_path)
+        if furniture:
+            print(f"ReaderAgent: Stripping {len(furniture)} repeated headers/footers.")
+
+        # Cached chunks are only reused if they were made with the current chunker and header/footer settings
+        self._chunk_settings = f"{chunk_settings()}:{HEADER_FOOTER_VERSION}"
+        for page in iter_pages_from_pdf(pdf_path, page_cache=self.page_cache, cache_settings=self._chunk_settings):
+            self._page_hashes.append(page["page_hash"])
+            if page["chunks"] and not self.near_duplicates.any_live(page["chunks"]):
+                # Its flashcards were deleted since (e.g. with a document uploaded before
+                # the page cache tracked documents), so it goes through generation again
+                page["chunks"] = None
+            if page["chunks"] is not None:
+                chunks, is_new = page["chunks"], False
+                self.stats["pages_reused"] += 1
+                self.stats["chunks_reused"] += len(chunks)
+            else:
+                with metrics.span("chunk"):
+                    chunks, is_new = chunk_text(clean_text(strip_headers_footers(page["text"], furniture))), True
+                for chunk in chunks:
+                    metrics.observe("chunk_tokens", estimate_tokens(chunk), metrics.SIZE_BUCKETS)
+                self.stats["pages_recomputed"] += 1
+                self.stats["chunks_recomputed"] += len(chunks)
+                self._pending_pages.append((page["page_hash"], chunks))
+            yield page, chunks, is_new
+
+    def add_to_vector_store(self, chunks):
+        """
+        Embeds a batch of this document's chunks (into the embedding cache).
+        They are added to the library's vector store by save_vector_store,
+        so the embedding work streams while the shared store is only held
+        locked for the final merge.
+        """
+        if not chunks:
+            return
+        self._embed_chunks(chunks)
+        self.text_chunks.extend(chunks)
+
+    def find_duplicates(self, chunks):
+        """
+        Looks up new chunks in the near-duplicate index. Returns, per chunk,
+        the digest of the chunk whose topic already covers it, or None for
+        new material that needs flashcards and quizzes. Near-duplicates
+        reuse that chunk's embedding instead of being encoded.
+        """
+        routes = self.near_duplicates.route(chunks)
+        for chunk, duplicate_of in zip(chunks, routes):
+            if duplicate_of is None:
+                continue
+            chunk_hash = content_hash(chunk)
+            metrics.inc("near_duplicate_chunks_total", match="exact" if duplicate_of == chunk_hash else "near")
+            self.stats["chunks_duplicate"] += 1
+            if duplicate_of != chunk_hash:
+                self._duplicate_of[chunk_hash] = duplicate_of
+        return routes
+
+    def commit_page_cache(self):
+        """
+        Marks this upload's new pages as fully processed, records which pages
+        the document has, and indexes their chunks for near-duplicate
+        detection. Call it once the downstream agents are done, so a crashed
+        run gets redone next time.
+        """
+        self.page_cache.mark_processed(self._pending_pages, self._chunk_settings)
+        self.page_cache.set_document_pages(self.document_name, self._page_hashes)
+        self._pending_pages = []
+        self.near_duplicates.commit()
+
+    def _embed_chunks(self, chunks):
+        """Encodes chunks, reusing cached embeddings for chunks seen before."""
+        hashes = [content_hash(chunk) for chunk in chunks]
+        cached = self.page_cache.get_embeddings(self.model_name, hashes)
+        
+        missing = list({h: chunk for h, chunk in zip(hashes, chunks) if h not in cached}.items())
+        metrics.inc("embeddings_total", len(hashes) - len(missing), source="cache")
+
+        # Near-duplicates take the embedding of the chunk they duplicate, once that one is encoded
+        aliases = {h: self._duplicate_of[h] for h, _ in missing if h in self._duplicate_of}
+        if aliases:
+            originals = self.page_cache.get_embeddings(self.model_name, list(set(aliases.values())))
+            reused = [(h, originals[original]) for h, original in aliases.items() if original in originals]
+            if reused:
+                self.page_cache.put_embeddings(self.model_name, reused)
+                cached.update(reused)
+                missing = [(h, chunk) for h, chunk in missing if h not in cached]
+                metrics.inc("embeddings_total", len(reused), source="near_duplicate")
+                self.stats["embeddings_reused"] += len(reused)
+        if missing:
+            metrics.inc("embeddings_total", len(missing), source="model")
+            with metrics.span("embed_encode"):
+                new_embeddings = self.embedding_model.encode([chunk for _, chunk in missing])
+            new_items = [(h, vector) for (h, _), vector in zip(missing, new_embeddings)]
+            self.page_cache.put_embeddings(self.model_name, new_items)
+            cached.update(new_items)
+        
+        return np.array([cached[h] for h in hashes]).astype('float32')
+
+    def save_vector_store(self):
+        """
+        Commits this document to the vector store and saves it. Other
+        processes (e.g. job workers) may be saving other documents, so the
+        latest store is loaded and updated under a cross-process lock.
+        """
+        if not self.text_chunks:
+            return
+        with named_lock(VECTOR_STORE_LOCK), metrics.span("vector_store_save"):
+            self.vector_store = VectorStore.load()
+            # Only chunks new to the library are looked up; they come from the embedding cache
+            self.vector_store.add_chunks(self.document_name, self.text_chunks, self._embed_chunks)
+            self.vector_store.commit_document(self.document_name)
+            self.vector_store.save()
+        
+        print(f"ReaderAgent: Vector store saved ({len(self.vector_store.list_documents())} documents, {self.vector_store.ntotal} chunks).")
+
+    def delete_document(self, document_name):
+        """
+        Removes a previously uploaded document from the vector store, along
+        with its flashcards. Its pages count as unprocessed again, so
+        uploading it again regenerates the flashcards.
+        """
+        with named_lock(VECTOR_STORE_LOCK):
+            self.vector_store = VectorStore.load()
+            cards = delete_document_flashcards(document_name)
+            removed = self.vector_store.delete_document(document_name)
+            self.vector_store.save()
+            self.page_cache.forget_document(document_name)
+        print(f"ReaderAgent: Deleted '{document_name}' ({removed} chunks, {cards} flashcards).")
+        return removed
\ No newline at end of file
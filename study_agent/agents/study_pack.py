@@ -0,0 +1,122 @@
+# agents/study_pack.py
+from utils.llm_clients import get_json_responses_from_llm, collect_json_items, estimate_tokens
+from utils.prompts import STUDY_PACK_PROMPT, STUDY_PACK_SECTION
+from utils.json_salvage import clean_flashcard, clean_quiz
+from agents.flashcard import flashcard_prompt, FLASHCARDS_PER_CHUNK
+from agents.quiz import quiz_prompt, QUIZZES_PER_CHUNK
+import os
+
+# Max input tokens of chunk text per request, and max chunks per request
+TOKEN_BUDGET = int(os.environ.get("STUDY_PACK_TOKEN_BUDGET", 3000))
+MAX_CHUNKS_PER_PACK = int(os.environ.get("STUDY_PACK_MAX_CHUNKS", 8))
+# Max output tokens per request: gemini-pro stops at 2048, and a response
+# cut off there loses its last sections, which are then retried one by one
+OUTPUT_TOKEN_BUDGET = int(os.environ.get("STUDY_PACK_OUTPUT_BUDGET", 2048))
+# Estimated output tokens of one flashcard, one quiz, and a section's own JSON
+FLASHCARD_OUTPUT_TOKENS = 50
+QUIZ_OUTPUT_TOKENS = 80
+SECTION_OUTPUT_TOKENS = 10
+
+def section_output_tokens():
+    """Expected output tokens of one section of a packed response."""
+    return SECTION_OUTPUT_TOKENS + FLASHCARDS_PER_CHUNK * FLASHCARD_OUTPUT_TOKENS + QUIZZES_PER_CHUNK * QUIZ_OUTPUT_TOKENS
+
+def chunks_per_pack(max_chunks=MAX_CHUNKS_PER_PACK, output_budget=OUTPUT_TOKEN_BUDGET):
+    """The most chunks per request: max_chunks, or fewer if their output wouldn't fit output_budget."""
+    return max(1, min(max_chunks, output_budget // section_output_tokens()))
+
+class StudyPackAgent:
+    """
+    Generates flashcards AND quizzes in a single LLM pass.
+    Small chunks are packed together into one prompt up to an input token
+    budget, and as many as the expected output fits, and the response is
+    split back out per chunk.
+    """
+    def __init__(self, token_budget=TOKEN_BUDGET, max_chunks=MAX_CHUNKS_PER_PACK, output_budget=OUTPUT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.max_chunks = chunks_per_pack(max_chunks, output_budget)
+        print("StudyPackAgent: Initialized.")
+
+    def generate(self, text_chunks):
+        """
+        Returns one {"flashcards": [...], "quizzes": [...]} dict per chunk,
+        in the same order as text_chunks.
+        """
+        results = [None] * len(text_chunks)
+        packs = self._pack_chunks(text_chunks)
+        print(f"StudyPackAgent: Packed {len(text_chunks)} chunks into {len(packs)} requests.")
+        self._run_packs(packs, text_chunks, results)
+
+        # Chunks the model skipped in a packed response are retried on their own
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            print(f"StudyPackAgent: Retrying {len(missing)} chunks missing from packed responses...")
+            self._run_packs([[i] for i in missing], text_chunks, results)
+
+        # Invalid items are dropped; chunks left short get a small follow-up
+        # request for just the missing flashcards or quizzes
+        results = [result or {"flashcards": [], "quizzes": []} for result in results]
+        flashcards = collect_json_items(text_chunks, [result["flashcards"] for result in results], FLASHCARDS_PER_CHUNK,
+                                        flashcard_prompt, clean_flashcard, "flashcard")
+        quizzes = collect_json_items(text_chunks, [result["quizzes"] for result in results], QUIZZES_PER_CHUNK,
+                                     quiz_prompt, clean_quiz, "quiz")
+        return [{"flashcards": cards, "quizzes": quiz_list} for cards, quiz_list in zip(flashcards, quizzes)]
+
+    def _pack_chunks(self, text_chunks):
+        """Groups consecutive chunk indices so each group fits the token budget and chunk limit."""
+        packs, current, current_tokens = [], [], 0
+        for i, chunk in enumerate(text_chunks):
+            tokens = estimate_tokens(chunk)
+            if current and (current_tokens + tokens > self.token_budget or len(current) >= self.max_chunks):
+                packs.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            packs.append(current)
+        return packs
+
+    def complete_packs(self, text_chunks):
+        """
+        How many of text_chunks, from the start, fill packs that chunks
+        arriving later can't change. Packing only depends on chunk order, so
+        generating those now makes the same prompts (and LLM cache keys)
+        however the chunks arrive; the rest waits for more chunks.
+        """
+        packs = self._pack_chunks(text_chunks)
+        if packs and len(packs[-1]) < self.max_chunks:
+            packs = packs[:-1]
+        return sum(len(pack) for pack in packs)
+
+    def _build_prompt(self, pack, text_chunks):
+        sections = "\n".join(
+            STUDY_PACK_SECTION.format(number=number, text_chunk=text_chunks[i])
+            for number, i in enumerate(pack, start=1)
+        )
+        return STUDY_PACK_PROMPT.format(sections=sections, flashcard_count=FLASHCARDS_PER_CHUNK, quiz_count=QUIZZES_PER_CHUNK)
+
+    def _run_packs(self, packs, text_chunks, results):
+        prompts = [self._build_prompt(pack, text_chunks) for pack in packs]
+        responses = get_json_responses_from_llm(prompts)
+
+        for pack, response_json in zip(packs, responses):
+            # (A single section that came back unwrapped is already a one-item list)
+            if not isinstance(response_json, list):
+                continue
+
+            for item in response_json:
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    number = int(item.get("section", 1 if len(pack) == 1 else 0))
+                except (TypeError, ValueError):
+                    continue
+                if not 1 <= number <= len(pack):
+                    continue
+
+                flashcards = item.get("flashcards")
+                quizzes = item.get("quizzes")
+                results[pack[number - 1]] = {
+                    "flashcards": flashcards if isinstance(flashcards, list) else [],
+                    "quizzes": quizzes if isinstance(quizzes, list) else []
+                }
@@ -0,0 +1,54 @@
+# answer_bank.py
+# Pre-generates an answer key for a question bank from the processed notes:
+#   python answer_bank.py questions.txt -o outputs/answers.jsonl
+# The input has one question per line (.txt), or one {"question": ...}
+# object per line (.jsonl). Answers are written as JSONL while they are
+# generated, in input order.
+import argparse
+import json
+import os
+import time
+from agents.doubt_agent import DoubtAgent, ANSWER_BATCH_SIZE
+
+def read_questions(path):
+    """Questions from a .txt (one per line) or .jsonl ({"question": ...} per line) file."""
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["question"] if path.endswith(".jsonl") else line)
+    return questions
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a question bank from your processed study material.")
+    parser.add_argument("questions", help="Question file: .txt (one per line) or .jsonl ({\"question\": ...} per line)")
+    parser.add_argument("-o", "--output", default="outputs/answers.jsonl", help="JSONL output file")
+    parser.add_argument("--batch-size", type=int, default=ANSWER_BATCH_SIZE, help="Questions per embedding/search/LLM batch")
+    parser.add_argument("-k", type=int, default=3, help="Chunks of context per question")
+    parser.add_argument("--concurrency", type=int, default=None, help="Max concurrent LLM calls")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+
+    agent = DoubtAgent()
+    start_time = time.time()
+    done = 0
+    with open(args.output, "w", encoding='utf-8') as out:
+        for result in agent.answer_questions(questions, k=args.k, batch_size=args.batch_size, max_concurrency=args.concurrency):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            done += 1
+            if done % args.batch_size == 0:
+                out.flush()
+                elapsed = time.time() - start_time
+                print(f"Answer Bank: {done}/{len(questions)} questions ({done / elapsed:.1f} questions/sec)")
+
+    elapsed = time.time() - start_time
+    rate = done / elapsed if elapsed else 0.0
+    print(f"Answer Bank: Answered {done} questions in {elapsed:.2f} seconds ({rate:.1f} questions/sec).")
+    print(f"Answer Bank: Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,170 +1,293 @@
-# app.py
-import streamlit as st
-import json
-import os
-import pandas as pd
-from main import run_study_pipeline, UPLOAD_DIR
-from agents.doubt_agent import DoubtAgent
-from agents.planner import PlannerAgent
-from utils.database import get_all_quizzes_for_ui, record_quiz_result, DB_FILE
-
-# File paths for outputs
-FLASHCARD_FILE = "outputs/flashcards.json"
-PLAN_FILE = "outputs/planner.json"
-
-st.set_page_config(layout="wide")
-st.title("🧠 Autonomous Study Workflow Agent (Full Version)")
-
-# --- 1. PDF UPLOAD ---
-st.subheader("1. Upload Your Study Material")
-uploaded_file = st.file_uploader("Upload Your Notes (PDF, Scans, Text)", type="pdf")
-
-if uploaded_file:
-    st.write(f"File '{uploaded_file.name}' uploaded successfully!")
-    
-    # Save the file to a known path
-    temp_pdf_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
-    with open(temp_pdf_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-
-    if st.button("Generate Study Materials"):
-        with st.spinner("Your AI agents are hard at work... Reading (with OCR), creating flashcards, building quizzes, and planning your revision..."):
-            success = run_study_pipeline(temp_pdf_path)
-        
-        if success:
-            st.success("Your study materials are ready!")
-            # Initialize the DoubtAgent in session state after processing
-            st.session_state.doubt_agent = DoubtAgent()
-            st.session_state.quizzes = get_all_quizzes_for_ui()
-            st.rerun()
-        else:
-            st.error("There was an error processing your file. Please try again.")
-
-# --- 2. DISPLAY TABS ---
-st.subheader("2. Your Generated Study Hub")
-
-# Check if DB exists to show tabs
-if not os.path.exists(DB_FILE):
-    st.info("Upload a PDF and click 'Generate' to see your materials.")
-else:
-    # Initialize agents and quiz data if not already in state
-    if 'doubt_agent' not in st.session_state:
-        st.session_state.doubt_agent = DoubtAgent()
-    if 'quizzes' not in st.session_state:
-        st.session_state.quizzes = get_all_quizzes_for_ui()
-
-    tab1, tab2, tab3, tab4 = st.tabs(["❓ Ask a Doubt", "💡 Flashcards", "📝 Smart Quiz", "🗓️ Smart Revision Plan"])
-
-    # --- DOUBT AGENT TAB ---
-    with tab1:
-        st.header("Ask a Question About Your Notes")
-        query = st.text_input("What concept do you need clarified?", key="doubt_query")
-        
-        if query:
-            with st.spinner("Finding the answer in your notes..."):
-                answer = st.session_state.doubt_agent.answer_question(query)
-                st.markdown(answer)
-
-    # --- FLASHCARD TAB (from hint) ---
-    with tab2:
-        st.header("Generated Flashcards")
-        try:
-            with open(FLASHCARD_FILE) as f:
-                cards = json.load(f)
-            
-            if 'card_index' not in st.session_state:
-                st.session_state.card_index = 0
-            
-            if not cards:
-                st.warning("No flashcards were generated.")
-            else:
-                card = cards[st.session_state.card_index]
-                
-                with st.container(border=True):
-                    if 'show_answer' not in st.session_state:
-                        st.session_state.show_answer = False
-                    
-                    st.markdown(f"**Q:** {card['question']}")
-                    
-                    if st.button("Show Answer", key=f"show_{st.session_state.card_index}"):
-                        st.session_state.show_answer = not st.session_state.show_answer
-                    
-                    if st.session_state.show_answer:
-                        st.markdown(f"**A:** {card['answer']}")
-                
-                col1, col2, col3 = st.columns([1,1,1])
-                with col1:
-                    if st.button("⬅️ Previous") and st.session_state.card_index > 0:
-                        st.session_state.card_index -= 1
-                        st.session_state.show_answer = False
-                        st.rerun()
-                with col3:
-                    if st.button("Next ➡️") and st.session_state.card_index < len(cards) - 1:
-                        st.session_state.card_index += 1
-                        st.session_state.show_answer = False
-                        st.rerun()
-                
-                st.markdown(f"Card {st.session_state.card_index + 1} of {len(cards)}")
-
-        except Exception as e:
-            st.error(f"Could not load flashcards: {e}")
-
-    # --- QUIZ TAB (Smart) ---
-    with tab3:
-        st.header("Smart Quiz")
-        st.write("Your answers here will update your Smart Revision Plan!")
-        
-        quizzes = st.session_state.quizzes
-        if not quizzes:
-            st.warning("No quiz questions were found in the database.")
-        else:
-            with st.form("quiz_form"):
-                user_answers = {}
-                for i, q in enumerate(quizzes):
-                    st.markdown(f"**Q{i+1}: {q['question']}**")
-                    # Use question ID as the key
-                    user_answers[q['id']] = st.radio("Choose one:", q['options'], key=f"quiz_{q['id']}", index=None)
-                    st.markdown("---")
-                
-                submitted = st.form_submit_button("Submit Quiz")
-
-            if submitted:
-                correct_count = 0
-                total_count = len(quizzes)
-                
-                for q_id, user_choice in user_answers.items():
-                    # Find the correct answer from our quiz list
-                    correct_answer = next(q['answer'] for q in quizzes if q['id'] == q_id)
-                    is_correct = (user_choice == correct_answer)
-                    
-                    if is_correct:
-                        correct_count += 1
-                    
-                    # Record the result in the database
-                    record_quiz_result(q_id, is_correct)
-                
-                st.success(f"Quiz Submitted! You got {correct_count} out of {total_count} correct.")
-                st.info("Your performance has been saved. Your Revision Plan will be updated next time you generate it.")
-
-    # --- PLANNER TAB (Smart) ---
-    with tab4:
-        st.header("Your Smart Revision Plan")
-        st.write("This plan prioritizes topics based on your quiz performance (worst topics first).")
-        
-        if st.button("Refresh Revision Plan"):
-            with st.spinner("Updating plan based on your latest quiz results..."):
-                planner = PlannerAgent()
-                planner.generate_smart_plan()
-                st.rerun()
-
-        try:
-            with open(PLAN_FILE) as f:
-                plan = json.load(f)
-            
-            if not plan:
-                st.warning("No revision plan was generated.")
-            else:
-                df = pd.DataFrame(plan)
-                st.dataframe(df, use_container_width=True)
-        except Exception as e:
+# app.py
+import streamlit as st
+import json
+import os
+import hashlib
+import threading
+import pandas as pd
+from main import UPLOAD_DIR
+from worker import launch_worker_pool, JOB_WORKERS
+from agents.doubt_agent import DoubtAgent
+from agents.planner import PlannerAgent
+from agents.reader import ReaderAgent
+from utils.registry import list_documents
+from utils.answer_cache import answer_cache
+from utils.jobs import enqueue_job, get_job
+from utils.metrics import start_metrics_server
+from utils.database import (initialize_database, get_quizzes_page, record_quiz_results, count_due, QUIZ_PAGE_SIZE, DB_FILE,
+                            flashcard_deck, flashcard_position, get_flashcard, get_adjacent_flashcard, record_reviews)
+from utils.scheduler import quality_from_result
+
+# File paths for outputs
+PLAN_FILE = "outputs/planner.json"
+
+st.set_page_config(layout="wide")
+st.title("🧠 Autonomous Study Workflow Agent (Full Version)")
+
+# --- 1. PDF UPLOAD ---
+st.subheader("1. Upload Your Study Material")
+uploaded_file = st.file_uploader("Upload Your Notes (PDF, Scans, Text)", type="pdf")
+
+if uploaded_file:
+    st.write(f"File '{uploaded_file.name}' uploaded successfully!")
+    
+    # Save the file to a known path (one folder per content, so two users
+    # uploading different files with the same name don't overwrite each other)
+    upload_dir = os.path.join(UPLOAD_DIR, hashlib.sha256(uploaded_file.getbuffer()).hexdigest()[:16])
+    os.makedirs(upload_dir, exist_ok=True)
+    temp_pdf_path = os.path.join(upload_dir, uploaded_file.name)
+    with open(temp_pdf_path, "wb") as f:
+        f.write(uploaded_file.getbuffer())
+
+    if st.button("Generate Study Materials"):
+        # Runs on a background worker; progress is polled below
+        job_id = enqueue_job(temp_pdf_path)
+        st.session_state.setdefault("job_ids", []).append(job_id)
+        st.toast(f"Queued '{uploaded_file.name}' for processing.")
+
+@st.cache_resource
+def _start_background_workers():
+    # Once per app process; with JOB_WORKERS=0, run `python worker.py` separately
+    return launch_worker_pool(JOB_WORKERS) if JOB_WORKERS > 0 else None
+
+_start_background_workers()
+# Prometheus endpoint for this process (doubt answering), if METRICS_PORT is set
+st.cache_resource(start_metrics_server)()
+
+@st.fragment(run_every=2)
+def show_jobs():
+    """Status of this session's pipeline jobs, refreshed every couple of seconds."""
+    jobs = [job for job in map(get_job, st.session_state.get("job_ids", [])) if job]
+    if not jobs:
+        return
+    for job in jobs:
+        name = job["document_name"]
+        if job["status"] == "queued":
+            st.info(f"⏳ {name}: waiting for a worker...")
+        elif job["status"] == "running":
+            if job["stage"] == "extract" and job["total"]:
+                st.progress(job["done"] / job["total"], text=f"📖 {name}: reading pages ({job['message']})")
+            else:
+                st.caption(f"⚙️ {name}: {job['message'] or 'starting...'}")
+        elif job["status"] == "done":
+            st.success(f"✅ {name}: your study materials are ready! ({job['message']})")
+        else:
+            st.error(f"❌ {name}: there was an error processing your file ({job['error']}). Please try again.")
+
+    # Refresh the study hub once when a job finishes
+    finished = {job["id"] for job in jobs if job["status"] == "done"}
+    if finished - st.session_state.get("jobs_seen_done", set()):
+        st.session_state.jobs_seen_done = finished
+        st.session_state.quiz_cursors = [None]  # Back to the first quiz page
+        st.rerun()
+
+show_jobs()
+
+# --- YOUR LIBRARY (all uploaded documents are searchable together) ---
+with st.sidebar:
+    st.header("📚 Your Library")
+    documents = list_documents()
+    if not documents:
+        st.caption("No documents yet.")
+    for name, chunk_count in documents:
+        col1, col2 = st.columns([4, 1])
+        col1.write(f"{name} ({chunk_count} chunks)")
+        if col2.button("🗑️", key=f"delete_{name}"):
+            ReaderAgent().delete_document(name)
+            st.rerun()
+
+# --- 2. DISPLAY TABS ---
+st.subheader("2. Your Generated Study Hub")
+
+# Check if DB exists to show tabs
+if not os.path.exists(DB_FILE):
+    st.info("Upload a PDF and click 'Generate' to see your materials.")
+else:
+    # Bring an existing database up to the current schema (once per process)
+    st.cache_resource(initialize_database)()
+
+    # Initialize agents if not already in state
+    # (cheap: models and the vector store are shared across sessions)
+    if 'doubt_agent' not in st.session_state:
+        st.session_state.doubt_agent = DoubtAgent()
+
+    tab1, tab2, tab3, tab4 = st.tabs(["❓ Ask a Doubt", "💡 Flashcards", "📝 Smart Quiz", "🗓️ Smart Revision Plan"])
+
+    # --- DOUBT AGENT TAB ---
+    with tab1:
+        st.header("Ask a Question About Your Notes")
+        query = st.text_input("What concept do you need clarified?", key="doubt_query")
+        
+        if query:
+            # Editing the query reruns the script: stop streaming the previous answer
+            if 'doubt_cancel' in st.session_state:
+                st.session_state.doubt_cancel.set()
+            cancel_event = threading.Event()
+            st.session_state.doubt_cancel = cancel_event
+
+            # Render the answer as it is generated
+            answer_box = st.empty()
+            answer_box.caption("Finding the answer in your notes...")
+            answer = ""
+            for piece in st.session_state.doubt_agent.answer_question(query, stream=True, cancel_event=cancel_event):
+                answer += piece
+                answer_box.markdown(answer + "▌")
+            answer_box.markdown(answer)
+
+            metrics = st.session_state.doubt_agent.last_metrics
+            cache_stats = answer_cache.stats()
+            if metrics.get("total_s") is not None:
+                st.caption(f"First words after {metrics['ttft_s'] or 0:.2f}s, full answer in {metrics['total_s']:.2f}s · "
+                           f"Answer cache: {cache_stats['hit_rate']:.0%} hit rate, "
+                           f"{cache_stats['latency_saved_s']:.1f}s of LLM time saved")
+
+    # --- FLASHCARD TAB (from hint) ---
+    with tab2:
+        st.header("Generated Flashcards")
+        try:
+            # Only the card on screen is read from the database
+            total_cards, deck_version = flashcard_deck()
+            if 'card_id' in st.session_state and st.session_state.get('deck_version') != deck_version:
+                # Cards were added or deleted since the position was worked out
+                position = flashcard_position(st.session_state.card_id)
+                if position is None:
+                    del st.session_state.card_id
+                else:
+                    st.session_state.card_index = position
+            st.session_state.deck_version = deck_version
+            card = get_flashcard(card_id=st.session_state.card_id) if 'card_id' in st.session_state else None
+            if card is None:
+                card = get_flashcard(position=0)
+                st.session_state.card_index = 0
+            
+            if card is None:
+                st.warning("No flashcards were generated.")
+            else:
+                st.session_state.card_id = card['id']
+                
+                with st.container(border=True):
+                    if 'show_answer' not in st.session_state:
+                        st.session_state.show_answer = False
+                    
+                    st.markdown(f"**Q:** {card['question']}")
+                    
+                    if st.button("Show Answer", key=f"show_{card['id']}"):
+                        st.session_state.show_answer = not st.session_state.show_answer
+                    
+                    if st.session_state.show_answer:
+                        st.markdown(f"**A:** {card['answer']}")
+                        # Self-grading schedules the card's next spaced-repetition review
+                        grade1, grade2 = st.columns([1,1])
+                        for column, label, knew_it in ((grade1, "😕 Forgot", False), (grade2, "🙂 Knew it", True)):
+                            if column.button(label, key=f"grade_{card['id']}_{knew_it}"):
+                                record_reviews('flashcard', [(card['id'], quality_from_result(knew_it))])
+                                st.toast("Review saved!")
+                
+                col1, col2, col3 = st.columns([1,1,1])
+                with col1:
+                    if st.button("⬅️ Previous"):
+                        previous_card = get_adjacent_flashcard(card['id'], -1)
+                        if previous_card:
+                            st.session_state.card_id = previous_card['id']
+                            st.session_state.card_index -= 1
+                            st.session_state.show_answer = False
+                            st.rerun()
+                with col3:
+                    if st.button("Next ➡️"):
+                        next_card = get_adjacent_flashcard(card['id'], 1)
+                        if next_card:
+                            st.session_state.card_id = next_card['id']
+                            st.session_state.card_index += 1
+                            st.session_state.show_answer = False
+                            st.rerun()
+                
+                st.markdown(f"Card {st.session_state.card_index + 1} of {total_cards}")
+
+        except Exception as e:
+            st.error(f"Could not load flashcards: {e}")
+
+    # --- QUIZ TAB (Smart) ---
+    with tab3:
+        st.header("Smart Quiz")
+        st.write("Your answers here will update your Smart Revision Plan!")
+        
+        # Show a fixed-size page at a time: the whole bank, or just the questions due for review
+        quiz_mode = st.radio("Questions:", ["All questions", "Due for review"], horizontal=True, key="quiz_mode")
+        if st.session_state.get('quiz_cursors_mode') != quiz_mode:
+            # Keyset cursors of the pages visited so far, so "Previous" can go back
+            st.session_state.quiz_cursors = [None]
+            st.session_state.quiz_cursors_mode = quiz_mode
+        page_number = len(st.session_state.quiz_cursors) - 1
+        quizzes, next_cursor = get_quizzes_page(st.session_state.quiz_cursors[-1], limit=QUIZ_PAGE_SIZE,
+                                                due_only=quiz_mode == "Due for review")
+        if not quizzes:
+            st.warning("No quiz questions were found in the database.")
+        else:
+            with st.form("quiz_form"):
+                user_answers = {}
+                for i, q in enumerate(quizzes):
+                    st.markdown(f"**Q{page_number * QUIZ_PAGE_SIZE + i + 1}: {q['question']}**")
+                    # Use question ID as the key
+                    user_answers[q['id']] = st.radio("Choose one:", q['options'], key=f"quiz_{q['id']}", index=None)
+                    st.markdown("---")
+                
+                submitted = st.form_submit_button("Submit Quiz")
+
+            col1, col2, col3 = st.columns([1,1,1])
+            with col1:
+                if page_number > 0 and st.button("⬅️ Previous page"):
+                    st.session_state.quiz_cursors.pop()
+                    st.rerun()
+            with col3:
+                if next_cursor is not None and st.button("Next page ➡️"):
+                    st.session_state.quiz_cursors.append(next_cursor)
+                    st.rerun()
+
+            if submitted:
+                correct_count = 0
+                total_count = len(quizzes)
+                results = []
+                quizzes_by_id = {q['id']: q for q in quizzes}
+                
+                for q_id, user_choice in user_answers.items():
+                    # Look up the correct answer by question ID
+                    correct_answer = quizzes_by_id[q_id]['answer']
+                    is_correct = (user_choice == correct_answer)
+                    
+                    if is_correct:
+                        correct_count += 1
+                    results.append((q_id, is_correct))
+                
+                # Record the whole submission in one database transaction
+                record_quiz_results(results)
+                
+                st.success(f"Quiz Submitted! You got {correct_count} out of {total_count} correct.")
+                st.info("Your performance has been saved. Your Revision Plan will be updated next time you generate it.")
+
+    # --- PLANNER TAB (Smart) ---
+    with tab4:
+        st.header("Your Smart Revision Plan")
+        st.write("This plan prioritizes topics based on your quiz performance (worst topics first).")
+
+        # Spaced repetition: questions whose next review is due
+        due_count = count_due(item_type='quiz')
+        if due_count:
+            st.info(f"🔔 {due_count} questions are due for review now. Take the Smart Quiz to keep them fresh!")
+        
+        if st.button("Refresh Revision Plan"):
+            with st.spinner("Updating plan based on your latest quiz results..."):
+                planner = PlannerAgent()
+                planner.generate_smart_plan()
+                st.rerun()
+
+        try:
+            with open(PLAN_FILE) as f:
+                plan = json.load(f)
+            
+            if not plan:
+                st.warning("No revision plan was generated.")
+            else:
+                df = pd.DataFrame(plan)
+                st.dataframe(df, use_container_width=True)
+        except Exception as e:
             st.error(f"Could not load plan: {e}")
\ No newline at end of file
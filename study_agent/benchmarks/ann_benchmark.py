@@ -0,0 +1,88 @@
+# benchmarks/ann_benchmark.py
+# Recall@k vs query latency of the approximate indexes VectorStore switches to
+# for large corpora, against the exact flat baseline.
+# Run from the study_agent folder:
+#   python -m benchmarks.ann_benchmark --n 200000 --dim 384
+import argparse
+import json
+import time
+import numpy as np
+from utils.vector_store import build_index, choose_index_params, apply_search_params, ivf_nlist
+
+def make_corpus(n, dim, n_queries, seed=0):
+    """Clustered synthetic embeddings (topics), normalized like sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype('float32')
+    corpus = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.standard_normal((n, dim)).astype('float32')
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = corpus[rng.integers(0, n, n_queries)] + 0.05 * rng.standard_normal((n_queries, dim)).astype('float32')
+    return corpus, queries.astype('float32')
+
+def run_queries(index, queries, k):
+    """Queries one at a time (like DoubtAgent does); returns (ids, latencies in ms)."""
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append(found[0])
+    return np.array(ids), np.array(latencies)
+
+def recall_at_k(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k vs latency of flat, HNSW and IVF indexes.")
+    parser.add_argument("--n", type=int, default=200_000, help="corpus size (chunks)")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension (all-MiniLM-L6-v2 = 384)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3, help="DoubtAgent retrieves k=3")
+    parser.add_argument("--json", help="optional path to write the results to")
+    args = parser.parse_args()
+
+    corpus, queries = make_corpus(args.n, args.dim, args.queries)
+    ids = np.arange(args.n, dtype='int64')
+    print(f"Corpus: {args.n} x {args.dim}, {args.queries} queries, k={args.k}")
+    print(f"Auto-selected for this size: {choose_index_params(args.n)}")
+
+    # Same nlist rule VectorStore uses for IVF, applied at this corpus size
+    nlist = ivf_nlist(args.n)
+    candidates = [("flat (exact)", {"type": "flat"})]
+    candidates += [(f"hnsw efSearch={ef}", {"type": "hnsw", "M": 32, "ef_construction": 200, "ef_search": ef}) for ef in (32, 64, 128, 256)]
+    candidates += [(f"ivf nlist={nlist} nprobe={p}", {"type": "ivf", "nlist": nlist, "nprobe": p}) for p in (4, 8, 16, 32)]
+
+    results, truth, built = [], None, {}
+    for name, params in candidates:
+        # Same build for every search setting of a type; only search params change
+        build_key = (params["type"], params.get("M"), params.get("nlist"))
+        if build_key not in built:
+            start = time.perf_counter()
+            built[build_key] = build_index(params, args.dim, corpus, ids)
+            build_seconds = time.perf_counter() - start
+        else:
+            build_seconds = None
+        index = built[build_key]
+        apply_search_params(index, params)
+
+        found, latencies = run_queries(index, queries, args.k)
+        if truth is None:
+            truth = found  # The flat index is the ground truth
+        row = {
+            "index": name,
+            "params": params,
+            "build_s": round(build_seconds, 2) if build_seconds is not None else None,
+            "recall_at_k": round(recall_at_k(found, truth), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        }
+        results.append(row)
+        build = f"{row['build_s']}s" if row['build_s'] is not None else "(reused)"
+        print(f"{name:28s} recall@{args.k}={row['recall_at_k']:.4f}  p50={row['p50_ms']:.3f}ms  "
+              f"p99={row['p99_ms']:.3f}ms  build={build}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"n": args.n, "dim": args.dim, "k": args.k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
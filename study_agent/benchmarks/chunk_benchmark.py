@@ -0,0 +1,203 @@
+# benchmarks/chunk_benchmark.py
+# Chunking benchmark that runs fully offline: synthetic PDFs with headings,
+# paragraphs of mixed length and short list items are chunked at several
+# token targets, and with the previous line-based extraction and chunking
+# for comparison. Reports the chunk-size distribution, how much text each
+# setting loses, and (unless --no-e2e) the LLM and embedding calls the
+# whole pipeline makes with it, using the fake LLM and embedding model.
+# Run from the study_agent folder:
+#   python -m benchmarks.chunk_benchmark --pages 50 --targets 150,300,600
+#   python -m benchmarks.chunk_benchmark --pages 200 --no-e2e --json chunks.json
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from unittest import mock
+from benchmarks.pipeline_benchmark import VOCABULARY, FILLER, synthetic_page, make_pdf, percentiles, stage
+
+def structured_page(rng):
+    """
+    A numbered heading, then paragraphs of mixed length, some followed by a
+    short bullet list. One page in ten is a chapter title page: a heading
+    and a one-line summary.
+    """
+    heading = f"{rng.randint(1, 20)}.{rng.randint(1, 9)} {' '.join(rng.sample(VOCABULARY, 2)).title()}"
+    if rng.random() < 0.1:
+        return f"{heading}\n\nIn this chapter: {', '.join(rng.sample(VOCABULARY, 3))}."
+    blocks = [heading]
+    for _ in range(rng.randint(2, 4)):
+        blocks.append(synthetic_page(rng, paragraphs=1, words=rng.randint(15, 80)))
+        if rng.random() < 0.5:
+            blocks.append("\n".join(f"- {term}: {' '.join(rng.sample(FILLER + VOCABULARY, 5))}"
+                                    for term in rng.sample(VOCABULARY, rng.randint(2, 4))))
+    return "\n\n".join(blocks)
+
+# --- The extraction clean-up and chunking used before block-based chunking ---
+def legacy_page_text(page):
+    return page.get_text().strip()
+
+def legacy_clean_text(text):
+    text = re.sub(r'\s*\n\s*', '\n', text)
+    return re.sub(r'(\w)-\n(\w)', r'\1\2', text)
+
+def legacy_chunk_text(text, min_chunk_size=100):
+    chunks = [c.strip() for c in text.split("\n\n") if len(c.strip()) > min_chunk_size]
+    if not chunks and text:
+        chunks = [c.strip() for c in text.split("\n") if len(c.strip()) > min_chunk_size]
+    return chunks
+
+def setting_name(target):
+    return "legacy" if target is None else f"target-{target}"
+
+def chunk_pages(pdf_path, target, overlap):
+    """
+    Returns (page texts, chunks per page, seconds spent chunking) for one
+    setting. The page texts are always the block-based ones, so every
+    setting is measured against all of the page's text.
+    """
+    import fitz
+    from utils.pdf_utils import _page_blocks_text, clean_text
+    from utils.chunker import chunk_text
+
+    texts, page_chunks, seconds = [], [], 0.0
+    doc = fitz.open(pdf_path)
+    try:
+        for page in doc:
+            text = clean_text(_page_blocks_text(page))
+            start = time.perf_counter()
+            if target is None:
+                chunks = legacy_chunk_text(legacy_clean_text(legacy_page_text(page)))
+            else:
+                chunks = chunk_text(text, target, overlap)
+            seconds += time.perf_counter() - start
+            texts.append(text)
+            page_chunks.append(chunks)
+    finally:
+        doc.close()
+    return texts, page_chunks, seconds
+
+def chunk_stats(texts, page_chunks, seconds):
+    from utils.llm_clients import estimate_tokens
+    sizes = [estimate_tokens(chunk) for chunks in page_chunks for chunk in chunks]
+    words = sum(len(text.split()) for text in texts)
+    # Words of the page that no chunk contains (overlap doesn't make up for them)
+    dropped = sum(sum((collections.Counter(text.split()) - collections.Counter(" ".join(chunks).split())).values())
+                  for text, chunks in zip(texts, page_chunks))
+    return {
+        "chunks": len(sizes),
+        "chunks_per_page": round(len(sizes) / max(1, len(texts)), 2),
+        "chunk_tokens": {"min": min(sizes, default=0), **percentiles(sizes)},
+        "chunks_under_50_tokens": sum(size < 50 for size in sizes),
+        # Chunk tokens per token of page text (above 1 because of the overlap)
+        "token_ratio": round(sum(sizes) / max(1, sum(estimate_tokens(text) for text in texts)), 3),
+        "words_dropped_pct": round(100 * dropped / max(1, words), 2),
+        "chunk_ms_per_page": round(1000 * seconds / max(1, len(texts)), 3),
+    }
+
+def bench_e2e(pdf_path, target, verbose):
+    """Runs the whole pipeline with one chunking setting and counts the calls it makes."""
+    import agents.reader as reader
+    import utils.chunker as chunker
+    import utils.pdf_utils as pdf_utils
+    from main import run_study_pipeline
+    from utils import metrics
+    from utils.registry import get_llm_model
+
+    if target is None:
+        # Its own extraction version keeps the legacy page texts apart in the page cache
+        patches = [mock.patch.object(pdf_utils, "_page_blocks_text", legacy_page_text),
+                   mock.patch.object(pdf_utils, "EXTRACTION_VERSION", "legacy"),
+                   mock.patch.object(reader, "clean_text", legacy_clean_text),
+                   mock.patch.object(reader, "chunk_text", legacy_chunk_text),
+                   mock.patch.object(reader, "chunk_settings", lambda: "legacy")]
+    else:
+        patches = [mock.patch.object(chunker, "CHUNK_TARGET_TOKENS", target)]
+
+    llm = get_llm_model()
+    calls_before = llm.calls
+    with stage(verbose), metrics.run_metrics() as run_registry:
+        for patch in patches:
+            patch.start()
+        try:
+            start = time.perf_counter()
+            success = run_study_pipeline(pdf_path)
+            elapsed = time.perf_counter() - start
+        finally:
+            for patch in patches:
+                patch.stop()
+
+    report = run_registry.report()
+    counters, histograms = report["counters"], report["histograms"]
+    return {
+        "success": success,
+        "seconds": round(elapsed, 3),
+        "llm_calls": llm.calls - calls_before,
+        "llm_prompt_chars": int(histograms.get("llm_prompt_chars", {}).get("sum", 0)),
+        "embeddings": counters.get('embeddings_total{source="model"}', 0),
+        "flashcards": counters.get("flashcards_added_total", 0),
+        "quizzes": counters.get("quizzes_stored_total", 0),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk-size distribution and pipeline call counts per chunking setting.")
+    parser.add_argument("--pages", type=int, default=50, help="pages in the synthetic document")
+    parser.add_argument("--targets", default="150,300,600", help="comma-separated CHUNK_TARGET_TOKENS values to compare")
+    parser.add_argument("--overlap", type=int, default=None, help="CHUNK_OVERLAP_TOKENS (default: the configured value)")
+    parser.add_argument("--no-legacy", action="store_true", help="skip the previous line-based chunking")
+    parser.add_argument("--no-e2e", action="store_true", help="only chunk; don't run the pipeline")
+    parser.add_argument("--separate-prompts", action="store_true", help="COMBINED_GENERATION=0: one prompt per chunk per agent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="optional path to write the results to")
+    parser.add_argument("--verbose", action="store_true", help="show the agents' console output")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # Fresh databases and caches in a scratch folder; the project's modules
+    # resolve these paths (and read the settings below) when imported
+    workdir = tempfile.mkdtemp(prefix="chunk_benchmark_")
+    sys.path.insert(0, os.getcwd())
+    os.chdir(workdir)
+    os.environ.update({
+        "LLM_BACKEND": "fake", "EMBEDDING_BACKEND": "fake",
+        "FAKE_LLM_LATENCY": "0.01", "FAKE_LLM_TOKEN_DELAY": "0",
+        "LLM_CACHE_DISABLED": "1",  # Identical chunks across settings must still cost a call
+        "NEAR_DUP_DISABLED": "1",  # Nor may they be routed to the previous setting's topics
+        "PDF_WORKERS": "1",  # Extraction in this process, where the legacy setting is patched in
+        "COMBINED_GENERATION": "0" if args.separate_prompts else "1",
+        "METRICS_ENABLED": "1", "METRICS_REPORT_DIR": os.path.join(workdir, "reports"),
+    })
+    if args.overlap is not None:
+        os.environ["CHUNK_OVERLAP_TOKENS"] = str(args.overlap)
+    from utils.chunker import CHUNK_OVERLAP_TOKENS as overlap
+
+    targets = ([] if args.no_legacy else [None]) + [int(target) for target in args.targets.split(",")]
+    pdf_path = os.path.join(workdir, "structured.pdf")
+    make_pdf(pdf_path, args.pages, seed=args.seed, make_page=structured_page)
+    print(f"Benchmark: {args.pages} structured pages, targets {args.targets}, overlap {overlap} (scratch folder {workdir})")
+
+    results = {"config": {"pages": args.pages, "targets": args.targets, "overlap": overlap,
+                          "combined_generation": not args.separate_prompts, "seed": args.seed},
+               "chunking": {}, "pipeline": {}}
+    for target in targets:
+        name = setting_name(target)
+        stats = results["chunking"][name] = chunk_stats(*chunk_pages(pdf_path, target, overlap))
+        print(f"  chunking {name}: {stats['chunks']} chunks, tokens p50 {stats['chunk_tokens']['p50']} / "
+              f"max {stats['chunk_tokens']['max']}, {stats['words_dropped_pct']}% of words dropped")
+    if not args.no_e2e:
+        for target in targets:
+            name = setting_name(target)
+            run = results["pipeline"][name] = bench_e2e(pdf_path, target, args.verbose)
+            print(f"  pipeline {name}: {run['llm_calls']} LLM calls, {run['embeddings']} embeddings, "
+                  f"{run['flashcards']} flashcards, {run['quizzes']} quizzes in {run['seconds']}s")
+
+    print(json.dumps(results, indent=2))
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
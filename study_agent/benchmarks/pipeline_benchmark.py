@@ -0,0 +1,316 @@
+# benchmarks/pipeline_benchmark.py
+# End-to-end benchmark that runs fully offline: synthetic text and scanned
+# PDFs go through run_study_pipeline with the fake LLM and fake embedding
+# model (plus a revised edition of the text PDF, which should mostly be
+# routed to the existing topics as near-duplicates), followed by doubt answering, quiz submissions and revision
+# planning. Reports throughput, latency percentiles and peak RSS per stage,
+# and can compare the results against a saved baseline.
+# Run from the study_agent folder:
+#   python -m benchmarks.pipeline_benchmark --pages 10,100 --json results.json
+#   python -m benchmarks.pipeline_benchmark --pages 10,100 --baseline results.json
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+
+VOCABULARY = (
+    "photosynthesis chlorophyll glucose enzyme membrane osmosis diffusion mitochondria respiration nucleus "
+    "protein ribosome chromosome mutation evolution selection ecosystem population predator habitat "
+    "velocity acceleration momentum friction gravity energy voltage current resistance magnetism "
+    "equation derivative integral matrix vector probability variance theorem proof function "
+    "revolution empire treaty parliament economy industry trade colony constitution democracy"
+).split()
+FILLER = "the a of and in is to that by for with as its which are from this".split()
+
+# Results compared against a baseline, by key suffix: (suffix, lower is better?, ignore changes smaller than)
+METRIC_RULES = (("per_s", False, 0.0), ("seconds", True, 0.01), ("_ms", True, 1.0), ("rss_mb", True, 5.0))
+
+def synthetic_page(rng, paragraphs=3, words=70):
+    """A few paragraphs of study-like text; each page leans on a handful of topic words."""
+    topic = rng.sample(VOCABULARY, 6)
+    return "\n\n".join(
+        " ".join(rng.choice(topic) if rng.random() < 0.4 else rng.choice(FILLER + VOCABULARY) for _ in range(words)).capitalize() + "."
+        for _ in range(paragraphs)
+    )
+
+def revised_pages(seed):
+    """
+    make_page for a revised edition of a synthetic_page document: the same
+    pages, plus a running header and a page-number footer, with one word
+    changed per page.
+    """
+    edits = random.Random(seed)
+    numbers = itertools.count(1)
+    def make_page(rng):
+        words = synthetic_page(rng).split(" ")
+        position = edits.randrange(len(words))
+        if "\n" not in words[position]:
+            words[position] = edits.choice(VOCABULARY)
+        return f"Course Notes - Revised Edition\n\n{' '.join(words)}\n\nPage {next(numbers)}"
+    return make_page
+
+def make_pdf(path, pages, scanned=False, seed=0, make_page=synthetic_page):
+    """
+    Writes a synthetic PDF with make_page(rng)'s text on each page (blank
+    lines separate blocks). Scanned pages are images of the text (no text
+    layer), so they go through OCR.
+    """
+    import fitz
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        text = make_page(rng)
+        page = doc.new_page()
+        # Nothing is written if the text doesn't fit, so shrink the font until it does
+        for fontsize in (11, 9, 7):
+            if page.insert_textbox(page.rect + (50, 50, -50, -50), text, fontsize=fontsize) >= 0:
+                break
+        if scanned:
+            pixmap = page.get_pixmap(dpi=100)
+            doc.delete_page(-1)
+            page = doc.new_page()
+            page.insert_image(page.rect, pixmap=pixmap)
+    doc.save(path)
+    doc.close()
+
+def percentiles(values):
+    values = np.array(values) if len(values) else np.zeros(1)
+    return {"p50": round(float(np.percentile(values, 50)), 3), "p95": round(float(np.percentile(values, 95)), 3),
+            "p99": round(float(np.percentile(values, 99)), 3), "max": round(float(values.max()), 3)}
+
+def reset_peak_rss():
+    """Restarts the kernel's peak-RSS counter (Linux), so each stage reports its own peak."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # Peak over the whole process (kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+@contextlib.contextmanager
+def stage(verbose):
+    """Runs a stage with a fresh peak-RSS counter, hiding the agents' console output unless verbose."""
+    reset_peak_rss()
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        yield
+
+def bench_pipeline(pdf_path, verbose):
+    from main import run_study_pipeline
+    from utils import metrics
+    from utils.registry import get_llm_model
+
+    llm = get_llm_model()
+    calls_before, failures_before, truncations_before = llm.calls, llm.failures, llm.truncations
+    with stage(verbose), metrics.run_metrics() as run_registry:
+        start = time.perf_counter()
+        success = run_study_pipeline(pdf_path)
+        elapsed = time.perf_counter() - start
+        rss = peak_rss_mb()
+
+    report = run_registry.report()
+    counters, histograms = report["counters"], report["histograms"]
+    pages = sum(value for key, value in counters.items() if key.startswith("pdf_pages_total"))
+    return {
+        "success": success,
+        "seconds": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 2),
+        "pages": {key.split('"')[1]: value for key, value in counters.items() if key.startswith("pdf_pages_total")},
+        "flashcards": counters.get("flashcards_added_total", 0),
+        "quizzes": counters.get("quizzes_stored_total", 0),
+        "llm_calls": llm.calls - calls_before,
+        "llm_failures": llm.failures - failures_before,
+        "llm_truncations": llm.truncations - truncations_before,
+        "json_responses": {key.split('"')[1]: value for key, value in counters.items() if key.startswith("llm_json_responses_total")},
+        "near_duplicate_chunks": sum(value for key, value in counters.items() if key.startswith("near_duplicate_chunks_total")),
+        "llm_calls_avoided": counters.get("near_duplicate_llm_calls_avoided_total", 0),
+        "embeddings_avoided": counters.get('embeddings_total{source="near_duplicate"}', 0),
+        "json_items_topped_up": sum(value for key, value in counters.items()
+                                    if key.startswith("llm_json_items_total") and 'outcome="topped_up"' in key),
+        "stage_seconds": {key.split('"')[1]: round(summary["sum"], 3) for key, summary in histograms.items()
+                          if key.startswith("pipeline_stage_seconds")},
+        "page_extract_ms": {key.split('"')[1]: {stat: round(summary[stat] * 1000, 3) for stat in ("p50", "p95", "max")}
+                            for key, summary in histograms.items() if key.startswith("pdf_page_extract_seconds")},
+        "peak_rss_mb": rss,
+        "children_peak_rss_mb": peak_children_rss_mb(),
+    }
+
+def peak_children_rss_mb():
+    """Peak RSS of the largest OCR worker process so far."""
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def bench_doubts(queries, verbose):
+    from agents.doubt_agent import DoubtAgent
+    agent = DoubtAgent()
+    latencies = []
+    with stage(verbose):
+        start = time.perf_counter()
+        for query in queries:
+            t = time.perf_counter()
+            agent.answer_question(query)
+            latencies.append((time.perf_counter() - t) * 1000)
+        elapsed = time.perf_counter() - start
+        rss = peak_rss_mb()
+    return {"queries": len(queries), "queries_per_s": round(len(queries) / elapsed, 2),
+            "latency_ms": percentiles(latencies), "peak_rss_mb": rss}
+
+def bench_quiz_submissions(submissions, rng, verbose):
+    from utils.database import db_pool, record_quiz_results, QUIZ_PAGE_SIZE
+    with db_pool.connection() as conn:
+        quiz_ids = [row['id'] for row in conn.execute("SELECT id FROM quizzes")]
+    if not quiz_ids:
+        return {"submissions": 0}
+    latencies = []
+    with stage(verbose):
+        start = time.perf_counter()
+        for _ in range(submissions):
+            # One graded quiz page, like the Smart Quiz tab submits
+            results = [(quiz_id, rng.random() < 0.7) for quiz_id in rng.sample(quiz_ids, min(QUIZ_PAGE_SIZE, len(quiz_ids)))]
+            t = time.perf_counter()
+            record_quiz_results(results)
+            latencies.append((time.perf_counter() - t) * 1000)
+        elapsed = time.perf_counter() - start
+        rss = peak_rss_mb()
+    return {"submissions": submissions, "submissions_per_s": round(submissions / elapsed, 2),
+            "latency_ms": percentiles(latencies), "peak_rss_mb": rss}
+
+def bench_planner(runs, verbose):
+    from agents.planner import PlannerAgent
+    latencies = []
+    with stage(verbose):
+        for _ in range(runs):
+            t = time.perf_counter()
+            PlannerAgent().generate_smart_plan()
+            latencies.append((time.perf_counter() - t) * 1000)
+        rss = peak_rss_mb()
+    return {"runs": runs, "latency_ms": percentiles(latencies), "peak_rss_mb": rss}
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+def compare(results, baseline, threshold):
+    """Returns the metrics that got worse than the baseline by more than threshold (a fraction)."""
+    current, base = flatten(results), flatten(baseline)
+    regressions = []
+    for key, value in current.items():
+        if key.startswith("config.") or key not in base:
+            continue
+        # e.g. "doubt.latency_ms.p95" follows the "_ms" rule
+        parts = key.split(".")[1:]
+        rule = next((rule for rule in METRIC_RULES if any(part.endswith(rule[0]) for part in parts)), None)
+        if rule is None:
+            continue
+        _, lower_is_better, noise_floor = rule
+        old = base[key]
+        worse_by = (value - old) if lower_is_better else (old - value)
+        if worse_by > noise_floor and worse_by > threshold * abs(old):
+            regressions.append({"metric": key, "baseline": old, "current": value,
+                                "change": f"{(value - old) / old:+.0%}" if old else "new"})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with a fake LLM and embedding model.")
+    parser.add_argument("--pages", default="10,100,1000", help="comma-separated document sizes")
+    parser.add_argument("--kinds", default="text,revised,scanned",
+                        help="text, revised (the text PDF re-issued with small edits; run after text) "
+                             "and/or scanned (image-only pages, OCR'd)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM seconds per request")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="fraction of fake LLM requests failing with 429")
+    parser.add_argument("--llm-truncation-rate", type=float, default=0.0, help="fraction of fake LLM responses cut off part-way")
+    parser.add_argument("--questions", type=int, default=200, help="doubts to answer")
+    parser.add_argument("--submissions", type=int, default=500, help="quiz pages to submit")
+    parser.add_argument("--planner-runs", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="optional path to write the results to")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression vs the baseline (0.2 = 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="show the agents' console output")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    # Fresh databases, caches and vector store in a scratch folder; the project's
+    # modules resolve these paths (and read the settings below) when imported
+    workdir = tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    sys.path.insert(0, os.getcwd())
+    os.chdir(workdir)
+    os.environ.update({
+        "LLM_BACKEND": "fake", "EMBEDDING_BACKEND": "fake",
+        "FAKE_LLM_LATENCY": str(args.llm_latency), "FAKE_LLM_TOKEN_DELAY": "0",
+        "FAKE_LLM_FAILURE_RATE": str(args.llm_failure_rate), "FAKE_LLM_TRUNCATION_RATE": str(args.llm_truncation_rate),
+        "LLM_BACKOFF_BASE": "0.05", "LLM_BACKOFF_MAX": "0.5",  # Retries shouldn't dominate the timings
+        "METRICS_ENABLED": "1", "METRICS_REPORT_DIR": os.path.join(workdir, "reports"),
+    })
+    rng = random.Random(args.seed)
+    sizes = [int(pages) for pages in args.pages.split(",")]
+    kinds = args.kinds.split(",")
+    print(f"Benchmark: {kinds} x {sizes} pages, fake LLM {args.llm_latency}s / {args.llm_failure_rate:.0%} failures "
+          f"(scratch folder {workdir})")
+
+    results = {"config": {"pages": sizes, "kinds": kinds, "llm_latency": args.llm_latency,
+                          "llm_failure_rate": args.llm_failure_rate,
+                          "llm_truncation_rate": args.llm_truncation_rate, "seed": args.seed, "cpus": os.cpu_count()},
+               "pipeline": {}}
+    for kind in kinds:
+        for pages in sizes:
+            name = f"{kind}-{pages}"
+            pdf_path = os.path.join(workdir, f"{name}.pdf")
+            make_pdf(pdf_path, pages, scanned=kind == "scanned", seed=args.seed + pages,
+                     make_page=revised_pages(args.seed) if kind == "revised" else synthetic_page)
+            results["pipeline"][name] = bench_pipeline(pdf_path, args.verbose)
+            run = results["pipeline"][name]
+            print(f"  pipeline {name}: {run['seconds']}s ({run['pages_per_s']} pages/s), {run['flashcards']} flashcards, "
+                  f"{run['quizzes']} quizzes, {run['near_duplicate_chunks']} near-duplicates, peak RSS {run['peak_rss_mb']} MB")
+
+    queries = [f"Explain {rng.choice(VOCABULARY)} and {rng.choice(VOCABULARY)} ({i})" for i in range(args.questions)]
+    results["doubt"] = bench_doubts(queries, args.verbose)
+    print(f"  doubts: {results['doubt']['queries_per_s']} queries/s, p95 {results['doubt']['latency_ms']['p95']} ms")
+    results["quiz_submit"] = bench_quiz_submissions(args.submissions, rng, args.verbose)
+    print(f"  quiz submissions: p95 {results['quiz_submit'].get('latency_ms', {}).get('p95')} ms")
+    results["planner"] = bench_planner(args.planner_runs, args.verbose)
+    print(f"  planner: p95 {results['planner']['latency_ms']['p95']} ms")
+
+    print(json.dumps(results, indent=2))
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print(f"Baseline: Warning, it was run with different settings: {baseline.get('config')}")
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']} ({regression['change']})")
+        print(f"Baseline: {len(regressions)} regressions over {args.threshold:.0%}.")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
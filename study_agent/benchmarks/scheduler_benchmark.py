@@ -0,0 +1,85 @@
+# benchmarks/scheduler_benchmark.py
+# Replays a year of spaced-repetition reviews over a large question bank
+# against a scratch copy of the study database, timing the "what is due
+# now" query and the per-answer schedule updates.
+# Run from the study_agent folder:
+#   python -m benchmarks.scheduler_benchmark --items 100000 --days 365
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import numpy as np
+import utils.database as database
+from utils.scheduler import DAY, quality_from_result
+
+def percentiles(values):
+    values = np.array(values) if values else np.zeros(1)
+    return {"p50": round(float(np.percentile(values, 50)), 3), "p99": round(float(np.percentile(values, 99)), 3),
+            "max": round(float(values.max()), 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a year of SM-2 reviews over a large question bank.")
+    parser.add_argument("--items", type=int, default=100_000, help="quizzes + flashcards in the schedule")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--batch", type=int, default=500, help="due items fetched (and answered) per query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="optional path to write the results to")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="scheduler_benchmark_")
+    database.db_pool = database.ConnectionPool(os.path.join(workdir, "study_data.db"))
+    database.initialize_database()
+
+    # Half quizzes, half flashcards, all due on day 0; each with a hidden recall probability
+    start_time = 1_700_000_000.0
+    items = [("quiz" if i % 2 else "flashcard", i) for i in range(args.items)]
+    recall = {item: rng.uniform(0.6, 0.98) for item in items}
+    with database.db_pool.transaction() as conn:
+        conn.executemany("INSERT INTO review_schedule (item_type, item_id, next_due) VALUES (?, ?, ?)",
+                         [(item_type, item_id, start_time) for item_type, item_id in items])
+    print(f"Schedule: {args.items} items, simulating {args.days} days (scratch DB in {workdir})")
+
+    query_ms, update_us, per_day = [], [], []
+    wall_start = time.perf_counter()
+    for day in range(args.days):
+        now = start_time + day * DAY
+        reviewed = 0
+        while True:
+            t = time.perf_counter()
+            due = database.get_due_items(limit=args.batch, now=now)
+            query_ms.append((time.perf_counter() - t) * 1000)
+            if not due:
+                break
+            by_type = {}
+            for row in due:
+                is_correct = rng.random() < recall[(row['item_type'], row['item_id'])]
+                by_type.setdefault(row['item_type'], []).append((row['item_id'], quality_from_result(is_correct)))
+            t = time.perf_counter()
+            for item_type, reviews in by_type.items():
+                database.record_reviews(item_type, reviews, now=now)
+            update_us.append((time.perf_counter() - t) * 1e6 / len(due))
+            reviewed += len(due)
+        per_day.append(reviewed)
+        if day % 30 == 0:
+            print(f"  day {day:3d}: {reviewed} reviews")
+    wall = time.perf_counter() - wall_start
+
+    results = {
+        "items": args.items,
+        "days": args.days,
+        "total_reviews": int(sum(per_day)),
+        "reviews_per_day": {"mean": round(float(np.mean(per_day)), 1), "max": int(max(per_day))},
+        "due_query_ms": percentiles(query_ms),
+        "update_us_per_review": percentiles(update_us),
+        "wall_seconds": round(wall, 1),
+    }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
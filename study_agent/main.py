@@ -1,54 +1,267 @@
-# main.py
-from agents.reader import ReaderAgent
-from agents.flashcard import FlashcardAgent
-from agents.quiz import QuizAgent
-from agents.planner import PlannerAgent
-from utils.database import initialize_database # <-- IMPORT
-import time
-import os
-
-# Define a temporary path for the uploaded file
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-def run_study_pipeline(pdf_path):
-    """
-    Executes the full multi-agent pipeline.
-    """
-    print("--- STARTING STUDY PIPELINE ---")
-    start_time = time.time()
-    
-    # 0. Initialize Database
-    initialize_database() # <-- ADD THIS STEP
-    
-    # 1. Reader Agent (with OCR)
-    reader = ReaderAgent()
-    text_chunks = reader.process_pdf(pdf_path)
-    
-    if not text_chunks:
-        print("Pipeline Error: No text chunks extracted.")
-        return False
-    
-    # 2. Flashcard Agent
-    flashcard_agent = FlashcardAgent()
-    flashcard_agent.generate_flashcards(text_chunks)
-    
-    # 3. Quiz Agent (saves to DB)
-    quiz_agent = QuizAgent()
-    quiz_agent.generate_and_store_quizzes(text_chunks)
-    
-    # 4. Planner Agent (reads from DB)
-    planner_agent = PlannerAgent()
-    planner_agent.generate_smart_plan()
-    
-    end_time = time.time()
-    print(f"--- PIPELINE FINISHED IN {end_time - start_time:.2f} SECONDS ---")
-    return True
-
-if __name__ == "__main__":
-    # This allows testing the pipeline from the command line
-    print("Running test pipeline...")
-    if os.path.exists("test.pdf"):
-        run_study_pipeline("test.pdf")
-    else:
-        print("Please add a 'test.pdf' to the root folder to run a test.")
\ No newline at end of file
+# main.py
+from agents.reader import ReaderAgent
+from agents.flashcard import FlashcardAgent
+from agents.quiz import QuizAgent
+from agents.study_pack import StudyPackAgent, chunks_per_pack
+from agents.planner import PlannerAgent
+from utils.database import initialize_database # <-- IMPORT
+from utils.llm_cache import llm_cache
+from utils.llm_clients import LLM_MAX_CONCURRENCY
+from utils import metrics
+import threading
+import queue
+import time
+import os
+
+# Define a temporary path for the uploaded file
+UPLOAD_DIR = "uploads"
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Generate flashcards and quizzes together in packed multi-chunk prompts.
+# Set COMBINED_GENERATION=0 for one prompt per chunk per agent.
+COMBINED_GENERATION = os.environ.get("COMBINED_GENERATION", "1") != "0"
+
+# Max chunks waiting between stages; a full queue blocks the stage before it
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 256))
+EMBED_BATCH_SIZE = 64
+# Enough chunks to keep every concurrent LLM request busy
+GENERATION_BATCH_SIZE = LLM_MAX_CONCURRENCY * chunks_per_pack()
+
+_END = object()  # Sentinel closing a stage queue
+
+def _progress(stage, done, total=None, message=""):
+    """A structured progress event, as yielded by iter_study_pipeline."""
+    return {"stage": stage, "done": done, "total": total, "message": message}
+
+def _put(stage_queue, item, failed):
+    """Blocking put that gives up if another stage has failed."""
+    while not failed.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+def _drain(stage_queue, max_items, failed):
+    """
+    Yields batches from a stage queue: waits for the first chunk, then takes
+    whatever else is already waiting (up to max_items). Stops at _END, or
+    as soon as another stage has failed.
+    """
+    while not failed.is_set():
+        try:
+            item = stage_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        batch = [item]
+        while len(batch) < max_items:
+            try:
+                item = stage_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _END:
+                yield batch
+                return
+            batch.append(item)
+        yield batch
+
+def _read_stage(reader, pdf_path, embed_queue, generate_queue, events, failed):
+    """
+    Stage 1: pages -> chunks. All chunks go to the embedder, new ones to
+    generation unless they are near-duplicates of a chunk with a topic.
+    """
+    for page, chunks, is_new in reader.iter_page_chunks(pdf_path):
+        duplicates = reader.find_duplicates(chunks) if is_new else [None] * len(chunks)
+        for chunk, duplicate_of in zip(chunks, duplicates):
+            _put(embed_queue, chunk, failed)
+            if is_new and duplicate_of is None:
+                _put(generate_queue, chunk, failed)
+        if failed.is_set():
+            return
+        status = "new" if is_new else "reused"
+        skipped = sum(duplicate_of is not None for duplicate_of in duplicates)
+        if skipped:
+            status += f", {skipped} duplicates"
+        events.put(_progress("extract", page["page_num"] + 1, page["page_count"],
+                             f"Page {page['page_num'] + 1}: {len(chunks)} chunks ({status})"))
+
+def _embed_stage(reader, embed_queue, events, failed):
+    """Stage 2: chunks -> embeddings, appended to the vector store in batches."""
+    done = 0
+    for batch in _drain(embed_queue, EMBED_BATCH_SIZE, failed):
+        reader.add_to_vector_store(batch)
+        done += len(batch)
+        events.put(_progress("embed", done, message=f"Embedded {done} chunks"))
+    if not failed.is_set():
+        reader.save_vector_store()
+
+def _generate_stage(document_name, generate_queue, events, failed):
+    """Stage 3: new chunks -> flashcards + quizzes, saved batch by batch."""
+    flashcard_agent = FlashcardAgent(document_name)
+    quiz_agent = QuizAgent(buffered=True)  # The whole document's quizzes go in one transaction
+    pack_agent = StudyPackAgent() if COMBINED_GENERATION else None
+
+    done = 0
+    def generate(batch):
+        nonlocal done
+        if COMBINED_GENERATION:
+            # One packed LLM pass for both flashcards and quizzes
+            packs = pack_agent.generate(batch)
+            flashcard_agent.add_flashcards(batch, [pack['flashcards'] for pack in packs])
+            quiz_agent.store_quizzes(batch, [pack['quizzes'] for pack in packs])
+        else:
+            flashcard_agent.generate_flashcards(batch)
+            quiz_agent.generate_and_store_quizzes(batch)
+        done += len(batch)
+        events.put(_progress("generate", done,
+                             message=f"{flashcard_agent.total} flashcards from {done} chunks"))
+
+    # Only full packs go out before the end, so the prompts (and their LLM cache
+    # keys) depend on the chunk order alone, not on how fast chunks arrive
+    pending = []
+    for batch in _drain(generate_queue, GENERATION_BATCH_SIZE, failed):
+        pending.extend(batch)
+        ready = pack_agent.complete_packs(pending) if COMBINED_GENERATION else len(pending)
+        if ready:
+            generate(pending[:ready])
+            del pending[:ready]
+    if not failed.is_set():
+        if pending:
+            generate(pending)
+        quiz_agent.flush()
+
+def iter_study_pipeline(pdf_path):
+    """
+    Executes the full multi-agent pipeline as streaming stages, yielding
+    progress events ({"stage", "done", "total", "message"}) as work completes.
+    Pages flow into the chunker and chunks flow into the embedder and the
+    flashcard/quiz generators through bounded queues, so memory stays bounded
+    and the first flashcards are saved long before the last page is read.
+    The final event has stage "done" (or "error").
+    Each run's timings and counters are saved as a JSON report (see utils/metrics.py).
+    """
+    details = {"document": os.path.basename(pdf_path), "status": "failed"}
+    with metrics.run_metrics() as run_registry:
+        start = time.perf_counter()
+        try:
+            for event in _iter_pipeline(pdf_path, details):
+                if event["stage"] in ("done", "error"):
+                    details["status"] = event["stage"]
+                yield event
+        finally:
+            details["elapsed_seconds"] = round(time.perf_counter() - start, 3)
+            report_path = metrics.write_report(run_registry, details["document"], **details)
+            if report_path:
+                print(f"Pipeline: Metrics report saved to {report_path}")
+
+def _iter_pipeline(pdf_path, details):
+    print("--- STARTING STUDY PIPELINE ---")
+    start_time = time.time()
+
+    # 0. Initialize Database
+    initialize_database() # <-- ADD THIS STEP
+
+    # 1-3. Reader (with OCR) -> embedder + flashcard/quiz generation, running concurrently
+    reader = ReaderAgent()
+    events = queue.Queue()
+    embed_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    generate_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    failed = threading.Event()
+    errors = []
+
+    def run_stage(target, *args, closes=()):
+        try:
+            with metrics.span("pipeline_stage", stage=target.__name__.strip("_")):
+                target(*args)
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+        finally:
+            for stage_queue in closes:
+                _put(stage_queue, _END, failed)
+    # Threads don't inherit this run's metrics on their own
+    run_stage = metrics.in_run_context(run_stage)
+
+    stages = [
+        threading.Thread(target=run_stage, args=(_read_stage, reader, pdf_path, embed_queue, generate_queue, events, failed),
+                         kwargs={"closes": (embed_queue, generate_queue)}),
+        threading.Thread(target=run_stage, args=(_embed_stage, reader, embed_queue, events, failed)),
+        threading.Thread(target=run_stage, args=(_generate_stage, os.path.basename(pdf_path), generate_queue, events, failed)),
+    ]
+    for stage in stages:
+        stage.start()
+
+    while any(stage.is_alive() for stage in stages) or not events.empty():
+        try:
+            yield events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+    if errors:
+        print(f"Pipeline Error: {errors[0]}")
+        raise errors[0]
+
+    if not reader.text_chunks:
+        print("Pipeline Error: No text chunks extracted.")
+        yield _progress("error", 0, message="No text chunks extracted.")
+        return
+
+    stats = details["reader"] = reader.stats
+    print(f"Pipeline: Reused {stats['pages_reused']} pages / {stats['chunks_reused']} chunks, "
+          f"recomputed {stats['pages_recomputed']} pages / {stats['chunks_recomputed']} chunks.")
+
+    if stats["chunks_duplicate"]:
+        details["near_duplicates"] = _near_duplicate_savings(stats)
+        print(f"Pipeline: Routed {stats['chunks_duplicate']} near-duplicate chunks to existing topics "
+              f"(at least {details['near_duplicates']['llm_calls_avoided']} LLM calls and "
+              f"{stats['embeddings_reused']} embeddings avoided).")
+
+    # New pages count as processed only once generation has finished
+    reader.commit_page_cache()
+
+    # 4. Planner Agent (reads from DB)
+    yield _progress("plan", 0, message="Building revision plan")
+    with metrics.span("pipeline_stage", stage="plan_stage"):
+        planner_agent = PlannerAgent()
+        planner_agent.generate_smart_plan()
+
+    details["llm_cache"] = llm_cache.stats()
+    print(f"LLM Cache: {details['llm_cache']}")
+
+    end_time = time.time()
+    print(f"--- PIPELINE FINISHED IN {end_time - start_time:.2f} SECONDS ---")
+    yield _progress("done", 1, 1, f"Finished in {end_time - start_time:.2f} seconds")
+
+def _near_duplicate_savings(stats):
+    """
+    The work skipped for near-duplicate chunks. Avoided LLM calls are a
+    lower bound: full study packs, or a flashcard and a quiz request per
+    chunk, not counting top-ups.
+    """
+    duplicates = stats["chunks_duplicate"]
+    avoided = -(-duplicates // chunks_per_pack()) if COMBINED_GENERATION else 2 * duplicates
+    metrics.inc("near_duplicate_llm_calls_avoided_total", avoided)
+    return {"chunks": duplicates, "llm_calls_avoided": avoided,
+            "embeddings_avoided": stats["embeddings_reused"]}
+
+def run_study_pipeline(pdf_path, on_progress=None):
+    """
+    Executes the full multi-agent pipeline.
+    on_progress, if given, is called with every progress event.
+    """
+    success = False
+    for event in iter_study_pipeline(pdf_path):
+        if on_progress:
+            on_progress(event)
+        success = event["stage"] == "done"
+    return success
+
+if __name__ == "__main__":
+    # This allows testing the pipeline from the command line
+    print("Running test pipeline...")
+    if os.path.exists("test.pdf"):
+        run_study_pipeline("test.pdf")
+    else:
+        print("Please add a 'test.pdf' to the root folder to run a test.")
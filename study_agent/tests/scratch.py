@@ -0,0 +1,28 @@
+# tests/scratch.py
+# One scratch folder for all the tests in a run. The project's modules
+# resolve their databases (and read these settings) when first used and
+# keep them for the whole process, so every test module shares the folder.
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+STUDY_AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_workdir = None
+
+def enter():
+    """Switches to the scratch folder with offline settings (once) and returns its path."""
+    global _workdir
+    if _workdir is None:
+        sys.path.insert(0, STUDY_AGENT_DIR)
+        _workdir = tempfile.mkdtemp(prefix="study_agent_tests_")
+        os.chdir(_workdir)
+        os.environ.update({
+            "LLM_BACKEND": "fake", "EMBEDDING_BACKEND": "fake",
+            "FAKE_LLM_LATENCY": "0", "FAKE_LLM_TOKEN_DELAY": "0",
+            "METRICS_ENABLED": "0", "PDF_WORKERS": "1",
+        })
+        atexit.register(shutil.rmtree, _workdir, True)
+    return _workdir
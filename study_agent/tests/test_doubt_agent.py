@@ -0,0 +1,107 @@
+# tests/test_doubt_agent.py
+# DoubtAgent against the fake LLM and embedding model: batched answers
+# get the right context even when chunks have gone from the store, and
+# streamed answers record their latency, stop when cancelled without
+# caching anything, and set an error apart from the partial answer.
+# Runs offline in the tests' scratch folder. Run from the study_agent folder:
+#   python -m pytest -q tests
+import os
+import threading
+import unittest
+from unittest import mock
+import scratch
+
+def setUpModule():
+    workdir = scratch.enter()
+    from benchmarks.pipeline_benchmark import make_pdf
+    from main import run_study_pipeline
+    pdf_path = os.path.join(workdir, "doubt-notes.pdf")
+    make_pdf(pdf_path, 6, seed=7)
+    assert run_study_pipeline(pdf_path)
+
+QUESTIONS = ["What does osmosis move?", "How is momentum conserved?", "Why did the empire trade?",
+             "What is a matrix derivative?", "Where are ribosomes found?", "What drives a voltage current?"]
+
+class AnswerBatchTest(unittest.TestCase):
+    def test_missing_chunk_does_not_shift_contexts(self):
+        import agents.doubt_agent as doubt_agent
+        from utils.answer_cache import answer_cache
+        from utils.prompts import DOUBT_PROMPT
+        from utils.vector_store import VectorStore
+
+        agent = doubt_agent.DoubtAgent()
+        chunk_ids = [agent._search(agent._encode(question)) for question in QUESTIONS]
+        texts = agent.vector_store.get_chunk_map([chunk_id for ids in chunk_ids for chunk_id in ids])
+        # The first chunk hit was deleted by another process since the index was loaded
+        gone = chunk_ids[0][0]
+        get_chunk_map = VectorStore.get_chunk_map
+        def without_gone(store, ids):
+            return {chunk_id: text for chunk_id, text in get_chunk_map(store, ids).items() if chunk_id != gone}
+
+        prompts = []
+        def respond(prompt, **kwargs):
+            prompts.append(prompt)
+            return "An answer."
+        with mock.patch.object(VectorStore, "get_chunk_map", without_gone), \
+                mock.patch.object(doubt_agent, "get_text_response_from_llm", respond):
+            results = list(agent.answer_questions(QUESTIONS))
+
+        for question, ids, result in zip(QUESTIONS, chunk_ids, results):
+            self.assertEqual(result["chunk_ids"], ids)
+            context = "\n\n".join(texts[chunk_id] for chunk_id in ids if chunk_id != gone)
+            self.assertIn(DOUBT_PROMPT.format(context=context, query=question), prompts)
+            # Answers from incomplete context aren't cached
+            cached = answer_cache.lookup(agent._encode(question), ids, agent.vector_store.index_file)
+            self.assertEqual(cached is None, gone in ids)
+
+class StreamAnswerTest(unittest.TestCase):
+    def llm_cache_entry(self, agent, query):
+        from utils.llm_cache import llm_cache
+        from utils.llm_clients import _model_name
+        from utils.registry import get_llm_model
+        _, _, prompt, _ = agent._prepare_answer(query)
+        return llm_cache.get(llm_cache.make_key(_model_name(get_llm_model()), prompt, {"temperature": 0.1}))
+
+    def test_streamed_answer_records_first_token_and_is_cached(self):
+        from agents.doubt_agent import DoubtAgent
+        from utils.answer_cache import answer_cache
+        query = "What does a ribosome build?"
+        agent = DoubtAgent()
+        pieces = list(agent.stream_answer(query))
+        self.assertGreater(len(pieces), 1)
+        metrics = agent.last_metrics
+        self.assertIsNotNone(metrics["ttft_s"])
+        self.assertLessEqual(metrics["ttft_s"], metrics["total_s"])
+        self.assertFalse(metrics["cancelled"] or metrics["error"])
+        embedding = agent._encode(query)
+        self.assertEqual(answer_cache.lookup(embedding, agent._search(embedding), agent.vector_store.index_file),
+                         "".join(pieces))
+
+    def test_cancelled_answer_is_not_cached(self):
+        from agents.doubt_agent import DoubtAgent
+        from utils.answer_cache import answer_cache
+        query = "How does friction slow a cart?"
+        agent = DoubtAgent()
+        cancel_event = threading.Event()
+        pieces = []
+        for piece in agent.stream_answer(query, cancel_event=cancel_event):
+            pieces.append(piece)
+            cancel_event.set()
+        self.assertEqual(len(pieces), 1)
+        self.assertTrue(agent.last_metrics["cancelled"])
+        self.assertIsNotNone(agent.last_metrics["ttft_s"])
+        embedding = agent._encode(query)
+        self.assertIsNone(answer_cache.lookup(embedding, agent._search(embedding), agent.vector_store.index_file))
+        self.assertIsNone(self.llm_cache_entry(agent, query))
+
+    def test_error_mid_answer_is_set_apart(self):
+        import agents.doubt_agent as doubt_agent
+        def fail_midway(prompt, **kwargs):
+            yield "The cell membrane "
+            raise ConnectionError("stream reset")
+        agent = doubt_agent.DoubtAgent()
+        with mock.patch.object(doubt_agent, "stream_text_from_llm", fail_midway):
+            pieces = list(agent.stream_answer("What surrounds a cell?"))
+        self.assertEqual(pieces, ["The cell membrane ", doubt_agent.STREAM_ERROR_NOTE])
+        self.assertTrue(doubt_agent.STREAM_ERROR_NOTE.startswith("\n\n"))
+        self.assertEqual(agent.last_metrics["error"], "stream reset")
@@ -0,0 +1,44 @@
+# tests/test_flashcard_deck.py
+# The flashcard tab's card count comes from trigger-maintained counters:
+# they must match the table through inserts and document deletes, and a
+# card's position must follow the deck when cards before it go.
+# Run from the study_agent folder:
+#   python -m pytest -q tests
+import os
+import unittest
+import scratch
+
+def setUpModule():
+    global workdir
+    workdir = scratch.enter()
+
+class FlashcardDeckTest(unittest.TestCase):
+    def upload(self, name, seed):
+        from benchmarks.pipeline_benchmark import make_pdf
+        from main import run_study_pipeline
+        pdf_path = os.path.join(workdir, name)
+        make_pdf(pdf_path, 3, seed=seed)
+        self.assertTrue(run_study_pipeline(pdf_path))
+
+    def assertDeckCounted(self):
+        from utils.database import db_pool, flashcard_deck
+        with db_pool.connection() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM flashcards").fetchone()[0]
+        self.assertEqual(flashcard_deck()[0], total)
+
+    def test_count_and_position_follow_deletes(self):
+        from agents.reader import ReaderAgent
+        from utils.database import db_pool, flashcard_deck, flashcard_position
+        self.upload("deck-1.pdf", seed=60)
+        self.upload("deck-2.pdf", seed=61)
+        self.assertDeckCounted()
+        with db_pool.connection() as conn:
+            last_id = conn.execute("SELECT MAX(id) FROM flashcards").fetchone()[0]
+        position = flashcard_position(last_id)
+        _, version = flashcard_deck()
+
+        ReaderAgent().delete_document("deck-1.pdf")
+        self.assertDeckCounted()
+        self.assertNotEqual(flashcard_deck()[1], version)
+        self.assertLess(flashcard_position(last_id), position)
+        self.assertEqual(flashcard_position(last_id), flashcard_deck()[0] - 1)
@@ -0,0 +1,65 @@
+# tests/test_headers_footers.py
+# Header/footer detection must only strip running headers and page
+# numbers: section headings that repeat on a few pages, numbered per-page
+# headings, and body text that differs only in a number all survive.
+# Run from the study_agent folder:
+#   python -m pytest -q tests
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAGES = 40
+WORKED_EXAMPLE_PAGES = (4, 17, 30)
+
+def lecture_page(number):
+    """A running header, a numbered heading, a body paragraph (two on some pages) and a page number."""
+    blocks = ["Course Notes", f"Topic {number} overview"]
+    if number in WORKED_EXAMPLE_PAGES:
+        blocks.insert(1, "Worked Example")
+    blocks.append(f"This section explains exercise {number} and the method behind it.")
+    blocks.append(f"Page {number}")
+    return blocks
+
+class HeadersFootersTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import fitz
+        cls.workdir = tempfile.mkdtemp(prefix="headers_footers_test_")
+        cls.pdf_path = os.path.join(cls.workdir, "lecture.pdf")
+        doc = fitz.open()
+        for number in range(1, PAGES + 1):
+            page = doc.new_page()
+            page.insert_textbox(page.rect + (50, 50, -50, -50), "\n\n".join(lecture_page(number)), fontsize=11)
+        doc.save(cls.pdf_path)
+        doc.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def test_only_running_header_and_page_number_are_found(self):
+        from utils.pdf_utils import find_headers_footers
+        self.assertEqual(find_headers_footers(self.pdf_path), {(0, "course notes"), (-1, "#")})
+
+    def test_body_text_and_headings_survive(self):
+        import fitz
+        from utils.pdf_utils import find_headers_footers, strip_headers_footers, _page_blocks_text
+        furniture = find_headers_footers(self.pdf_path)
+        doc = fitz.open(self.pdf_path)
+        try:
+            for number, page in enumerate(doc, start=1):
+                stripped = strip_headers_footers(_page_blocks_text(page), furniture)
+                self.assertEqual(stripped.split("\n\n"), lecture_page(number)[1:-1])
+        finally:
+            doc.close()
+
+    def test_furniture_is_only_stripped_at_its_position(self):
+        from utils.pdf_utils import strip_headers_footers
+        furniture = {(0, "course notes"), (-1, "#")}
+        # Same text at another position is content
+        self.assertEqual(strip_headers_footers("Intro\n\nCourse Notes\n\nBody", furniture), "Intro\n\nCourse Notes\n\nBody")
+        self.assertEqual(strip_headers_footers("Course Notes\n\nBody\n\n- 7 -", furniture), "Body")
@@ -0,0 +1,33 @@
+# tests/test_llm_clients.py
+# JSON responses against the fake LLM: clean ones are cached, salvaged
+# ones (cut off or malformed) are asked for again. Run from the
+# study_agent folder:
+#   python -m pytest -q tests
+import unittest
+import scratch
+
+def setUpModule():
+    scratch.enter()
+
+class JsonResponseCacheTest(unittest.TestCase):
+    def calls_for_repeat(self, prompt, **fake_settings):
+        """Asks the same prompt twice; returns (items, LLM calls made by the second request)."""
+        from utils.fake_llm import FakeLLM
+        from utils.llm_clients import get_json_response_from_llm
+        llm = FakeLLM(latency=0, token_delay=0, **fake_settings)
+        items = get_json_response_from_llm(prompt, model=llm)
+        calls = llm.calls
+        get_json_response_from_llm(prompt, model=llm)
+        return items, llm.calls - calls
+
+    def test_complete_response_is_cached(self):
+        from agents.flashcard import flashcard_prompt
+        items, calls = self.calls_for_repeat(flashcard_prompt("Osmosis moves water across a membrane. " * 8))
+        self.assertTrue(items)
+        self.assertEqual(calls, 0)
+
+    def test_salvaged_response_is_not_cached(self):
+        from agents.flashcard import flashcard_prompt
+        _, calls = self.calls_for_repeat(flashcard_prompt("Momentum is conserved in collisions. " * 8),
+                                         truncation_rate=1.0)
+        self.assertEqual(calls, 1)
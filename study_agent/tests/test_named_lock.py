@@ -0,0 +1,26 @@
+# tests/test_named_lock.py
+# A named lock held longer than its ttl is renewed, not taken over by a
+# waiting process. Run from the study_agent folder:
+#   python -m pytest -q tests
+import time
+import threading
+import unittest
+import scratch
+
+def setUpModule():
+    scratch.enter()
+
+class NamedLockTest(unittest.TestCase):
+    def test_long_hold_is_not_taken_over(self):
+        from utils.database import named_lock
+        order = []
+        def wait_for_lock():
+            with named_lock("test-lock", ttl=0.3, poll_interval=0.05):
+                order.append("waiter")
+        with named_lock("test-lock", ttl=0.3, poll_interval=0.05):
+            waiter = threading.Thread(target=wait_for_lock)
+            waiter.start()
+            time.sleep(1.2)
+            order.append("holder")
+        waiter.join()
+        self.assertEqual(order, ["holder", "waiter"])
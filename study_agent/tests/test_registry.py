@@ -0,0 +1,29 @@
+# tests/test_registry.py
+# With EMBEDDING_BACKEND=fake, fake embeddings are cached under their own
+# model name, never under the real model's. Run from the study_agent folder:
+#   python -m pytest -q tests
+import os
+import unittest
+import contextlib
+import scratch
+
+def setUpModule():
+    global workdir
+    workdir = scratch.enter()
+
+class FakeEmbeddingNameTest(unittest.TestCase):
+    def test_fake_embeddings_are_cached_under_their_own_name(self):
+        from benchmarks.pipeline_benchmark import make_pdf
+        from main import run_study_pipeline
+        from utils.fake_embedder import FakeEmbedder
+        from utils.page_cache import PageCache
+        from utils.registry import EMBEDDING_MODEL_NAME, get_embedding_model
+        self.assertEqual(EMBEDDING_MODEL_NAME, "fake:all-MiniLM-L6-v2")
+        self.assertIsInstance(get_embedding_model(), FakeEmbedder)
+
+        pdf_path = os.path.join(workdir, "embedded.pdf")
+        make_pdf(pdf_path, 2, seed=70)
+        self.assertTrue(run_study_pipeline(pdf_path))
+        with contextlib.closing(PageCache()._connect()) as conn:
+            names = {row[0] for row in conn.execute("SELECT DISTINCT model_name FROM chunk_embeddings")}
+        self.assertEqual(names, {"fake:all-MiniLM-L6-v2"})
@@ -0,0 +1,114 @@
+# tests/test_reupload.py
+# Regression tests: deleting a document and uploading it again must give
+# it its flashcards back, not reuse the page cache's chunks (or route its
+# chunks to topics that were deleted) and skip generation; other chunker
+# settings re-chunk the cached page text without extracting it again, and
+# regenerating the same chunks asks the LLM the same prompts.
+# Runs offline with the fake LLM and embedding model, in the tests' scratch folder.
+# Run from the study_agent folder:
+#   python -m pytest -q tests
+import os
+import unittest
+from unittest import mock
+import scratch
+
+def setUpModule():
+    global workdir
+    workdir = scratch.enter()
+
+def flashcard_count(document_name):
+    from utils.database import db_pool
+    with db_pool.connection() as conn:
+        return conn.execute("""
+            SELECT COUNT(*) FROM flashcards f JOIN documents d ON d.id = f.document_id WHERE d.name = ?
+        """, (document_name,)).fetchone()[0]
+
+class ReuploadTest(unittest.TestCase):
+    def upload(self, name, pages, workers=1, **kwargs):
+        """Runs the pipeline on a synthetic PDF and returns its reader stats."""
+        from benchmarks.pipeline_benchmark import make_pdf
+        from main import run_study_pipeline
+        from agents.reader import ReaderAgent
+        import utils.pdf_utils as pdf_utils
+        pdf_path = os.path.join(workdir, name)
+        make_pdf(pdf_path, pages, **kwargs)
+
+        stats = {}
+        commit_page_cache = ReaderAgent.commit_page_cache
+        def commit_and_record(reader):
+            stats.update(reader.stats)
+            commit_page_cache(reader)
+        with mock.patch.object(pdf_utils, "PDF_WORKERS", workers), \
+                mock.patch.object(ReaderAgent, "commit_page_cache", commit_and_record):
+            self.assertTrue(run_study_pipeline(pdf_path))
+        return stats
+
+    def delete(self, name):
+        from agents.reader import ReaderAgent
+        ReaderAgent().delete_document(name)
+        self.assertEqual(flashcard_count(name), 0)
+
+    def test_reupload_after_delete_regenerates_flashcards(self):
+        for workers in (1, 3):
+            with self.subTest(workers=workers):
+                name = f"lecture-{workers}.pdf"
+                self.upload(name, 4, workers, seed=workers)
+                cards = flashcard_count(name)
+                self.assertGreater(cards, 0)
+
+                self.delete(name)
+                self.upload(name, 4, workers, seed=workers)
+                self.assertEqual(flashcard_count(name), cards)
+
+    def test_unchanged_reupload_reuses_pages(self):
+        self.upload("notes.pdf", 3, seed=10)
+        cards = flashcard_count("notes.pdf")
+        stats = self.upload("notes.pdf", 3, seed=10)
+        self.assertEqual((stats["pages_reused"], stats["pages_recomputed"]), (3, 0))
+        self.assertEqual(flashcard_count("notes.pdf"), cards)
+
+    def test_untracked_pages_regenerate_after_delete(self):
+        # Pages processed before the page cache recorded their document
+        from utils.page_cache import PageCache
+        self.upload("old.pdf", 3, seed=20)
+        cards = flashcard_count("old.pdf")
+        PageCache().set_document_pages("old.pdf", [])
+        self.delete("old.pdf")
+        stats = self.upload("old.pdf", 3, seed=20)
+        self.assertEqual(stats["pages_recomputed"], 3)
+        self.assertEqual(flashcard_count("old.pdf"), cards)
+
+    def test_revision_regenerates_after_original_is_deleted(self):
+        from benchmarks.pipeline_benchmark import revised_pages
+        self.upload("edition-1.pdf", 4, seed=30)
+        stats = self.upload("edition-2.pdf", 4, seed=30, make_page=revised_pages(30))
+        self.assertGreater(stats["chunks_duplicate"], 0)
+        # The revision's cards are the original's, re-linked to it
+        self.delete("edition-1.pdf")
+        cards = flashcard_count("edition-2.pdf")
+        self.assertGreater(cards, 0)
+        self.delete("edition-2.pdf")
+        stats = self.upload("edition-2.pdf", 4, seed=30, make_page=revised_pages(30))
+        self.assertEqual(stats["chunks_duplicate"], 0)
+        self.assertGreater(flashcard_count("edition-2.pdf"), 0)
+
+    def test_new_chunker_settings_reuse_cached_text(self):
+        import utils.chunker as chunker
+        import utils.pdf_utils as pdf_utils
+        self.upload("slides.pdf", 3, seed=40)
+        with mock.patch.object(chunker, "CHUNK_TARGET_TOKENS", 150), \
+                mock.patch.object(pdf_utils, "_timed_extract", wraps=pdf_utils._timed_extract) as extract:
+            stats = self.upload("slides.pdf", 3, seed=40)
+        self.assertEqual(stats["pages_recomputed"], 3)
+        self.assertEqual(extract.call_count, 0)
+
+    def test_regeneration_is_served_from_the_llm_cache(self):
+        # Packs don't depend on timing, so the same chunks make the same prompts
+        from utils.registry import get_llm_model
+        self.upload("handout.pdf", 8, seed=50)
+        self.delete("handout.pdf")
+        llm = get_llm_model()
+        calls = llm.calls
+        self.upload("handout.pdf", 8, seed=50)
+        self.assertGreater(flashcard_count("handout.pdf"), 0)
+        self.assertEqual(llm.calls - calls, 0)
@@ -0,0 +1,186 @@
+# utils/answer_cache.py
+import sqlite3
+import os
+import json
+import time
+import threading
+import numpy as np
+
+ANSWER_CACHE_FILE = "vector_store/answer_cache.db"
+# Min cosine similarity between two queries for them to share an answer
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.9))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 2000))
+# Set ANSWER_CACHE_DISABLED=1 to send every doubt to the LLM
+ANSWER_CACHE_DISABLED = os.environ.get("ANSWER_CACHE_DISABLED", "0") == "1"
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype='float32').ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class SemanticAnswerCache:
+    """
+    Cache of DoubtAgent answers keyed on meaning rather than exact wording.
+    Each entry stores the query embedding, the chunk IDs retrieved for it and
+    the answer. A new query reuses an answer when its embedding is within
+    the similarity threshold of a cached query AND it retrieves the same
+    chunks, so "what is a batch OS" can answer "define batch operating system".
+
+    Entries belong to one vector store version (its index file); once a new
+    version is saved they are all dropped. The embeddings of the current
+    version are held in memory as a small normalized matrix, so a lookup is
+    one matrix-vector product. Least recently used entries are evicted past
+    max_entries.
+    """
+    def __init__(self, path=ANSWER_CACHE_FILE, threshold=ANSWER_CACHE_THRESHOLD,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, enabled=not ANSWER_CACHE_DISABLED):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0  # Seconds of LLM time not spent thanks to hits
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._version = None
+        self._ids = []
+        self._chunk_ids = []
+        self._matrix = np.zeros((0, 0), dtype='float32')
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                store_version TEXT,
+                query TEXT,
+                embedding BLOB, -- normalized float32 bytes
+                chunk_ids TEXT, -- JSON list, sorted
+                answer TEXT,
+                latency REAL, -- Seconds the LLM took to produce the answer
+                created_at REAL,
+                last_access REAL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_version ON answer_cache (store_version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_last_access ON answer_cache (last_access)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _sync_version(self, conn, store_version):
+        """Drops entries of older vector stores and loads the current version's embeddings."""
+        if store_version == self._version:
+            return
+        deleted = conn.execute("DELETE FROM answer_cache WHERE store_version != ?", (store_version,)).rowcount
+        conn.commit()
+        if deleted:
+            print(f"Answer Cache: Vector store changed, dropped {deleted} cached answers.")
+        rows = conn.execute(
+            "SELECT id, embedding, chunk_ids FROM answer_cache WHERE store_version = ? ORDER BY id",
+            (store_version,)
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        self._chunk_ids = [tuple(json.loads(row[2])) for row in rows]
+        self._matrix = (np.vstack([np.frombuffer(row[1], dtype='float32') for row in rows])
+                        if rows else np.zeros((0, 0), dtype='float32'))
+        self._version = store_version
+
+    def lookup(self, query_embedding, chunk_ids, store_version):
+        """Returns a cached answer for a similar query with the same context, or None."""
+        if not self.enabled or store_version is None:
+            return None
+        key = tuple(sorted(int(i) for i in chunk_ids))
+        query = _normalize(query_embedding)
+        with self._lock:
+            conn = self._connect()
+            try:
+                self._sync_version(conn, store_version)
+                if len(self._ids) and self._matrix.shape[1] == len(query):
+                    similarities = self._matrix @ query
+                    # Most similar first; the first one with the same context wins
+                    for row in np.argsort(-similarities):
+                        if similarities[row] < self.threshold:
+                            break
+                        if self._chunk_ids[row] != key:
+                            continue
+                        entry = conn.execute("SELECT answer, latency FROM answer_cache WHERE id = ?",
+                                             (self._ids[row],)).fetchone()
+                        if entry is None:
+                            break  # Evicted by another process
+                        conn.execute("UPDATE answer_cache SET last_access = ? WHERE id = ?",
+                                     (time.time(), self._ids[row]))
+                        conn.commit()
+                        self.hits += 1
+                        self.latency_saved += entry[1]
+                        return entry[0]
+                self.misses += 1
+                return None
+            finally:
+                conn.close()
+
+    def put(self, query, query_embedding, chunk_ids, answer, latency, store_version):
+        """Stores a freshly generated answer, then evicts the oldest entries if needed."""
+        if not self.enabled or store_version is None:
+            return
+        key = sorted(int(i) for i in chunk_ids)
+        vector = _normalize(query_embedding)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                self._sync_version(conn, store_version)
+                entry_id = conn.execute(
+                    "INSERT INTO answer_cache (store_version, query, embedding, chunk_ids, answer, latency, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (store_version, query, vector.tobytes(), json.dumps(key), answer, latency, now, now)
+                ).lastrowid
+                if self._matrix.shape[1] not in (0, len(vector)):
+                    self._version = None  # Embedding model changed; reload on next use
+                else:
+                    self._ids.append(entry_id)
+                    self._chunk_ids.append(tuple(key))
+                    self._matrix = np.vstack([self._matrix.reshape(-1, len(vector)), vector])
+                self._evict(conn)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        evicted = [row[0] for row in conn.execute(
+            "SELECT id FROM answer_cache ORDER BY last_access ASC LIMIT ?", (count - self.max_entries,)
+        )]
+        conn.executemany("DELETE FROM answer_cache WHERE id = ?", [(entry_id,) for entry_id in evicted])
+        evicted = set(evicted)
+        keep = [row for row, entry_id in enumerate(self._ids) if entry_id not in evicted]
+        self._ids = [self._ids[row] for row in keep]
+        self._chunk_ids = [self._chunk_ids[row] for row in keep]
+        self._matrix = self._matrix[keep]
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM answer_cache")
+            conn.commit()
+            conn.close()
+            self._version = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "latency_saved_s": round(self.latency_saved, 2)
+        }
+
+# Shared, process-wide cache instance
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,103 @@
+# utils/chunker.py
+# Splits a page's cleaned text (paragraphs separated by blank lines, see
+# pdf_utils.clean_text) into chunks of about CHUNK_TARGET_TOKENS tokens.
+# Paragraphs are kept whole where they fit, headings stay with the text
+# they introduce, and consecutive chunks share CHUNK_OVERLAP_TOKENS of
+# context. Every piece of text ends up in a chunk; nothing is filtered out.
+import os
+import re
+from utils.llm_clients import estimate_tokens
+
+CHUNK_TARGET_TOKENS = int(os.environ.get("CHUNK_TARGET_TOKENS", 300))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 40))
+HEADING_MAX_WORDS = 12
+
+def chunk_settings():
+    """The settings that determine a page's chunks (part of the page cache key)."""
+    return f"chunker:{CHUNK_TARGET_TOKENS}:{CHUNK_OVERLAP_TOKENS}"
+
+def is_heading(paragraph):
+    """A short line without closing punctuation, e.g. "2.1 Cell Structure"."""
+    return len(paragraph.split()) <= HEADING_MAX_WORDS and paragraph[-1] not in ".!?,;"
+
+def _split_words(text, max_tokens):
+    """Word windows of at most max_tokens (a single huge word is kept whole)."""
+    pieces, current, length = [], [], 0
+    for word in text.split():
+        # Same estimate as estimate_tokens(" ".join(current + [word])), without re-joining
+        if current and (length + 1 + len(word)) // 4 + 1 > max_tokens:
+            pieces.append(" ".join(current))
+            current, length = [], 0
+        length += len(word) + (1 if current else 0)
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def _split_paragraph(paragraph, max_tokens):
+    """A paragraph as-is if it fits, else its sentences (and word windows for run-on sentences)."""
+    if estimate_tokens(paragraph) <= max_tokens:
+        return [paragraph]
+    units = []
+    for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+        units.extend([sentence] if estimate_tokens(sentence) <= max_tokens else _split_words(sentence, max_tokens))
+    return units
+
+def _tail(units, max_tokens):
+    """The last units (or the last words of the last unit) within max_tokens, to repeat as overlap."""
+    tail, tokens = [], 0
+    for separator, unit in reversed(units):
+        unit_tokens = estimate_tokens(unit)
+        if tokens + unit_tokens > max_tokens:
+            if not tail:
+                words = _split_words(unit, max_tokens)
+                tail = [(" ", words[-1])] if len(words) > 1 else []
+            break
+        tail.insert(0, (separator, unit))
+        tokens += unit_tokens
+    return tail
+
+def chunk_text(text, target_tokens=None, overlap_tokens=None):
+    """
+    Packs paragraphs into chunks of up to target_tokens (estimated), each
+    starting with the last ~overlap_tokens of the previous chunk. Long
+    paragraphs are split at sentence boundaries, then at word boundaries.
+    A heading starts a new chunk once the current one is half full, and is
+    never left at the end of a chunk. Empty text gives no chunks; otherwise
+    all of it is covered, however short.
+    """
+    target = target_tokens or CHUNK_TARGET_TOKENS
+    overlap = min(CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens, target // 2)
+
+    chunks = []
+    current, current_tokens = [], 0  # [(separator, unit)] of the chunk being built
+    carried = 0  # How many of current's units are overlap repeated from the previous chunk
+    headings = 0  # How many headings current ends with
+
+    def flush():
+        chunks.append("".join(separator + unit for separator, unit in current).strip())
+
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+        heading = is_heading(paragraph)
+        for i, unit in enumerate(_split_paragraph(paragraph, target - overlap)):
+            tokens = estimate_tokens(unit)
+            new_section = heading and i == 0 and current_tokens >= target // 2
+            if len(current) > carried and (current_tokens + tokens > target or new_section):
+                # Headings move on to the next chunk with the text they introduce
+                moved = current[len(current) - headings:] if headings else []
+                del current[len(current) - len(moved):]
+                if len(current) > carried:
+                    flush()
+                    # A new section starts clean; otherwise carry some context over
+                    current = [] if new_section or moved else _tail(current, overlap)
+                carried = len(current)
+                current += moved
+                current_tokens = sum(estimate_tokens(u) for _, u in current)
+            current.append(("\n\n" if i == 0 else " ", unit))
+            current_tokens += tokens
+            headings = headings + 1 if heading else 0
+    if len(current) > carried:
+        flush()
+    return chunks
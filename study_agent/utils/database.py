@@ -1,168 +1,750 @@
-# utils/database.py
-import sqlite3
-import os
-import datetime
-
-DB_FILE = "vector_store/study_data.db"
-os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
-
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def initialize_database():
-    """
-    Creates the necessary tables if they don't exist.
-    We'll link quizzes to the text chunks they were generated from.
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Stores the original text chunks
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS topics (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chunk_hash TEXT UNIQUE,
-        content TEXT,
-        last_revised DATE,
-        revision_score REAL DEFAULT 0.0,
-        revision_count INTEGER DEFAULT 0
-    )
-    """)
-    
-    # Stores quiz questions and tracks performance
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS quizzes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        topic_id INTEGER,
-        question TEXT,
-        options TEXT, -- Storing options as a JSON string
-        answer TEXT,
-        correct_count INTEGER DEFAULT 0,
-        incorrect_count INTEGER DEFAULT 0,
-        FOREIGN KEY (topic_id) REFERENCES topics (id)
-    )
-    """)
-    
-    conn.commit()
-    conn.close()
-    print("Database: Initialized successfully.")
-
-def add_topic_and_quizzes(chunk_content, quiz_list):
-    """
-    Adds a new topic (chunk) and its associated quizzes to the database.
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Use a hash to prevent duplicate chunks
-    chunk_hash = str(hash(chunk_content))
-    
-    try:
-        cursor.execute("INSERT OR IGNORE INTO topics (chunk_hash, content) VALUES (?, ?)", (chunk_hash, chunk_content))
-        
-        # Get the ID of the topic (either newly inserted or existing)
-        cursor.execute("SELECT id FROM topics WHERE chunk_hash = ?", (chunk_hash,))
-        topic_id_row = cursor.fetchone()
-        if not topic_id_row:
-             conn.close()
-             return # Should not happen, but as a safeguard
-        
-        topic_id = topic_id_row['id']
-
-        for quiz in quiz_list:
-            # Check if this specific question already exists for this topic
-            cursor.execute("SELECT id FROM quizzes WHERE topic_id = ? AND question = ?", (topic_id, quiz['question']))
-            if cursor.fetchone() is None:
-                # Store options as a JSON string
-                options_json = json.dumps(quiz['options'])
-                cursor.execute(
-                    "INSERT INTO quizzes (topic_id, question, options, answer) VALUES (?, ?, ?, ?)",
-                    (topic_id, quiz['question'], options_json, quiz['answer'])
-                )
-        
-        conn.commit()
-    except sqlite3.IntegrityError as e:
-        print(f"Database Error: {e}")
-        pass
-    finally:
-        conn.close()
-
-def record_quiz_result(question_id, is_correct):
-    """
-    Records the outcome of a single quiz question.
-    This is the core of "performance tracking".
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if is_correct:
-        query = "UPDATE quizzes SET correct_count = correct_count + 1 WHERE id = ?"
-    else:
-        query = "UPDATE quizzes SET incorrect_count = incorrect_count + 1 WHERE id = ?"
-    
-    cursor.execute(query, (question_id,))
-    
-    # Also update the parent topic's 'last_revised' date
-    cursor.execute("""
-        UPDATE topics 
-        SET last_revised = ? 
-        WHERE id = (SELECT topic_id FROM quizzes WHERE id = ?)
-    """, (datetime.date.today(), question_id))
-
-    conn.commit()
-    conn.close()
-
-def get_all_quizzes_for_ui():
-    """Fetches all quizzes for the Streamlit UI."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    quizzes = cursor.execute("""
-        SELECT id, question, options, answer 
-        FROM quizzes
-    """).fetchall()
-    conn.close()
-    
-    # Parse the JSON options string back into a list
-    quiz_list = []
-    for q in quizzes:
-        quiz_list.append({
-            'id': q['id'],
-            'question': q['question'],
-            'options': json.loads(q['options']),
-            'answer': q['answer']
-        })
-    return quiz_list
-
-def get_topics_for_revision():
-    """
-    This is the "smart" part.
-    It fetches topics, prioritizing those with the worst performance.
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Calculate a 'priority_score'
-    # Prioritizes:
-    # 1. High incorrect_count
-    # 2. Low correct_count
-    # 3. Topics that haven't been quizzed (incorrect_count = 0 and last_revised is NULL)
-    query = """
-    SELECT 
-        t.id, 
-        t.content,
-        t.last_revised,
-        COALESCE(SUM(q.incorrect_count), 0) as total_incorrect,
-        COALESCE(SUM(q.correct_count), 0) as total_correct
-    FROM topics t
-    LEFT JOIN quizzes q ON t.id = q.topic_id
-    GROUP BY t.id
-    ORDER BY total_incorrect DESC, total_correct ASC, t.last_revised ASC
-    LIMIT 10 
-    """
-    
-    topics = cursor.execute(query).fetchall()
-    conn.close()
+# utils/database.py
+import sqlite3
+import os
+import json
+import queue
+import datetime
+import threading
+import contextlib
+import time
+from utils.page_cache import content_hash
+from utils.scheduler import sm2_review, quality_from_result, DEFAULT_EASE
+from utils import metrics
+
+DB_FILE = "vector_store/study_data.db"
+# Flashcards used to be kept in this file; it is imported once, then renamed
+LEGACY_FLASHCARD_FILE = "outputs/flashcards.json"
+os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
+
+# Max open connections shared by all threads / Streamlit sessions
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+# Seconds a writer waits for another writer instead of failing with "database is locked"
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", 30))
+
+def _configure(conn):
+    # WAL lets readers run alongside the single writer; NORMAL sync is
+    # still crash-safe in WAL mode but skips an fsync per commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA cache_size=-16000")  # 16 MB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    return conn
+
+def get_db_connection():
+    """Establishes a connection to the SQLite database."""
+    conn = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    return _configure(conn)
+
+class ConnectionPool:
+    """
+    Thread-safe pool of long-lived SQLite connections.
+    Connections are in autocommit mode: reads need no transaction, and
+    writes go through transaction(), which takes the write lock up front
+    (BEGIN IMMEDIATE) so concurrent writers queue on busy_timeout rather
+    than deadlocking when a read transaction tries to upgrade.
+    """
+    def __init__(self, path=DB_FILE, size=DB_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return _configure(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrows a connection for the duration of the with-block."""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Borrows a connection and runs the with-block as one write transaction."""
+        start = time.perf_counter()
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            locked = time.perf_counter()
+            # Time spent queueing for a connection and the write lock vs. holding it
+            metrics.observe("db_lock_wait_seconds", locked - start)
+            try:
+                yield conn
+                conn.execute("COMMIT")
+                metrics.observe("db_transaction_seconds", time.perf_counter() - locked, outcome="commit")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                metrics.observe("db_transaction_seconds", time.perf_counter() - locked, outcome="rollback")
+                raise
+
+# Shared, process-wide pool for study_data.db
+db_pool = ConnectionPool()
+
+@contextlib.contextmanager
+def named_lock(name, ttl=60, poll_interval=0.2):
+    """
+    Cross-process mutex stored in the database (works wherever SQLite does,
+    unlike fcntl). The holder's claim lasts ttl seconds and is renewed in
+    the background while the with-block runs, so a long hold isn't taken
+    over but a crashed process only blocks everyone else until it expires.
+    """
+    owner = f"{os.getpid()}:{threading.get_ident()}:{time.time()}"
+    start = time.perf_counter()
+    with db_pool.connection() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+    while True:
+        with db_pool.transaction() as conn:
+            now = time.time()
+            conn.execute("DELETE FROM locks WHERE name = ? AND expires_at < ?", (name, now))
+            acquired = conn.execute("INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                                    (name, owner, now + ttl)).rowcount
+        if acquired:
+            break
+        time.sleep(poll_interval)
+    metrics.observe("named_lock_wait_seconds", time.perf_counter() - start, lock=name)
+
+    stop = threading.Event()
+    def keep_alive():
+        while not stop.wait(ttl / 3):
+            with db_pool.transaction() as conn:
+                renewed = conn.execute("UPDATE locks SET expires_at = ? WHERE name = ? AND owner = ?",
+                                       (time.time() + ttl, name, owner)).rowcount
+            if not renewed and not stop.is_set():
+                print(f"Database: Lost lock '{name}' (held past its {ttl}s expiry).")
+                return
+    threading.Thread(target=metrics.in_run_context(keep_alive), daemon=True).start()
+    try:
+        yield
+    finally:
+        stop.set()
+        with db_pool.transaction() as conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+def initialize_database():
+    """
+    Creates the necessary tables if they don't exist.
+    We'll link quizzes to the text chunks they were generated from.
+    """
+    with db_pool.transaction() as conn:
+        _create_tables(conn.cursor())
+        _migrate_topic_hashes(conn)
+        _migrate_topic_counters(conn)
+        _create_counter_triggers(conn)
+        _create_schedule_triggers(conn)
+        _create_schedule_triggers(conn, 'flashcard', 'flashcards')
+        _create_flashcard_count_triggers(conn)
+        _migrate_flashcards_json(conn)
+    print("Database: Initialized successfully.")
+
+def _create_tables(cursor):
+    # Stores the original text chunks
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS topics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chunk_hash TEXT UNIQUE,
+        content TEXT,
+        last_revised DATE,
+        revision_score REAL DEFAULT 0.0,
+        revision_count INTEGER DEFAULT 0,
+        total_correct INTEGER DEFAULT 0, -- Sums of the topic's quiz counters,
+        total_incorrect INTEGER DEFAULT 0 -- kept up to date by triggers
+    )
+    """)
+    
+    # Stores quiz questions and tracks performance
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS quizzes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        topic_id INTEGER,
+        question TEXT,
+        options TEXT, -- Storing options as a JSON string
+        answer TEXT,
+        correct_count INTEGER DEFAULT 0,
+        incorrect_count INTEGER DEFAULT 0,
+        FOREIGN KEY (topic_id) REFERENCES topics (id)
+    )
+    """)
+
+    # Keyset pages of one topic's quizzes (topic_id, then rowid order)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_quizzes_topic ON quizzes (topic_id)")
+
+    # Uploaded documents (shared with utils/vector_store.py, which maps them to their chunks)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE,
+        uploaded_at TIMESTAMP
+    )
+    """)
+
+    # Flashcards, linked to the topic (chunk) and document they came from
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS flashcards (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        topic_id INTEGER,
+        document_id INTEGER,
+        question TEXT,
+        answer TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (topic_id) REFERENCES topics (id),
+        FOREIGN KEY (document_id) REFERENCES documents (id)
+    )
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_flashcards_topic_question ON flashcards (topic_id, question)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_flashcards_document ON flashcards (document_id)")
+
+    # Spaced-repetition state per quiz / flashcard (see utils/scheduler.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS review_schedule (
+        item_type TEXT, -- 'quiz' or 'flashcard'
+        item_id INTEGER,
+        repetitions INTEGER DEFAULT 0,
+        interval_days REAL DEFAULT 0,
+        ease REAL DEFAULT 2.5,
+        lapses INTEGER DEFAULT 0,
+        next_due REAL, -- Unix timestamp
+        last_reviewed REAL,
+        PRIMARY KEY (item_type, item_id)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_review_schedule_due ON review_schedule (next_due)")
+    # (item_type, next_due, item_id) also gives due-queue pages a total order without a sort
+    cursor.execute("DROP INDEX IF EXISTS idx_review_schedule_type_due")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_review_schedule_queue ON review_schedule (item_type, next_due, item_id)")
+
+    # MinHash signatures of generated chunks, for near-duplicate detection (see utils/near_duplicates.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS chunk_signatures (
+        chunk_hash TEXT PRIMARY KEY,
+        signature BLOB, -- uint32 MinHash values
+        duplicate_of TEXT -- chunk_hash of the topic it was routed to; NULL if it has its own topic
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_signatures_duplicate_of ON chunk_signatures (duplicate_of)")
+    # LSH buckets of the chunks with their own topic
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS chunk_signature_bands (
+        bucket INTEGER,
+        chunk_hash TEXT,
+        PRIMARY KEY (bucket, chunk_hash)
+    ) WITHOUT ROWID
+    """)
+
+def _migrate_topic_hashes(conn):
+    """
+    One-time fix-up for databases written before topics were keyed on a
+    stable digest: Python's hash() changes every run, so the same chunk
+    could be stored many times. Merges duplicate topics (and duplicate
+    questions within a topic, adding up their counters), then adds the
+    UNIQUE (topic_id, question) index that keeps it that way.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_quizzes_topic_question'").fetchone():
+        return
+
+    # 1. Merge topics with the same content into the oldest one
+    survivors, merged, rehashed = {}, 0, []
+    for row in conn.execute("SELECT id, chunk_hash, content FROM topics ORDER BY id").fetchall():
+        digest = content_hash(row['content'] or "")
+        if digest in survivors:
+            target = survivors[digest]
+            conn.execute("UPDATE quizzes SET topic_id = ? WHERE topic_id = ?", (target, row['id']))
+            conn.execute("""
+                UPDATE topics SET last_revised = (SELECT MAX(last_revised) FROM topics WHERE id IN (?, ?))
+                WHERE id = ?
+            """, (target, row['id'], target))
+            conn.execute("DELETE FROM topics WHERE id = ?", (row['id'],))
+            merged += 1
+        else:
+            survivors[digest] = row['id']
+            if row['chunk_hash'] != digest:
+                rehashed.append((digest, row['id']))
+    conn.executemany("UPDATE topics SET chunk_hash = ? WHERE id = ?", rehashed)
+
+    # 2. Merge repeated questions within a topic into the oldest one
+    conn.execute("""
+        UPDATE quizzes SET
+            correct_count = (SELECT SUM(q.correct_count) FROM quizzes q
+                             WHERE q.topic_id = quizzes.topic_id AND q.question = quizzes.question),
+            incorrect_count = (SELECT SUM(q.incorrect_count) FROM quizzes q
+                               WHERE q.topic_id = quizzes.topic_id AND q.question = quizzes.question)
+        WHERE id IN (SELECT MIN(id) FROM quizzes GROUP BY topic_id, question HAVING COUNT(*) > 1)
+    """)
+    removed = conn.execute("""
+        DELETE FROM quizzes WHERE id NOT IN (SELECT MIN(id) FROM quizzes GROUP BY topic_id, question)
+    """).rowcount
+
+    conn.execute("CREATE UNIQUE INDEX idx_quizzes_topic_question ON quizzes (topic_id, question)")
+    if merged or removed:
+        print(f"Database: Merged {merged} duplicate topics and {removed} duplicate questions.")
+
+def _migrate_topic_counters(conn):
+    """Adds and backfills the per-topic counters on databases created before they existed."""
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(topics)")}
+    if 'total_correct' in columns:
+        return
+    conn.execute("ALTER TABLE topics ADD COLUMN total_correct INTEGER DEFAULT 0")
+    conn.execute("ALTER TABLE topics ADD COLUMN total_incorrect INTEGER DEFAULT 0")
+    conn.execute("""
+        UPDATE topics SET
+            total_correct = (SELECT COALESCE(SUM(correct_count), 0) FROM quizzes WHERE topic_id = topics.id),
+            total_incorrect = (SELECT COALESCE(SUM(incorrect_count), 0) FROM quizzes WHERE topic_id = topics.id)
+    """)
+    print("Database: Backfilled per-topic quiz counters.")
+
+def _create_counter_triggers(conn):
+    """
+    Keeps topics.total_correct / total_incorrect equal to the sums over the
+    topic's quizzes on every write path, so the planner never aggregates.
+    """
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_quizzes_insert_counters AFTER INSERT ON quizzes
+    WHEN NEW.correct_count != 0 OR NEW.incorrect_count != 0
+    BEGIN
+        UPDATE topics SET total_correct = total_correct + NEW.correct_count,
+                          total_incorrect = total_incorrect + NEW.incorrect_count
+        WHERE id = NEW.topic_id;
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_quizzes_update_counters
+    AFTER UPDATE OF correct_count, incorrect_count, topic_id ON quizzes
+    BEGIN
+        UPDATE topics SET total_correct = total_correct - OLD.correct_count,
+                          total_incorrect = total_incorrect - OLD.incorrect_count
+        WHERE id = OLD.topic_id;
+        UPDATE topics SET total_correct = total_correct + NEW.correct_count,
+                          total_incorrect = total_incorrect + NEW.incorrect_count
+        WHERE id = NEW.topic_id;
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_quizzes_delete_counters AFTER DELETE ON quizzes
+    BEGIN
+        UPDATE topics SET total_correct = total_correct - OLD.correct_count,
+                          total_incorrect = total_incorrect - OLD.incorrect_count
+        WHERE id = OLD.topic_id;
+    END
+    """)
+    # Matches the planner's ORDER BY, so its top-N is a short index scan
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_topics_priority
+    ON topics (total_incorrect DESC, total_correct ASC, last_revised ASC)
+    """)
+
+def _create_schedule_triggers(conn, item_type='quiz', table='quizzes'):
+    """New items are due immediately; deleted items leave the review queue."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                          (f"trg_{table}_insert_schedule",)).fetchone()
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_insert_schedule AFTER INSERT ON {table}
+    BEGIN
+        INSERT OR IGNORE INTO review_schedule (item_type, item_id, next_due)
+        VALUES ('{item_type}', NEW.id, CAST(strftime('%s', 'now') AS REAL));
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_delete_schedule AFTER DELETE ON {table}
+    BEGIN
+        DELETE FROM review_schedule WHERE item_type = '{item_type}' AND item_id = OLD.id;
+    END
+    """)
+    if not exists:
+        # Items stored before scheduling existed are due now
+        conn.execute(f"""
+            INSERT OR IGNORE INTO review_schedule (item_type, item_id, next_due)
+            SELECT '{item_type}', id, ? FROM {table}
+        """, (time.time(),))
+
+def _create_flashcard_count_triggers(conn):
+    """
+    Keeps the deck's size (and a version that changes on every insert or
+    delete) in the counters table, so the flashcard tab never counts rows.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("""
+        INSERT OR IGNORE INTO counters (name, value)
+        VALUES ('flashcards', (SELECT COUNT(*) FROM flashcards)), ('flashcards_version', 0)
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_flashcards_insert_count AFTER INSERT ON flashcards
+    BEGIN
+        UPDATE counters SET value = value + 1 WHERE name IN ('flashcards', 'flashcards_version');
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_flashcards_delete_count AFTER DELETE ON flashcards
+    BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'flashcards';
+        UPDATE counters SET value = value + 1 WHERE name = 'flashcards_version';
+    END
+    """)
+
+def _migrate_flashcards_json(conn):
+    """Imports cards from the old outputs/flashcards.json (no topic/document link), once."""
+    if not os.path.exists(LEGACY_FLASHCARD_FILE):
+        return
+    try:
+        with open(LEGACY_FLASHCARD_FILE, encoding='utf-8') as f:
+            cards = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Database: Could not import {LEGACY_FLASHCARD_FILE}: {e}")
+        return
+    conn.executemany(
+        "INSERT INTO flashcards (question, answer) VALUES (?, ?)",
+        [(card['question'], card['answer']) for card in cards
+         if isinstance(card, dict) and 'question' in card and 'answer' in card]
+    )
+    os.replace(LEGACY_FLASHCARD_FILE, LEGACY_FLASHCARD_FILE + ".imported")
+    print(f"Database: Imported {len(cards)} flashcards from {LEGACY_FLASHCARD_FILE}.")
+
+def _topic_ids(conn, chunks):
+    """Inserts any new topics (chunks) and returns {digest: topic_id} for all of them."""
+    hashes = [content_hash(chunk) for chunk in chunks]
+    conn.executemany(
+        "INSERT OR IGNORE INTO topics (chunk_hash, content) VALUES (?, ?)",
+        list(zip(hashes, chunks))
+    )
+    topic_ids = {}
+    unique_hashes = list(set(hashes))
+    for i in range(0, len(unique_hashes), 500):
+        batch = unique_hashes[i:i + 500]
+        rows = conn.execute(f"SELECT id, chunk_hash FROM topics WHERE chunk_hash IN ({','.join('?' * len(batch))})", batch)
+        topic_ids.update({row['chunk_hash']: row['id'] for row in rows})
+    return topic_ids
+
+def add_topic_and_quizzes(chunk_content, quiz_list):
+    """
+    Adds a new topic (chunk) and its associated quizzes to the database.
+    """
+    add_topics_and_quizzes([(chunk_content, quiz_list)])
+
+def add_topics_and_quizzes(items):
+    """
+    Adds many topics (chunks) and their quizzes, [(chunk_content, quiz_list)],
+    in one transaction. Topics are keyed on a stable digest of their content
+    and quizzes on (topic, question), so storing the same material again
+    changes nothing; a regenerated question keeps its performance counters.
+    Returns the number of quizzes written.
+    """
+    items = [(chunk, quiz_list) for chunk, quiz_list in items if quiz_list]
+    if not items:
+        return 0
+    # Use a digest to prevent duplicate chunks (stable across runs, unlike hash())
+    hashes = [content_hash(chunk) for chunk, _ in items]
+    
+    with db_pool.transaction() as conn:
+        # Get the IDs of the topics (either newly inserted or existing)
+        topic_ids = _topic_ids(conn, [chunk for chunk, _ in items])
+
+        # Store options as a JSON string; existing questions are updated in place
+        rows = [
+            (topic_ids[chunk_hash], quiz['question'], json.dumps(quiz['options']), quiz['answer'])
+            for chunk_hash, (_, quiz_list) in zip(hashes, items)
+            for quiz in quiz_list
+            if isinstance(quiz, dict) and {'question', 'options', 'answer'} <= quiz.keys()
+        ]
+        conn.executemany("""
+            INSERT INTO quizzes (topic_id, question, options, answer) VALUES (?, ?, ?, ?)
+            ON CONFLICT (topic_id, question) DO UPDATE SET options = excluded.options, answer = excluded.answer
+        """, rows)
+    return len(rows)
+
+def add_flashcards(document_name, items):
+    """
+    Appends flashcards, [(chunk_content, card_list)], in one transaction,
+    linked to their topic (chunk) and to the document. Cards already stored
+    for the same topic are kept as they are. Returns the number of new cards.
+    """
+    items = [(chunk, cards) for chunk, cards in items if cards]
+    if not items:
+        return 0
+    with db_pool.transaction() as conn:
+        document_id = None
+        if document_name:
+            conn.execute("INSERT OR IGNORE INTO documents (name, uploaded_at) VALUES (?, CURRENT_TIMESTAMP)", (document_name,))
+            document_id = conn.execute("SELECT id FROM documents WHERE name = ?", (document_name,)).fetchone()[0]
+        topic_ids = _topic_ids(conn, [chunk for chunk, _ in items])
+        return conn.executemany(
+            "INSERT OR IGNORE INTO flashcards (topic_id, document_id, question, answer) VALUES (?, ?, ?, ?)",
+            [(topic_ids[content_hash(chunk)], document_id, card['question'], card['answer'])
+             for chunk, cards in items for card in cards
+             if isinstance(card, dict) and 'question' in card and 'answer' in card]
+        ).rowcount
+
+def delete_document_flashcards(document_name):
+    """
+    Removes the flashcards generated from a document (e.g. when it is deleted
+    from the library). Cards whose chunk, or a near-duplicate routed to it,
+    also appears in another document are kept and re-linked to that document.
+    """
+    # Another document containing the card's chunk (topics and vector store chunks share the digest)
+    other_document = """
+        SELECT dc.document_id FROM topics t
+        JOIN chunks c ON c.chunk_hash = t.chunk_hash
+            OR c.chunk_hash IN (SELECT chunk_hash FROM chunk_signatures WHERE duplicate_of = t.chunk_hash)
+        JOIN document_chunks dc ON dc.chunk_id = c.id
+        WHERE t.id = flashcards.topic_id AND dc.document_id != flashcards.document_id
+        LIMIT 1
+    """
+    with db_pool.transaction() as conn:
+        row = conn.execute("SELECT id FROM documents WHERE name = ?", (document_name,)).fetchone()
+        if row is None:
+            return 0
+        removed = conn.execute(f"DELETE FROM flashcards WHERE document_id = ? AND NOT EXISTS ({other_document})",
+                               (row['id'],)).rowcount
+        conn.execute(f"UPDATE flashcards SET document_id = ({other_document}) WHERE document_id = ?", (row['id'],))
+        return removed
+
+def flashcard_deck():
+    """
+    (number of flashcards, deck version), read from the trigger-maintained
+    counters; the version changes whenever cards are added or deleted.
+    """
+    with db_pool.connection() as conn:
+        counters = dict(conn.execute(
+            "SELECT name, value FROM counters WHERE name IN ('flashcards', 'flashcards_version')").fetchall())
+    return counters.get('flashcards', 0), counters.get('flashcards_version', 0)
+
+def flashcard_position(card_id):
+    """The card's 0-based position in the deck (oldest first), or None if it is gone."""
+    with db_pool.connection() as conn:
+        if conn.execute("SELECT 1 FROM flashcards WHERE id = ?", (card_id,)).fetchone() is None:
+            return None
+        return conn.execute("SELECT COUNT(*) FROM flashcards WHERE id < ?", (card_id,)).fetchone()[0]
+
+def get_flashcard(card_id=None, position=None):
+    """
+    One flashcard, by ID or by 0-based position in the deck (oldest first),
+    as a dict with its id, question, answer, topic_id and document_id.
+    Returns None if there is no such card.
+    """
+    with db_pool.connection() as conn:
+        if card_id is not None:
+            row = conn.execute("SELECT * FROM flashcards WHERE id = ?", (card_id,)).fetchone()
+        else:
+            row = conn.execute("SELECT * FROM flashcards ORDER BY id LIMIT 1 OFFSET ?", (position or 0,)).fetchone()
+    return dict(row) if row else None
+
+def get_adjacent_flashcard(card_id, step=1):
+    """The card after (step=1) or before (step=-1) card_id: one primary-key seek, however big the deck."""
+    with db_pool.connection() as conn:
+        if step > 0:
+            row = conn.execute("SELECT * FROM flashcards WHERE id > ? ORDER BY id LIMIT 1", (card_id,)).fetchone()
+        else:
+            row = conn.execute("SELECT * FROM flashcards WHERE id < ? ORDER BY id DESC LIMIT 1", (card_id,)).fetchone()
+    return dict(row) if row else None
+
+def record_quiz_result(question_id, is_correct):
+    """
+    Records the outcome of a single quiz question.
+    This is the core of "performance tracking".
+    """
+    record_quiz_results([(question_id, is_correct)])
+
+def record_quiz_results(results):
+    """
+    Records a whole quiz submission, [(question_id, is_correct)], in one
+    transaction: one lock acquisition and one commit however many questions.
+    """
+    results = list(results)
+    if not results:
+        return
+    with db_pool.transaction() as conn:
+        conn.executemany(
+            "UPDATE quizzes SET correct_count = correct_count + 1 WHERE id = ?",
+            [(question_id,) for question_id, is_correct in results if is_correct]
+        )
+        conn.executemany(
+            "UPDATE quizzes SET incorrect_count = incorrect_count + 1 WHERE id = ?",
+            [(question_id,) for question_id, is_correct in results if not is_correct]
+        )
+        
+        # Also update the parent topics' 'last_revised' date
+        conn.executemany("""
+            UPDATE topics 
+            SET last_revised = ? 
+            WHERE id = (SELECT topic_id FROM quizzes WHERE id = ?)
+        """, [(datetime.date.today(), question_id) for question_id, _ in results])
+
+        # ...and each question's place in the spaced-repetition schedule
+        _apply_reviews(conn, 'quiz', [(question_id, quality_from_result(is_correct))
+                                      for question_id, is_correct in results])
+
+def _apply_reviews(conn, item_type, reviews, now=None):
+    """Updates the schedule row of each reviewed item, [(item_id, quality 0-5)]."""
+    now = time.time() if now is None else now
+    item_ids = list({item_id for item_id, _ in reviews})
+    states = {}
+    for i in range(0, len(item_ids), 500):
+        batch = item_ids[i:i + 500]
+        rows = conn.execute(f"""
+            SELECT item_id, repetitions, interval_days, ease, lapses FROM review_schedule
+            WHERE item_type = ? AND item_id IN ({','.join('?' * len(batch))})
+        """, [item_type] + batch)
+        states.update({row[0]: tuple(row[1:]) for row in rows})
+
+    rows = {}
+    for item_id, quality in reviews:
+        state = states.get(item_id, (0, 0.0, DEFAULT_EASE, 0))
+        repetitions, interval_days, ease, lapses, next_due = sm2_review(*state, quality, now)
+        states[item_id] = (repetitions, interval_days, ease, lapses)
+        rows[item_id] = (item_type, item_id, repetitions, interval_days, ease, lapses, next_due, now)
+    conn.executemany("""
+        INSERT INTO review_schedule (item_type, item_id, repetitions, interval_days, ease, lapses, next_due, last_reviewed)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (item_type, item_id) DO UPDATE SET
+            repetitions = excluded.repetitions, interval_days = excluded.interval_days, ease = excluded.ease,
+            lapses = excluded.lapses, next_due = excluded.next_due, last_reviewed = excluded.last_reviewed
+    """, list(rows.values()))
+
+def record_reviews(item_type, reviews, now=None):
+    """
+    Records self-graded reviews, [(item_id, quality 0-5)], of quizzes or
+    flashcards in one transaction; each one updates a single schedule row.
+    """
+    reviews = list(reviews)
+    if reviews:
+        with db_pool.transaction() as conn:
+            _apply_reviews(conn, item_type, reviews, now)
+
+def get_due_items(limit=20, item_type=None, now=None):
+    """
+    "What should I study now": the items whose review is due, most overdue
+    first. A range scan over the next-due index, so it reads `limit` rows
+    however large the schedule is.
+    """
+    now = time.time() if now is None else now
+    with db_pool.connection() as conn:
+        if item_type:
+            return conn.execute("""
+                SELECT * FROM review_schedule
+                WHERE item_type = ? AND next_due <= ?
+                ORDER BY next_due LIMIT ?
+            """, (item_type, now, limit)).fetchall()
+        return conn.execute("""
+            SELECT * FROM review_schedule WHERE next_due <= ? ORDER BY next_due LIMIT ?
+        """, (now, limit)).fetchall()
+
+def count_due(item_type=None, now=None):
+    now = time.time() if now is None else now
+    with db_pool.connection() as conn:
+        if item_type:
+            return conn.execute("SELECT COUNT(*) FROM review_schedule WHERE item_type = ? AND next_due <= ?",
+                                (item_type, now)).fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM review_schedule WHERE next_due <= ?", (now,)).fetchone()[0]
+
+def get_all_quizzes_for_ui():
+    """Fetches all quizzes for the Streamlit UI."""
+    with db_pool.connection() as conn:
+        quizzes = conn.execute("""
+            SELECT id, question, options, answer 
+            FROM quizzes
+        """).fetchall()
+    
+    # Parse the JSON options string back into a list
+    quiz_list = []
+    for q in quizzes:
+        quiz_list.append({
+            'id': q['id'],
+            'question': q['question'],
+            'options': json.loads(q['options']),
+            'answer': q['answer']
+        })
+    return quiz_list
+
+QUIZ_PAGE_SIZE = 10
+
+def get_quizzes_page(cursor=None, limit=QUIZ_PAGE_SIZE, topic_id=None, due_only=False, now=None):
+    """
+    One page of quizzes for the UI, using keyset pagination: pass the
+    returned next_cursor to get the following page (None = no more pages).
+    Each page is an index range scan, so its cost doesn't depend on how
+    many quizzes come before it, and only this page's options are decoded.
+    - topic_id: only that topic's quizzes
+    - due_only: only quizzes due for review, most overdue first
+    Returns (quizzes, next_cursor).
+    """
+    if due_only:
+        # Ordered by (next_due, id); the cursor is the last row's pair
+        now = time.time() if now is None else now
+        last_due, last_id = cursor or (float('-inf'), 0)
+        query = """
+            SELECT q.id, q.topic_id, q.question, q.options, q.answer, s.next_due
+            FROM review_schedule s JOIN quizzes q ON q.id = s.item_id
+            WHERE s.item_type = 'quiz' AND s.next_due <= ? AND (s.next_due, s.item_id) > (?, ?)
+        """
+        params = [now, last_due, last_id]
+        if topic_id is not None:
+            query += " AND q.topic_id = ?"
+            params.append(topic_id)
+        query += " ORDER BY s.next_due, s.item_id LIMIT ?"
+    else:
+        # Ordered by id; the cursor is the last row's id
+        query = "SELECT id, topic_id, question, options, answer FROM quizzes WHERE id > ?"
+        params = [cursor or 0]
+        if topic_id is not None:
+            query += " AND topic_id = ?"
+            params.append(topic_id)
+        query += " ORDER BY id LIMIT ?"
+    params.append(limit + 1)  # One extra row tells whether there is a next page
+
+    with db_pool.connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    page = rows[:limit]
+    quiz_list = [{
+        'id': q['id'],
+        'topic_id': q['topic_id'],
+        'question': q['question'],
+        'options': json.loads(q['options']),
+        'answer': q['answer']
+    } for q in page]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = (last['next_due'], last['id']) if due_only else last['id']
+    return quiz_list, next_cursor
+
+def get_topics_for_revision(limit=10):
+    """
+    This is the "smart" part.
+    It fetches topics, prioritizing those with the worst performance.
+    """
+    # Calculate a 'priority_score'
+    # Prioritizes:
+    # 1. High incorrect_count
+    # 2. Low correct_count
+    # 3. Topics that haven't been quizzed (incorrect_count = 0 and last_revised is NULL)
+    # The totals are maintained on write and idx_topics_priority matches the
+    # ORDER BY, so this reads `limit` rows instead of aggregating every quiz
+    query = """
+    SELECT 
+        id, 
+        content,
+        last_revised,
+        total_incorrect,
+        total_correct
+    FROM topics
+    ORDER BY total_incorrect DESC, total_correct ASC, last_revised ASC
+    LIMIT ?
+    """
+    
+    with db_pool.connection() as conn:
+        topics = conn.execute(query, (limit,)).fetchall()
     return topics
\ No newline at end of file
@@ -0,0 +1,42 @@
+# utils/fake_embedder.py
+# Local stand-in for the SentenceTransformer embedding model, for tests,
+# benchmarks and offline runs. Select it with EMBEDDING_BACKEND=fake; it
+# loads instantly and needs neither torch nor a model download. Its cached
+# embeddings are stored under its own name, fake:all-MiniLM-L6-v2.
+import re
+import zlib
+import numpy as np
+
+FAKE_EMBEDDING_DIM = 384  # Same as all-MiniLM-L6-v2
+
+class FakeEmbedder:
+    """
+    Deterministic bag-of-words embeddings: every word is hashed to a fixed
+    random direction and a text is the normalized sum of its words. Texts
+    sharing words are close, so retrieval still returns sensible chunks.
+    """
+    def __init__(self, dim=FAKE_EMBEDDING_DIM):
+        self.dim = dim
+        self._word_vectors = {}
+
+    def _word_vector(self, word):
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            vector = np.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(self.dim).astype('float32')
+            self._word_vectors[word] = vector
+        return vector
+
+    def encode(self, sentences, **kwargs):
+        """Like SentenceTransformer.encode: a 2-D array for a list, a vector for one string."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(texts), self.dim), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                embeddings[row] += self._word_vector(word)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms == 0, 1, norms)
+        return embeddings[0] if single else embeddings
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
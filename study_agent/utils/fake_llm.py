@@ -0,0 +1,121 @@
+# utils/fake_llm.py
+# Local stand-in for the Gemini model, for tests and offline runs.
+# Select it with LLM_BACKEND=fake; no API key or network is needed.
+import os
+import re
+import json
+import time
+import types
+import hashlib
+import threading
+
+FAKE_LLM_LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", 0.2))  # seconds before the first token
+FAKE_LLM_TOKEN_DELAY = float(os.environ.get("FAKE_LLM_TOKEN_DELAY", 0.02))  # seconds per streamed piece
+# Fraction of requests that fail with a (retryable) quota error
+FAKE_LLM_FAILURE_RATE = float(os.environ.get("FAKE_LLM_FAILURE_RATE", 0))
+# Fraction of responses cut off part-way, like a model hitting its output limit
+FAKE_LLM_TRUNCATION_RATE = float(os.environ.get("FAKE_LLM_TRUNCATION_RATE", 0))
+
+class FakeQuotaError(Exception):
+    """Raised for simulated failures; looks like a 429 to utils.llm_clients, so it is retried."""
+
+def _fake_flashcards(text, count=5, skip=0):
+    words = text.split()[skip:skip + count] or ["notes"]
+    return [{"question": f"What does the text say about '{word}'?", "answer": text[:120]} for word in words]
+
+def _fake_quizzes(text, count=3, skip=0):
+    words = (text.split() + ["A", "B", "C", "D"])[:4]
+    return [{"question": f"Question {i + 1} about: {text[:60]}", "options": words, "answer": words[0]}
+            for i in range(skip, skip + count)]
+
+def _avoided(prompt):
+    """How many earlier questions a follow-up prompt lists (see prompts.AVOID_QUESTIONS)."""
+    block = prompt.split("Do not repeat any of these questions:", 1)
+    return len(re.findall(r"^- ", block[1].split("\n\n", 1)[0], re.M)) if len(block) == 2 else 0
+
+def _count(prompt, pattern, default):
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else default
+
+def _section_text(prompt, marker):
+    match = re.search(marker + r"\s*---\n(.*?)\n---", prompt, re.S)
+    return match.group(1) if match else ""
+
+def fake_response(prompt):
+    """A deterministic, well-formed response for each prompt in utils/prompts.py."""
+    if "Question:" in prompt:
+        query = prompt.rsplit("Question:", 1)[1].split("Answer:", 1)[0].strip()
+        context = _section_text(prompt, "Context:")
+        return f"Based on your notes, here is what they say about \"{query}\": {context[:200]}"
+    sections = re.findall(r"^Section (\d+):\n---\n(.*?)\n---", prompt, re.M | re.S)
+    if sections:
+        flashcard_count = _count(prompt, r"- (\d+) flashcard", 5)
+        quiz_count = _count(prompt, r"- (\d+) multiple-choice", 3)
+        return json.dumps([{"section": int(number), "flashcards": _fake_flashcards(text, flashcard_count),
+                            "quizzes": _fake_quizzes(text, quiz_count)} for number, text in sections])
+    text = _section_text(prompt, "Text:")
+    if "quiz generator" in prompt:
+        return json.dumps(_fake_quizzes(text, _count(prompt, r"Make (\d+) multiple-choice", 3), _avoided(prompt)))
+    return json.dumps(_fake_flashcards(text, _count(prompt, r"Create (\d+) question-answer", 5), _avoided(prompt)))
+
+class FakeLLM:
+    """
+    Mimics the parts of genai.GenerativeModel the agents use:
+    generate_content(prompt, generation_config=None, stream=False, request_options=None).
+    With stream=True it returns an iterator of chunks with a .text attribute,
+    a few words at a time, like the real streaming API.
+    With a failure_rate, that fraction of requests raise FakeQuotaError, and
+    with a truncation_rate, that fraction of responses are cut off part-way.
+    Which requests are hit depends only on the seed, the prompt and how often
+    it was sent before, so runs are reproducible however threads interleave.
+    """
+    model_name = "fake-llm"
+
+    def __init__(self, latency=FAKE_LLM_LATENCY, token_delay=FAKE_LLM_TOKEN_DELAY, responder=fake_response,
+                 failure_rate=FAKE_LLM_FAILURE_RATE, truncation_rate=FAKE_LLM_TRUNCATION_RATE, seed=0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.responder = responder
+        self.failure_rate = failure_rate
+        self.truncation_rate = truncation_rate
+        self.seed = seed
+        self.calls = 0
+        self.failures = 0
+        self.truncations = 0
+        self._attempts = {}  # Prompt digest -> times sent
+        self._lock = threading.Lock()
+
+    def _roll(self, prompt):
+        """Two deterministic numbers in [0, 1) for this prompt and attempt."""
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).hexdigest()
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts[digest] = self._attempts.get(digest, 0) + 1
+        roll = hashlib.sha256(f"{digest}:{attempt}".encode("utf-8")).hexdigest()
+        return int(roll[:8], 16) / 2**32, int(roll[8:16], 16) / 2**32
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None):
+        fail_roll, truncate_roll = self._roll(prompt)
+        if fail_roll < self.failure_rate:
+            with self._lock:
+                self.failures += 1
+            time.sleep(self.latency)
+            raise FakeQuotaError("429 Resource has been exhausted (simulated by FakeLLM)")
+        text = self.responder(prompt)
+        if truncate_roll < self.truncation_rate:
+            with self._lock:
+                self.truncations += 1
+            # Cut somewhere in the second half, where a length limit would hit
+            text = text[:int(len(text) * (0.5 + truncate_roll / self.truncation_rate / 2))]
+        if stream:
+            return self._stream(text)
+        time.sleep(self.latency + self.token_delay * len(text.split()) / 4)
+        return types.SimpleNamespace(text=text)
+
+    def _stream(self, text):
+        time.sleep(self.latency)
+        words = re.findall(r"\S+\s*", text)
+        for i in range(0, len(words), 4):
+            if i:
+                time.sleep(self.token_delay)
+            yield types.SimpleNamespace(text="".join(words[i:i + 4]))
@@ -0,0 +1,115 @@
+# utils/jobs.py
+# Persistent queue of pipeline jobs in the study database. The app enqueues
+# uploads; worker processes (worker.py) claim them, report progress, and
+# record the outcome. Everything is in SQLite, so the UI can poll any job
+# from any session and a crashed worker's job is picked up again.
+import os
+import time
+from utils.database import db_pool
+
+# A running job whose worker hasn't reported for this long is considered crashed
+JOB_STALE_AFTER = float(os.environ.get("JOB_STALE_AFTER", 120))  # seconds
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+
+_schema_ready = False
+
+def _ensure_schema(conn):
+    global _schema_ready
+    if _schema_ready:
+        return
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pdf_path TEXT,
+        document_name TEXT,
+        status TEXT DEFAULT 'queued', -- queued, running, done or failed
+        stage TEXT, -- Last progress event (see main.iter_study_pipeline)
+        done INTEGER,
+        total INTEGER,
+        message TEXT,
+        error TEXT,
+        attempts INTEGER DEFAULT 0,
+        worker_id TEXT,
+        heartbeat_at REAL,
+        created_at REAL,
+        started_at REAL,
+        finished_at REAL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+    _schema_ready = True
+
+def enqueue_job(pdf_path):
+    """Adds a pipeline run for an uploaded PDF to the queue and returns its job ID."""
+    with db_pool.transaction() as conn:
+        _ensure_schema(conn)
+        return conn.execute(
+            "INSERT INTO jobs (pdf_path, document_name, status, message, created_at) VALUES (?, ?, 'queued', 'Waiting for a worker', ?)",
+            (pdf_path, os.path.basename(pdf_path), time.time())
+        ).lastrowid
+
+def claim_job(worker_id):
+    """
+    Atomically takes the oldest queued job, or a running job whose worker
+    stopped sending heartbeats (it crashed), for this worker.
+    Returns the job as a dict, or None if there is nothing to do.
+    """
+    now = time.time()
+    with db_pool.transaction() as conn:
+        _ensure_schema(conn)
+        # Crashed jobs that have used up their attempts fail instead of looping forever
+        conn.execute("""
+            UPDATE jobs SET status = 'failed', error = 'Worker crashed too many times', finished_at = ?
+            WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?
+        """, (now, now - JOB_STALE_AFTER, JOB_MAX_ATTEMPTS))
+        row = conn.execute("""
+            SELECT id FROM jobs
+            WHERE status = 'queued' OR (status = 'running' AND heartbeat_at < ?)
+            ORDER BY id LIMIT 1
+        """, (now - JOB_STALE_AFTER,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("""
+            UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1,
+                heartbeat_at = ?, started_at = COALESCE(started_at, ?), error = NULL
+            WHERE id = ?
+        """, (worker_id, now, now, row['id']))
+        return dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone())
+
+def heartbeat(job_id, worker_id):
+    """Tells the queue the worker is still alive. False if the job was taken over by another worker."""
+    with db_pool.transaction() as conn:
+        return conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                            (time.time(), job_id, worker_id)).rowcount > 0
+
+def update_job_progress(job_id, worker_id, event):
+    """Persists a pipeline progress event ({"stage", "done", "total", "message"}) for polling."""
+    with db_pool.transaction() as conn:
+        conn.execute("""
+            UPDATE jobs SET stage = ?, done = ?, total = ?, message = ?, heartbeat_at = ?
+            WHERE id = ? AND worker_id = ? AND status = 'running'
+        """, (event["stage"], event["done"], event["total"], event["message"], time.time(), job_id, worker_id))
+
+def finish_job(job_id, worker_id, error=None):
+    """Marks a job done, or failed with an error message."""
+    with db_pool.transaction() as conn:
+        conn.execute("""
+            UPDATE jobs SET status = ?, error = ?, finished_at = ?
+            WHERE id = ? AND worker_id = ? AND status = 'running'
+        """, ("failed" if error else "done", error, time.time(), job_id, worker_id))
+
+def get_job(job_id):
+    with db_pool.connection() as conn:
+        _ensure_schema(conn)
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+def list_jobs(limit=20, status=None):
+    """Most recent jobs first, optionally only those with the given status."""
+    with db_pool.connection() as conn:
+        _ensure_schema(conn)
+        if status:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit))
+        else:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
@@ -0,0 +1,150 @@
+# utils/json_salvage.py
+# Tolerant parsing of the JSON lists the LLM returns. Instead of one regex
+# and json.loads over the whole response (where any stray prose, markdown
+# fence or truncated last element loses everything), the outermost array
+# is scanned element by element and every complete, valid element is kept.
+import json
+
+class JSONArrayParser:
+    """
+    Incremental scanner for the first top-level JSON array in a text.
+    feed() text as it arrives and get back the elements completed so far;
+    close() at the end. Anything before the array (prose, ```json fences)
+    and after it is ignored. A response that is a single object instead of
+    an array is treated as a one-element array.
+    Elements that don't parse are counted in .malformed, and a cut-off
+    last element (the response was truncated) sets .truncated.
+    """
+    def __init__(self):
+        self.found = False  # Saw the start of an array / object
+        self.complete = False  # Saw its end
+        self.truncated = False
+        self.malformed = 0
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element_start = None
+        self._single_object = False
+
+    def feed(self, text):
+        """Scans more response text; returns the list of elements it completed."""
+        self._buffer += text
+        items = []
+        while self._pos < len(self._buffer) and not self.complete:
+            self._step(self._buffer[self._pos], self._pos, items)
+            self._pos += 1
+        return items
+
+    def close(self):
+        """Marks the end of the response; a still-open element is dropped as truncated."""
+        if self.found and not self.complete:
+            self.truncated = True
+
+    def _emit(self, start, end, items):
+        try:
+            items.append(json.loads(self._buffer[start:end]))
+        except json.JSONDecodeError:
+            self.malformed += 1
+        self._element_start = None
+
+    def _step(self, char, pos, items):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+            return
+
+        if not self.found:
+            # Whichever comes first: the array, or a lone object
+            if char == "[":
+                self.found, self._depth = True, 1
+            elif char == "{":
+                self.found, self._single_object, self._depth = True, True, 2
+                self._element_start = pos
+            return
+
+        if char == '"':
+            self._in_string = True
+            if self._depth == 1 and self._element_start is None:
+                self._element_start = pos
+        elif char in "[{":
+            if self._depth == 1 and self._element_start is None:
+                self._element_start = pos
+            self._depth += 1
+        elif char in "]}":
+            self._depth -= 1
+            if self._depth == 1 and self._element_start is not None:
+                # Closed an object/array element
+                self._emit(self._element_start, pos + 1, items)
+                self.complete = self._single_object
+            elif self._depth == 0:
+                # Closed the outer array; a pending number/string/literal ends here
+                if self._element_start is not None:
+                    self._emit(self._element_start, pos, items)
+                self.complete = True
+        elif self._depth == 1:
+            if char == ",":
+                if self._element_start is not None:
+                    self._emit(self._element_start, pos, items)
+            elif not char.isspace() and self._element_start is None:
+                self._element_start = pos
+
+def parse_json_array(text):
+    """
+    Non-streaming helper: returns (elements, parser) for a whole response,
+    the parser holding the found / complete / truncated / malformed flags.
+    """
+    parser = JSONArrayParser()
+    items = parser.feed(text or "")
+    parser.close()
+    return items, parser
+
+def _text(value):
+    """A stripped string for str/number values, else None."""
+    if isinstance(value, str):
+        return value.strip() or None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+def clean_flashcard(item):
+    """A {"question", "answer"} flashcard with non-empty strings, or None if the item doesn't fit."""
+    if not isinstance(item, dict):
+        return None
+    question, answer = _text(item.get("question")), _text(item.get("answer"))
+    if not question or not answer:
+        return None
+    return {"question": question, "answer": answer}
+
+def clean_quiz(item):
+    """
+    A {"question", "options", "answer"} MCQ with at least two distinct
+    options, one of them the answer (an answer given as an option letter,
+    e.g. "B", is mapped to that option), or None if the item doesn't fit.
+    """
+    if not isinstance(item, dict) or not isinstance(item.get("options"), list):
+        return None
+    question, answer = _text(item.get("question")), _text(item.get("answer"))
+    options = list(dict.fromkeys(option for option in map(_text, item["options"]) if option))
+    if not question or not answer or len(options) < 2:
+        return None
+    if answer not in options:
+        letter = answer.rstrip(").").upper()
+        if len(letter) == 1 and "A" <= letter < chr(ord("A") + len(options)):
+            answer = options[ord(letter) - ord("A")]
+        else:
+            return None
+    return {"question": question, "options": options, "answer": answer}
+
+def clean_items(items, clean):
+    """Applies a clean_* validator to a parsed list; returns (valid items, number rejected)."""
+    if not isinstance(items, list):
+        return [], 0
+    cleaned = [clean(item) for item in items]
+    valid = [item for item in cleaned if item is not None]
+    return valid, len(cleaned) - len(valid)
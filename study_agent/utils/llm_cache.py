@@ -0,0 +1,138 @@
+# utils/llm_cache.py
+import sqlite3
+import os
+import json
+import hashlib
+import time
+import threading
+import dataclasses
+
+CACHE_FILE = "vector_store/llm_cache.db"
+CACHE_MAX_MB = float(os.environ.get("LLM_CACHE_MAX_MB", 200))
+CACHE_MAX_AGE_DAYS = float(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", 30))
+# Set LLM_CACHE_DISABLED=1 to always go to the network
+CACHE_DISABLED = os.environ.get("LLM_CACHE_DISABLED", "0") == "1"
+
+def _config_to_dict(generation_config):
+    """Turns a GenerationConfig (dataclass, dict or None) into something JSON-stable."""
+    if generation_config is None:
+        return None
+    if isinstance(generation_config, dict):
+        return generation_config
+    if dataclasses.is_dataclass(generation_config):
+        return dataclasses.asdict(generation_config)
+    return vars(generation_config)
+
+class LLMCache:
+    """
+    Disk-backed, content-addressed cache of LLM responses.
+    Entries are keyed by a SHA-256 of (model name, prompt, generation config)
+    and evicted least-recently-used once the cache is too big or too old.
+    """
+    def __init__(self, path=CACHE_FILE, max_mb=CACHE_MAX_MB, max_age_days=CACHE_MAX_AGE_DAYS, enabled=not CACHE_DISABLED):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 3600
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                size INTEGER,
+                created_at REAL,
+                last_access REAL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def make_key(model_name, prompt, generation_config=None):
+        """Stable hash of everything that determines the model's response."""
+        payload = json.dumps(
+            {"model": model_name, "prompt": prompt, "config": _config_to_dict(generation_config)},
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                if row is None or now - row[1] > self.max_age:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self.hits += 1
+                return json.loads(row[0])
+            finally:
+                conn.close()
+
+    def put(self, key, value):
+        """Stores a successfully parsed response, then evicts old entries if needed."""
+        if not self.enabled:
+            return
+        value_json = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, value_json, len(value_json), now, now)
+                )
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn, now):
+        # 1. Age-based: drop anything older than max_age
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.max_age,))
+
+        # 2. Size-based: drop least recently used entries until under max_bytes
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+            conn.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+# Shared, process-wide cache instance
+llm_cache = LLMCache()
@@ -1,54 +1,249 @@
-# utils/llm_clients.py
-import os
-import json
-import re
-import google.generativeai as genai
-from dotenv import load_dotenv  
-
-load_dotenv()  
-
-# --- OPTION 2: Google Gemini (NOW ACTIVE) ---
-try:
-    api_key = os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY not found. Have you created a .env file?")
-        
-    genai.configure(api_key=api_key)
-    # --- THIS LINE IS THE FIX for Error 1 ---
-    model = genai.GenerativeModel('gemini-pro') 
-    
-    print("LLM Client: Configured Gemini successfully from .env file.")
-except Exception as e:
-    print(f"LLM Client Error: {e}")
-    model = None
-
-# --- Gemini Function for JSON ---
-def get_json_response_from_llm(prompt, model=model):
-    """
-    Sends a prompt to the LLM and attempts to parse a JSON response.
-    """
-    if not model:
-        print("Error: Gemini model is not initialized.")
-        return None
-        
-    # --- We also remove JSON mode, as gemini-pro is less reliable with it ---
-    try:
-        response = model.generate_content(prompt)
-        raw_output = response.text
-        
-        # Clean the output to find the JSON
-        json_match = re.search(r'\[.*\]|\{.*\}', raw_output, re.DOTALL)
-        
-        if not json_match:
-            print(f"Error: No JSON found in LLM response: {raw_output}")
-            return None
-
-        json_string = json_match.group(0)
-        return json.loads(json_string)
-
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from LLM response: {raw_output}")
-        return None
-    except Exception as e:
-        print(f"An error occurred calling LLM: {e}")
-        return None
+# utils/llm_clients.py
+import os
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from utils.llm_cache import llm_cache
+from utils.json_salvage import parse_json_array, clean_items
+from utils import metrics
+from utils.registry import get_llm_model
+
+load_dotenv()
+
+# --- Concurrency settings (override via .env) ---
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+LLM_REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", 60))  # seconds per request
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 5))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 1.0))  # seconds
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 30.0))  # seconds
+# Follow-up requests for items missing from a JSON response (0 = never ask again)
+JSON_TOP_UP_ROUNDS = int(os.environ.get("JSON_TOP_UP_ROUNDS", 1))
+
+# The Gemini client itself is configured lazily by utils.registry.get_llm_model()
+
+def estimate_tokens(text):
+    """Rough token count for budgeting prompts (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+def _is_quota_error(error):
+    """True for rate-limit / quota errors (HTTP 429) that are worth retrying."""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+def generate_text(prompt, model=None, generation_config=None):
+    """
+    Sends a prompt to the LLM (the shared Gemini model by default) and returns
+    the raw text. Each request has a timeout, and quota errors are retried
+    with exponential backoff plus full jitter.
+    """
+    model = model or get_llm_model()
+    metrics.observe("llm_prompt_chars", len(prompt), metrics.SIZE_BUCKETS)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            response = model.generate_content(
+                prompt,
+                generation_config=generation_config,
+                request_options={"timeout": LLM_REQUEST_TIMEOUT}
+            )
+            text = response.text
+            metrics.observe("llm_request_seconds", time.perf_counter() - start, mode="blocking")
+            metrics.observe("llm_response_chars", len(text or ""), metrics.SIZE_BUCKETS)
+            return text
+        except Exception as e:
+            if not _is_quota_error(e) or attempt == LLM_MAX_RETRIES:
+                metrics.inc("llm_errors_total", kind="quota" if _is_quota_error(e) else type(e).__name__)
+                raise
+            metrics.inc("llm_retries_total")
+            delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+            print(f"LLM Client: Quota error, retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_RETRIES})...")
+            time.sleep(delay)
+
+def _model_name(model):
+    return getattr(model, "model_name", type(model).__name__)
+
+def get_text_response_from_llm(prompt, model=None, generation_config=None, use_cache=True):
+    """
+    Like generate_text, but served from the persistent LLM cache when
+    the same (model, prompt, config) has been answered before.
+    """
+    model = model or get_llm_model()
+    cache_key = None
+    if use_cache and llm_cache.enabled:
+        cache_key = llm_cache.make_key(_model_name(model), prompt, generation_config)
+        cached = llm_cache.get(cache_key)
+        metrics.inc("llm_cache_lookups_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+    text = generate_text(prompt, model=model, generation_config=generation_config)
+    if cache_key and text:
+        llm_cache.put(cache_key, text)
+    return text
+
+def stream_text_from_llm(prompt, model=None, generation_config=None, use_cache=True, cancel_event=None):
+    """
+    Streaming version of get_text_response_from_llm: yields the response text
+    in increments as the model produces them. A cached response is yielded
+    in one piece. Quota errors are retried only before the first increment.
+    If cancel_event is set (or the caller stops iterating), the request is
+    abandoned and the partial response isn't cached.
+    """
+    model = model or get_llm_model()
+    cache_key = None
+    if use_cache and llm_cache.enabled:
+        cache_key = llm_cache.make_key(_model_name(model), prompt, generation_config)
+        cached = llm_cache.get(cache_key)
+        metrics.inc("llm_cache_lookups_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            yield cached
+            return
+
+    metrics.observe("llm_prompt_chars", len(prompt), metrics.SIZE_BUCKETS)
+    pieces = []
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            response = model.generate_content(
+                prompt,
+                generation_config=generation_config,
+                stream=True,
+                request_options={"timeout": LLM_REQUEST_TIMEOUT}
+            )
+            for chunk in response:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if chunk.text:
+                    if not pieces:
+                        metrics.observe("llm_first_token_seconds", time.perf_counter() - start)
+                    pieces.append(chunk.text)
+                    yield chunk.text
+            metrics.observe("llm_request_seconds", time.perf_counter() - start, mode="stream")
+            metrics.observe("llm_response_chars", sum(map(len, pieces)), metrics.SIZE_BUCKETS)
+            break
+        except Exception as e:
+            if pieces or not _is_quota_error(e) or attempt == LLM_MAX_RETRIES:
+                metrics.inc("llm_errors_total", kind="quota" if _is_quota_error(e) else type(e).__name__)
+                raise
+            metrics.inc("llm_retries_total")
+            delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+            print(f"LLM Client: Quota error, retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_RETRIES})...")
+            time.sleep(delay)
+
+    if cache_key and pieces:
+        llm_cache.put(cache_key, "".join(pieces))
+
+# --- Gemini Function for JSON ---
+def get_json_response_from_llm(prompt, model=None, use_cache=True):
+    """
+    Sends a prompt to the LLM and parses the JSON list in its response.
+    Every complete element is kept even if the response has extra prose,
+    a malformed element or a truncated end (see utils/json_salvage.py);
+    returns the list of elements, or None if no JSON was found at all.
+    Only cleanly parsed responses are cached on disk, so repeated prompts
+    skip the network but a salvaged response is asked for again next time
+    (a truncation is usually transient; caching it would keep the gap).
+    """
+    model = model or get_llm_model()
+    if not model:
+        print("Error: Gemini model is not initialized.")
+        return None
+
+    # Only successfully parsed JSON is cached, never a raw/broken response
+    cache_key = None
+    if use_cache and llm_cache.enabled:
+        cache_key = llm_cache.make_key(_model_name(model), prompt)
+        cached = llm_cache.get(cache_key)
+        metrics.inc("llm_cache_lookups_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached if isinstance(cached, list) else [cached]
+
+    # --- We also remove JSON mode, as gemini-pro is less reliable with it ---
+    try:
+        raw_output = generate_text(prompt, model=model)
+    except Exception as e:
+        print(f"An error occurred calling LLM: {e}")
+        return None
+
+    items, parser = parse_json_array(raw_output)
+    if not parser.found:
+        print(f"Error: No JSON found in LLM response: {raw_output}")
+        metrics.inc("llm_json_responses_total", outcome="failed")
+        return None
+    if parser.complete and not parser.malformed:
+        metrics.inc("llm_json_responses_total", outcome="complete")
+        if cache_key:
+            llm_cache.put(cache_key, items)
+    else:
+        print(f"LLM Client: Salvaged {len(items)} JSON items from a damaged response "
+              f"({parser.malformed} malformed{', truncated' if parser.truncated else ''}).")
+        metrics.inc("llm_json_responses_total", outcome="salvaged")
+        metrics.inc("llm_json_items_dropped_total", parser.malformed, reason="malformed")
+        metrics.inc("llm_json_items_dropped_total", int(parser.truncated), reason="truncated")
+    return items
+
+# --- Concurrent execution engine ---
+def run_concurrently(func, items, max_concurrency=None):
+    """
+    Applies func to every item on a bounded thread pool.
+    Results come back in the same order as items, no matter
+    which call finishes first.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    workers = max(1, min(max_concurrency or LLM_MAX_CONCURRENCY, len(items)))
+    if workers == 1:
+        return [func(item) for item in items]
+
+    # Calls on the pool record into the caller's run reports
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm") as executor:
+        return list(executor.map(metrics.in_run_context(func), items))
+
+def get_json_responses_from_llm(prompts, model=None, max_concurrency=None, use_cache=True):
+    """
+    Concurrent version of get_json_response_from_llm.
+    Returns one parsed response (or None) per prompt, in prompt order.
+    """
+    return run_concurrently(
+        lambda prompt: get_json_response_from_llm(prompt, model=model, use_cache=use_cache),
+        prompts,
+        max_concurrency=max_concurrency
+    )
+
+def collect_json_items(text_chunks, responses, expected, build_prompt, clean, kind, rounds=JSON_TOP_UP_ROUNDS):
+    """
+    Turns one parsed LLM response per chunk into that chunk's list of valid
+    items (clean validates/normalizes one item, e.g. json_salvage.clean_quiz).
+    Chunks left with fewer than expected items get a follow-up request for
+    just the missing ones: build_prompt(chunk, count, items so far) must ask
+    for count new items. Returns the lists, in chunk order.
+    """
+    item_lists = []
+    for response in responses:
+        valid, rejected = clean_items(response, clean)
+        metrics.inc("llm_json_items_total", len(valid), kind=kind, outcome="valid")
+        metrics.inc("llm_json_items_total", rejected, kind=kind, outcome="invalid")
+        item_lists.append(valid[:expected])
+
+    for _ in range(rounds):
+        short = [i for i, items in enumerate(item_lists) if len(items) < expected]
+        if not short:
+            break
+        missing = sum(expected - len(item_lists[i]) for i in short)
+        print(f"LLM Client: Requesting {missing} missing {kind} items for {len(short)} chunks...")
+        metrics.inc("llm_json_top_up_requests_total", len(short), kind=kind)
+        prompts = [build_prompt(text_chunks[i], expected - len(item_lists[i]), item_lists[i]) for i in short]
+        for i, response in zip(short, get_json_responses_from_llm(prompts)):
+            valid, rejected = clean_items(response, clean)
+            metrics.inc("llm_json_items_total", rejected, kind=kind, outcome="invalid")
+            # Skip repeats of items the chunk already has
+            seen = {item["question"] for item in item_lists[i]}
+            extra = [item for item in valid if item["question"] not in seen][:expected - len(item_lists[i])]
+            metrics.inc("llm_json_items_total", len(extra), kind=kind, outcome="topped_up")
+            item_lists[i] = item_lists[i] + extra
+    return item_lists
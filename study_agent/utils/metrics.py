@@ -0,0 +1,219 @@
+# utils/metrics.py
+# Lightweight in-process instrumentation: timing spans, histograms and
+# counters. Everything recorded for a pipeline run, on its own threads,
+# goes into a per-run JSON report (see run_metrics / write_report, and
+# in_run_context for threads), and the process-wide totals
+# can be scraped in the Prometheus text format (see start_metrics_server).
+# With METRICS_ENABLED=0 every call returns straight away.
+import os
+import time
+import json
+import bisect
+import random
+import threading
+import contextlib
+import contextvars
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+METRICS_REPORT_DIR = os.environ.get("METRICS_REPORT_DIR", "outputs/reports")
+# Port for the Prometheus endpoint (0 = off). Pipeline workers use the next ports up.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+MAX_SAMPLES = 2048  # Values kept per histogram for the report's percentiles
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+def _series_name(name, labels):
+    """Prometheus-style series name, e.g. pdf_pages_total{source="ocr"}."""
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+class Histogram:
+    """Fixed buckets (for Prometheus) plus a reservoir sample (for percentiles)."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = value
+
+    def summary(self):
+        values = sorted(self.samples)
+        def percentile(q):
+            return round(values[min(len(values) - 1, int(q * len(values)))], 6) if values else 0.0
+        return {"count": self.count, "sum": round(self.sum, 6), "p50": percentile(0.5),
+                "p95": percentile(0.95), "p99": percentile(0.99), "max": round(self.max, 6)}
+
+class MetricsRegistry:
+    """A thread-safe set of counters and histograms, keyed by (name, labels)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, key, value):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, key, value, buckets):
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def report(self):
+        """Counters and histogram summaries as a JSON-ready dict."""
+        with self._lock:
+            return {
+                "counters": {_series_name(*key): value for key, value in sorted(self.counters.items())},
+                "histograms": {_series_name(*key): histogram.summary() for key, histogram in sorted(self.histograms.items())},
+            }
+
+    def prometheus(self):
+        """All series in the Prometheus text exposition format."""
+        lines = []
+        typed = set()
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, "counter")
+                lines.append(f"{_series_name(name, labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                declare(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f"{_series_name(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{_series_name(name + '_sum', labels)} {histogram.sum}")
+                lines.append(f"{_series_name(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()  # Process-wide totals, served to Prometheus
+# Plus the registries of the runs the current thread works for (see run_metrics)
+_run_registries = contextvars.ContextVar("metrics_run_registries", default=())
+
+def inc(name, value=1, **labels):
+    """Adds value to a counter."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    registry.inc(key, value)
+    for target in _run_registries.get():
+        target.inc(key, value)
+
+def observe(name, value, buckets=SECONDS_BUCKETS, **labels):
+    """Records one value in a histogram (seconds by default; pass SIZE_BUCKETS for sizes)."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    registry.observe(key, value, buckets)
+    for target in _run_registries.get():
+        target.observe(key, value, buckets)
+
+class _Span:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name + "_seconds", time.perf_counter() - self.start, **self.labels)
+        return False
+
+_NULL_SPAN = contextlib.nullcontext()
+
+def span(name, **labels):
+    """Times the with-block into the <name>_seconds histogram."""
+    if not METRICS_ENABLED:
+        return _NULL_SPAN
+    return _Span(name, labels)
+
+@contextlib.contextmanager
+def run_metrics():
+    """
+    Collects everything recorded during the with-block into a fresh
+    MetricsRegistry (for a per-run report): on this thread, and on threads
+    it starts through in_run_context. Runs on other threads of the process
+    (e.g. concurrent jobs) are kept out of it.
+    """
+    run_registry = MetricsRegistry()
+    if METRICS_ENABLED:
+        _run_registries.set(_run_registries.get() + (run_registry,))
+    try:
+        yield run_registry
+    finally:
+        # Not a token reset: a generator's block can end after other runs were entered
+        _run_registries.set(tuple(target for target in _run_registries.get() if target is not run_registry))
+
+def in_run_context(func):
+    """
+    Wraps func (a thread target or a pool task) to run with the caller's
+    runs, so what it records goes into their reports too; new threads
+    don't inherit them otherwise. Each call gets its own copy of the
+    context, so the wrapper can run on several threads at once.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+def write_report(run_registry, name, **details):
+    """Saves a run's metrics (plus any details) as JSON and returns the file path."""
+    if not METRICS_ENABLED:
+        return None
+    os.makedirs(METRICS_REPORT_DIR, exist_ok=True)
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+    path = os.path.join(METRICS_REPORT_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{safe_name}.json")
+    with open(path, "w") as f:
+        json.dump({"name": name, "finished_at": time.time(), **details, **run_registry.report()}, f, indent=2)
+    return path
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the console
+
+_server = None
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serves this process's metrics for Prometheus on a background thread (once; port 0 = off)."""
+    global _server
+    if not METRICS_ENABLED or not port or _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics: Could not serve on port {port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"Metrics: Serving Prometheus metrics on port {port}.")
+    return _server
@@ -0,0 +1,170 @@
+# utils/near_duplicates.py
+# MinHash / LSH index of the chunks that flashcards and quizzes were
+# generated from, kept in the study database across documents. A new chunk
+# that is (nearly) the same text as an indexed one, e.g. a repeated slide,
+# boilerplate, or a lecture uploaded again with small edits, is routed to
+# that chunk's topic instead of going through generation and embedding.
+import os
+import re
+import json
+import zlib
+import hashlib
+import collections
+import numpy as np
+from utils.database import db_pool
+from utils.page_cache import content_hash
+
+# Estimated Jaccard similarity (of word 5-grams) from which chunks count as duplicates
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", 0.8))
+NEAR_DUP_DISABLED = os.environ.get("NEAR_DUP_DISABLED", "0") == "1"
+SHINGLE_WORDS = 5
+# 16 bands of 8 rows: chunks with a similarity above ~0.7 share a bucket with high probability.
+# Changing these invalidates the stored signatures.
+NUM_PERMUTATIONS = 128
+BAND_ROWS = 8
+
+# Multiply-shift hash functions, one per permutation: the top 32 bits of (a * x + b) mod 2**64, a odd
+_permutations = np.random.RandomState(42)
+_A = _permutations.randint(0, 1 << 63, size=NUM_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_B = _permutations.randint(0, 1 << 63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+# A topic is live while it has flashcards
+_LIVE_TOPIC = "EXISTS (SELECT 1 FROM topics t JOIN flashcards f ON f.topic_id = t.id WHERE t.chunk_hash = {column})"
+
+def minhash(text):
+    """MinHash signature (uint32 array) of a text's word 5-grams."""
+    words = re.findall(r'\w+', text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    # uint64 arithmetic wraps around, which is the mod 2**64
+    values = (np.outer(hashes, _A) + _B) >> np.uint64(32)
+    return values.min(axis=0).astype(np.uint32)
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(signature == other))
+
+def band_buckets(signature):
+    """One LSH bucket per band of the signature, as signed 64-bit ints for SQLite."""
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + signature[band * BAND_ROWS:(band + 1) * BAND_ROWS].tobytes(),
+                                       digest_size=8).digest(), "big", signed=True)
+        for band in range(NUM_PERMUTATIONS // BAND_ROWS)
+    ]
+
+class NearDuplicateIndex:
+    """
+    route() looks up a batch of chunks and tells, for each, which earlier
+    chunk's topic already covers it. Earlier chunks only count while their
+    topic still has flashcards (their document may have been deleted).
+    Chunks routed in this run are matched against each other as well, but
+    only saved by commit(), once generation has finished, so a failed run
+    leaves no routes to topics that were never created.
+    """
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD, enabled=not NEAR_DUP_DISABLED):
+        self.threshold = threshold
+        self.enabled = enabled
+        self._pending = {}  # chunk_hash -> (signature, duplicate_of) routed in this run
+        self._pending_buckets = collections.defaultdict(list)  # bucket -> [chunk_hash] of this run's originals
+
+    def route(self, chunks):
+        """
+        Returns, per chunk, the chunk_hash of the topic it duplicates (its
+        own digest for an exact repeat), or None if it is new material.
+        """
+        if not self.enabled or not chunks:
+            return [None] * len(chunks)
+        hashes = [content_hash(chunk) for chunk in chunks]
+        signatures = [minhash(chunk) for chunk in chunks]
+        buckets = [band_buckets(signature) for signature in signatures]
+        stored, candidates = self._lookup(hashes, {bucket for chunk_buckets in buckets for bucket in chunk_buckets})
+
+        routes = []
+        for chunk_hash, signature, chunk_buckets in zip(hashes, signatures, buckets):
+            if chunk_hash in self._pending:
+                # Repeated within this run
+                duplicate_of = self._pending[chunk_hash][1]
+                routes.append(duplicate_of or chunk_hash)
+                continue
+            if chunk_hash in stored:
+                # Seen in an earlier run, and its topic is still live
+                routes.append(stored[chunk_hash])
+                continue
+            best, best_similarity = None, self.threshold
+            for bucket in chunk_buckets:
+                for candidate, candidate_signature in candidates.get(bucket, []) + [
+                        (other, self._pending[other][0]) for other in self._pending_buckets.get(bucket, [])]:
+                    score = similarity(signature, candidate_signature)
+                    if score >= best_similarity:
+                        best, best_similarity = candidate, score
+            self._pending[chunk_hash] = (signature, best)
+            if best is None:
+                for bucket in chunk_buckets:
+                    self._pending_buckets[bucket].append(chunk_hash)
+            routes.append(best)
+        return routes
+
+    def _lookup(self, hashes, buckets):
+        """
+        Returns ({chunk_hash: topic chunk_hash} for chunks already indexed,
+        {bucket: [(chunk_hash, signature)]} of the live originals in the buckets).
+        """
+        stored, candidates = {}, collections.defaultdict(list)
+        with db_pool.connection() as conn:
+            unique_hashes = list(set(hashes))
+            for i in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[i:i + 500]
+                rows = conn.execute(f"""
+                    SELECT s.chunk_hash, COALESCE(s.duplicate_of, s.chunk_hash) AS topic_hash FROM chunk_signatures s
+                    WHERE s.chunk_hash IN ({','.join('?' * len(batch))})
+                    AND {_LIVE_TOPIC.format(column='COALESCE(s.duplicate_of, s.chunk_hash)')}
+                """, batch)
+                stored.update({row['chunk_hash']: row['topic_hash'] for row in rows})
+            buckets = list(buckets)
+            for i in range(0, len(buckets), 500):
+                batch = buckets[i:i + 500]
+                rows = conn.execute(f"""
+                    SELECT b.bucket, s.chunk_hash, s.signature FROM chunk_signature_bands b
+                    JOIN chunk_signatures s ON s.chunk_hash = b.chunk_hash
+                    WHERE b.bucket IN ({','.join('?' * len(batch))})
+                    AND s.duplicate_of IS NULL AND {_LIVE_TOPIC.format(column='s.chunk_hash')}
+                """, batch)
+                for row in rows:
+                    candidates[row['bucket']].append((row['chunk_hash'], np.frombuffer(row['signature'], dtype=np.uint32)))
+        return stored, candidates
+
+    def any_live(self, chunks):
+        """
+        Whether any of the chunks (e.g. a cached page's) has a live topic,
+        its own or the one it was routed to. Works with the index disabled too.
+        """
+        hashes = list({content_hash(chunk) for chunk in chunks})
+        with db_pool.connection() as conn:
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                row = conn.execute(f"""
+                    SELECT 1 FROM (SELECT value AS chunk_hash FROM json_each(?)) h
+                    LEFT JOIN chunk_signatures s ON s.chunk_hash = h.chunk_hash
+                    WHERE {_LIVE_TOPIC.format(column='COALESCE(s.duplicate_of, h.chunk_hash)')}
+                    LIMIT 1
+                """, (json.dumps(batch),)).fetchone()
+                if row:
+                    return True
+        return False
+
+    def commit(self):
+        """Saves the signatures and routes of this run's chunks."""
+        pending, self._pending = self._pending, {}
+        self._pending_buckets = collections.defaultdict(list)
+        if not pending:
+            return
+        with db_pool.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunk_signatures (chunk_hash, signature, duplicate_of) VALUES (?, ?, ?)",
+                [(chunk_hash, signature.tobytes(), duplicate_of) for chunk_hash, (signature, duplicate_of) in pending.items()]
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunk_signature_bands (bucket, chunk_hash) VALUES (?, ?)",
+                [(bucket, chunk_hash) for chunk_hash, (signature, duplicate_of) in pending.items()
+                 if duplicate_of is None for bucket in band_buckets(signature)]
+            )
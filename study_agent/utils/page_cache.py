@@ -0,0 +1,146 @@
+# utils/page_cache.py
+import sqlite3
+import os
+import json
+import hashlib
+import time
+import numpy as np
+
+PAGE_CACHE_FILE = "vector_store/page_cache.db"
+
+def content_hash(text):
+    """Stable SHA-256 digest of a piece of text (unlike hash(), same across runs)."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class PageCache:
+    """
+    Per-page cache for incremental re-ingest of edited PDFs.
+    - pages: extracted (possibly OCR'd) text per page content hash, plus the
+      page's chunks once the whole pipeline has processed it, and the
+      chunker settings they were made with (other settings re-chunk the
+      cached text instead of extracting it again).
+    - chunk_embeddings: embedding vectors keyed by chunk content hash.
+    - document_pages: which pages each uploaded document consists of, so
+      deleting a document can make its pages go through the pipeline again.
+    """
+    def __init__(self, path=PAGE_CACHE_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS pages (
+            page_hash TEXT PRIMARY KEY,
+            text TEXT,
+            chunks TEXT, -- JSON list, NULL until the page is fully processed
+            created_at REAL,
+            chunk_settings TEXT -- What the chunks were made with
+        )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(pages)")}
+        if "chunk_settings" not in columns:
+            conn.execute("ALTER TABLE pages ADD COLUMN chunk_settings TEXT")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_embeddings (
+            chunk_hash TEXT,
+            model_name TEXT,
+            embedding BLOB, -- float32 bytes
+            PRIMARY KEY (chunk_hash, model_name)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS document_pages (
+            document_name TEXT,
+            page_hash TEXT,
+            PRIMARY KEY (document_name, page_hash)
+        )
+        """)
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_pages(self, page_hashes, chunk_settings=""):
+        """
+        Returns {page_hash: (text, chunks or None)} for the hashes that are
+        cached. Chunks made with other chunk_settings come back as None.
+        """
+        conn = self._connect()
+        found = {}
+        for page_hash in set(page_hashes):
+            row = conn.execute("SELECT text, chunks, chunk_settings FROM pages WHERE page_hash = ?", (page_hash,)).fetchone()
+            if row:
+                current = row[1] is not None and row[2] == chunk_settings
+                found[page_hash] = (row[0], json.loads(row[1]) if current else None)
+        conn.close()
+        return found
+
+    def put_page_texts(self, items):
+        """Caches freshly extracted text, so OCR is skipped next time even if the pipeline fails later."""
+        conn = self._connect()
+        conn.executemany(
+            "INSERT OR IGNORE INTO pages (page_hash, text, created_at) VALUES (?, ?, ?)",
+            [(page_hash, text, time.time()) for page_hash, text in items]
+        )
+        conn.commit()
+        conn.close()
+
+    def mark_processed(self, items, chunk_settings=""):
+        """Stores the chunks of pages whose downstream processing has finished, and their chunk_settings."""
+        conn = self._connect()
+        conn.executemany(
+            "UPDATE pages SET chunks = ?, chunk_settings = ? WHERE page_hash = ?",
+            [(json.dumps(chunks), chunk_settings, page_hash) for page_hash, chunks in items]
+        )
+        conn.commit()
+        conn.close()
+
+    def set_document_pages(self, document_name, page_hashes):
+        """Records the pages of a document's latest upload."""
+        conn = self._connect()
+        conn.execute("DELETE FROM document_pages WHERE document_name = ?", (document_name,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO document_pages (document_name, page_hash) VALUES (?, ?)",
+            [(document_name, page_hash) for page_hash in page_hashes]
+        )
+        conn.commit()
+        conn.close()
+
+    def forget_document(self, document_name):
+        """
+        Marks a deleted document's pages as unprocessed again, so a re-upload
+        regenerates their flashcards instead of reusing the cached chunks.
+        Their text stays cached, so OCR is still skipped. Returns the number of pages.
+        """
+        conn = self._connect()
+        cursor = conn.execute("""
+            UPDATE pages SET chunks = NULL
+            WHERE page_hash IN (SELECT page_hash FROM document_pages WHERE document_name = ?)
+        """, (document_name,))
+        conn.execute("DELETE FROM document_pages WHERE document_name = ?", (document_name,))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount
+
+    def get_embeddings(self, model_name, chunk_hashes):
+        """Returns {chunk_hash: vector} for the chunks that were embedded before."""
+        conn = self._connect()
+        found = {}
+        for chunk_hash in set(chunk_hashes):
+            row = conn.execute(
+                "SELECT embedding FROM chunk_embeddings WHERE chunk_hash = ? AND model_name = ?",
+                (chunk_hash, model_name)
+            ).fetchone()
+            if row:
+                found[chunk_hash] = np.frombuffer(row[0], dtype='float32')
+        conn.close()
+        return found
+
+    def put_embeddings(self, model_name, items):
+        conn = self._connect()
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_embeddings (chunk_hash, model_name, embedding) VALUES (?, ?, ?)",
+            [(chunk_hash, model_name, np.asarray(vector, dtype='float32').tobytes()) for chunk_hash, vector in items]
+        )
+        conn.commit()
+        conn.close()
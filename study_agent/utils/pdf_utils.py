@@ -1,61 +1,257 @@
-# utils/pdf_utils.py
-import fitz  # PyMuPDF
-import re
-import pytesseract
-from PIL import Image
-import io
-
-def extract_text_from_pdf(pdf_path):
-    """
-    Extracts text from a PDF, automatically applying OCR to scanned pages.
-    Implements the "Supports both text and image-based documents" feature.
-    """
-    doc = fitz.open(pdf_path)
-    full_text = ""
-    print(f"PDF Utils: Processing {len(doc)} pages...")
-
-    for page_num, page in enumerate(doc):
-        # 1. Try to get text directly
-        page_text = page.get_text().strip()
-        
-        # 2. Check if text is meaningful (heuristic)
-        if len(page_text) < 100:  # Threshold for considering a page "scanned"
-            print(f"PDF Utils: Page {page_num+1} seems to be a scan. Running OCR...")
-            try:
-                # 3. If no text, render page as image and use OCR
-                pix = page.get_pixmap(dpi=300)  # High DPI for better OCR
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
-                
-                # 4. Use Pytesseract to extract text
-                ocr_text = pytesseract.image_to_string(img)
-                page_text = ocr_text
-            except Exception as e:
-                print(f"PDF Utils: OCR failed for page {page_num+1}: {e}")
-                page_text = ""  # Failed OCR, add no text
-        
-        full_text += page_text + "\n\n" # Add page break
-    
-    doc.close()
-    
-    # Clean up common PDF/OCR artifacts
-    full_text = re.sub(r'\s*\n\s*', '\n', full_text) # Consolidate multiple newlines
-    full_text = re.sub(r'(\w)-\n(\w)', r'\1\2', full_text) # Fix hyphenated word breaks
-    
-    print(f"PDF Utils: Extraction complete. Total characters: {len(full_text)}")
-    return full_text.encode('utf-8').decode('utf-8')
-
-def chunk_text(text, min_chunk_size=100):
-    """Splits text into meaningful chunks."""
-    # Split by double newlines (paragraphs)
-    chunks = text.split("\n\n")
-    
-    # Clean, strip, and filter chunks
-    cleaned_chunks = [c.strip() for c in chunks if len(c.strip()) > min_chunk_size]
-    
-    # If no good chunks found, try a simpler split
-    if not cleaned_chunks and text:
-        chunks = text.split("\n")
-        cleaned_chunks = [c.strip() for c in chunks if len(c.strip()) > min_chunk_size]
-
-    return cleaned_chunks
\ No newline at end of file
+# utils/pdf_utils.py
+import fitz  # PyMuPDF
+import re
+import pytesseract
+from PIL import Image
+import io
+import os
+import math
+import hashlib
+import collections
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from utils import metrics
+
+# Number of worker processes for page extraction/OCR (1 = serial)
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", os.cpu_count() or 1))
+# Pages with less text than this are treated as scans and OCR'd
+SCANNED_PAGE_THRESHOLD = 100
+OCR_DPI = 300
+# Bump when the extracted text changes shape, so cached page texts are redone
+EXTRACTION_VERSION = "blocks-1"
+# Short blocks repeated at the same place at the top or bottom of at least
+# this many pages, and this fraction of all pages, are headers/footers
+HEADER_FOOTER_MIN_PAGES = int(os.environ.get("HEADER_FOOTER_MIN_PAGES", 3))
+HEADER_FOOTER_MIN_FRACTION = float(os.environ.get("HEADER_FOOTER_MIN_FRACTION", 0.5))
+EDGE_BLOCKS = 2  # Blocks at each end of a page that can be a header/footer
+FURNITURE_MAX_WORDS = 10  # Longer blocks are content, however often they repeat
+# Bump when header/footer detection changes, so chunks cached with the old one are redone
+HEADER_FOOTER_VERSION = "edges-2"
+# A page number on its own: "12", "- 12 -", "Page 12", "12 / 40", "Page 12 of 40"
+PAGE_NUMBER = re.compile(r'(page|pg\.?|p\.|slide)?\s*[-–—(]?\s*\d+\s*[-–—)]?\s*((of|/)\s*\d+)?', re.IGNORECASE)
+
+def _page_blocks_text(page):
+    """
+    The page's text blocks (paragraphs, headings, list items as PyMuPDF
+    lays them out) in reading order, separated by blank lines.
+    """
+    blocks = page.get_text("blocks")
+    # (x0, y0, x1, y1, text, block_no, block_type); type 1 is an image
+    return "\n\n".join(block[4].strip() for block in blocks if block[6] == 0 and block[4].strip())
+
+def _extract_page_text(page, page_num):
+    """
+    Extracts the text of a single page, applying OCR if it looks scanned.
+    Only one pixmap is alive at a time, so memory stays bounded per worker.
+    Returns (text, source), where source is "text", "ocr" or "ocr_failed".
+    """
+    # 1. Try to get text directly, one paragraph per block
+    page_text = _page_blocks_text(page)
+    source = "text"
+    
+    # 2. Check if text is meaningful (heuristic)
+    if len(page_text) < SCANNED_PAGE_THRESHOLD:  # Threshold for considering a page "scanned"
+        print(f"PDF Utils: Page {page_num+1} seems to be a scan. Running OCR...")
+        try:
+            # 3. If no text, render page as image and use OCR
+            pix = page.get_pixmap(dpi=OCR_DPI)  # High DPI for better OCR
+            img_data = pix.tobytes("png")
+            pix = None  # Free the raw pixmap before OCR
+            img = Image.open(io.BytesIO(img_data))
+            
+            # 4. Use Pytesseract to extract text
+            ocr_text = pytesseract.image_to_string(img)
+            page_text = ocr_text
+            source = "ocr"
+        except Exception as e:
+            print(f"PDF Utils: OCR failed for page {page_num+1}: {e}")
+            page_text = ""  # Failed OCR, add no text
+            source = "ocr_failed"
+    
+    return page_text, source
+
+def _timed_extract(page, page_num):
+    """_extract_page_text plus its duration, so workers can report timings back."""
+    start = time.perf_counter()
+    page_text, source = _extract_page_text(page, page_num)
+    return page_text, source, time.perf_counter() - start
+
+def compute_page_hash(doc, page):
+    """
+    Hash of everything that determines a page's extracted text: its content
+    stream, its embedded images, and the extraction/OCR settings.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{EXTRACTION_VERSION}:{SCANNED_PAGE_THRESHOLD}:{OCR_DPI}:{page.rotation}".encode('utf-8'))
+    digest.update(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+    return digest.hexdigest()
+
+def _extract_page_list(pdf_path, page_nums):
+    """
+    Worker task: opens its own copy of the PDF (fitz documents can't be
+    shared across processes) and extracts the given pages in order, as
+    (text, source, seconds) tuples.
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        return [_timed_extract(doc[page_num], page_num) for page_num in page_nums]
+    finally:
+        doc.close()
+
+def _init_extraction_worker():
+    # Each worker already owns a core; stop Tesseract from spawning extra threads
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+def _finish_page(page, extracted, newly_extracted, page_cache):
+    """
+    Fills in a page's text from its extraction result (a worker future or a
+    (text, source, seconds) tuple) and caches fresh extractions.
+    """
+    if newly_extracted:
+        page_text, source, seconds = extracted.result()[0] if isinstance(extracted, Future) else extracted
+        page["text"] = page_text
+        metrics.inc("pdf_pages_total", source=source)
+        metrics.observe("pdf_page_extract_seconds", seconds, source=source)
+        if page_cache:
+            page_cache.put_page_texts([(page["page_hash"], page["text"])])
+    else:
+        metrics.inc("pdf_pages_total", source="cache")
+    return page
+
+def iter_pages_from_pdf(pdf_path, workers=None, page_cache=None, cache_settings=""):
+    """
+    Yields every page, in page order, as a dict with its "page_num",
+    "page_count" and raw "text", as soon as it is ready.
+    With a page_cache, each page also gets its "page_hash"; cached pages skip
+    extraction/OCR, and pages already fully processed come with their "chunks".
+    Cached chunks only come back if they were made with cache_settings
+    (e.g. the chunker's); otherwise the page comes with its cached text only.
+    With more than one worker, the text layer is still read here (quicker
+    than a round trip to a worker), and only pages that look scanned are
+    OCR'd on a process pool, which starts with the first of them. At most 2
+    pages per worker are in flight, so a slow consumer applies backpressure.
+    """
+    doc = fitz.open(pdf_path)
+    page_count = len(doc)
+    workers = max(1, min(workers or PDF_WORKERS, page_count or 1))
+    max_in_flight = workers * 2
+    print(f"PDF Utils: Processing {page_count} pages with {workers} worker(s)...")
+
+    executor = None
+    if workers > 1:
+        # This runs on a pipeline thread while other threads may hold locks, which a
+        # forked child would inherit locked; spawned workers start clean
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_init_extraction_worker)
+    pending = collections.deque()  # (page, future or result, newly_extracted), in page order
+    try:
+        for page_num in range(page_count):
+            page = {"page_num": page_num, "page_count": page_count, "page_hash": None, "text": None, "chunks": None}
+            if page_cache:
+                page["page_hash"] = compute_page_hash(doc, doc[page_num])
+                cached = page_cache.get_pages([page["page_hash"]], cache_settings).get(page["page_hash"])
+                if cached:
+                    page["text"], page["chunks"] = cached
+
+            extracted = None
+            newly_extracted = page["text"] is None
+            if newly_extracted:
+                if executor:
+                    start = time.perf_counter()
+                    page_text = _page_blocks_text(doc[page_num])
+                    if len(page_text) >= SCANNED_PAGE_THRESHOLD:
+                        extracted = (page_text, "text", time.perf_counter() - start)
+                    else:
+                        # The task opens its own copy of the PDF in the worker
+                        extracted = executor.submit(_extract_page_list, pdf_path, [page_num])
+                else:
+                    extracted = _timed_extract(doc[page_num], page_num)
+            pending.append((page, extracted, newly_extracted))
+
+            # Hand over finished pages in order; block once too many are in flight
+            while pending and (not isinstance(pending[0][1], Future) or pending[0][1].done() or len(pending) > max_in_flight):
+                yield _finish_page(*pending.popleft(), page_cache)
+
+        while pending:
+            yield _finish_page(*pending.popleft(), page_cache)
+    finally:
+        doc.close()
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+def extract_pages_from_pdf(pdf_path, workers=None, page_cache=None):
+    """Non-streaming version of iter_pages_from_pdf: returns all pages as a list."""
+    return list(iter_pages_from_pdf(pdf_path, workers=workers, page_cache=page_cache))
+
+def _furniture_key(block):
+    """
+    Normalized block text. Page numbers on their own all get the same key,
+    so "Page 3" and "Page 4" count as the same footer; numbers in any other
+    text (e.g. "Topic 3 overview") keep it apart from its neighbours.
+    """
+    text = re.sub(r'\s+', ' ', block).strip().lower()
+    return "#" if PAGE_NUMBER.fullmatch(text) else text
+
+def _edge_blocks(blocks):
+    """(position, block) of the blocks that can be furniture: 0, 1, ... from the top, -1, -2, ... from the bottom."""
+    return ([(position, block) for position, block in enumerate(blocks[:EDGE_BLOCKS])] +
+            [(-1 - position, block) for position, block in enumerate(reversed(blocks[-EDGE_BLOCKS:]))])
+
+def find_headers_footers(pdf_path, min_pages=HEADER_FOOTER_MIN_PAGES, min_fraction=HEADER_FOOTER_MIN_FRACTION):
+    """
+    Finds the running headers and footers of a PDF: short blocks that recur
+    (up to page numbers) at the same position among the first or last
+    EDGE_BLOCKS blocks of at least min_pages pages and min_fraction of all
+    pages. Reads only the text layer, which is quick; scanned pages don't
+    contribute. Returns a set of (position, key) for strip_headers_footers.
+    """
+    counts = collections.Counter()
+    doc = fitz.open(pdf_path)
+    try:
+        page_count = len(doc)
+        for page in doc:
+            blocks = _page_blocks_text(page).split("\n\n")
+            counts.update({(position, _furniture_key(block)) for position, block in _edge_blocks(blocks)
+                           if block and len(block.split()) <= FURNITURE_MAX_WORDS})
+    finally:
+        doc.close()
+    threshold = max(min_pages, math.ceil(min_fraction * page_count))
+    return {key for key, count in counts.items() if count >= threshold}
+
+def strip_headers_footers(text, furniture):
+    """Removes the header/footer blocks found by find_headers_footers from the ends of a page's text."""
+    if not furniture:
+        return text
+    blocks = text.split("\n\n")
+    start, end = 0, len(blocks)
+    while start < min(EDGE_BLOCKS, end) and (start, _furniture_key(blocks[start])) in furniture:
+        start += 1
+    while end > max(start, len(blocks) - EDGE_BLOCKS) and (end - 1 - len(blocks), _furniture_key(blocks[end - 1])) in furniture:
+        end -= 1
+    return "\n\n".join(blocks[start:end])
+
+def clean_text(text):
+    """
+    Cleans up common PDF/OCR artifacts. Paragraphs (blank-line separated
+    blocks) are kept apart; the line breaks inside one are unwrapped.
+    """
+    text = re.sub(r'(\w)-\n(\w)', r'\1\2', text) # Fix hyphenated word breaks
+    paragraphs = (re.sub(r'\s+', ' ', p).strip() for p in re.split(r'\n\s*\n', text))
+    return "\n\n".join(p for p in paragraphs if p)
+
+def extract_text_from_pdf(pdf_path, workers=None, page_cache=None):
+    """
+    Extracts text from a PDF, automatically applying OCR to scanned pages.
+    Implements the "Supports both text and image-based documents" feature.
+    """
+    pages = extract_pages_from_pdf(pdf_path, workers=workers, page_cache=page_cache)
+    full_text = "\n\n".join(page["text"] for page in pages) # Add page breaks
+    
+    # Clean up common PDF/OCR artifacts
+    full_text = clean_text(full_text)
+    
+    print(f"PDF Utils: Extraction complete. Total characters: {len(full_text)}")
+    return full_text.encode('utf-8').decode('utf-8')
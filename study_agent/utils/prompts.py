@@ -1,51 +1,82 @@
-# utils/prompts.py
-
-FLASHCARD_PROMPT = """
-You are a flashcard generator.
-Create 5 question-answer pairs from the following text.
-Return output *only* in a valid JSON list format.
-Do not include any other text before or after the JSON.
-
-Example Output:
-[
-  {{"question": "What is an Operating System?", "answer": "Software that manages computer hardware and software resources."}},
-  {{"question": "Name two types of OS.", "answer": "Batch OS, Real-time OS"}}
-]
-
-Text:
----
-{text_chunk}
----
-"""
-
-QUIZ_PROMPT = """
-You are a quiz generator.
-Make 3 multiple-choice questions from this text.
-Each question must have 4 options and one correct answer.
-Return output *only* in a valid JSON list format.
-
-Example Output:
-[
-  {{"question": "Which of the following is an OS?", "options": [ "Compiler", "Assembler", "Batch", "Linker"], "answer": "Batch"}}
-]
-
-Text:
----
-{text_chunk}
----
-"""
-
-DOUBT_PROMPT = """
-You are a helpful study assistant.
-Answer the user's question based *only* on the provided context.
-If the answer is not in the context, say "I'm sorry, I don't have information on that topic from your notes."
-
-Context:
----
-{context}
----
-
-Question: {query}
-
-Answer:
-"""
+# utils/prompts.py
+
+FLASHCARD_PROMPT = """
+You are a flashcard generator.
+Create {count} question-answer pairs from the following text.
+Return output *only* in a valid JSON list format.
+Do not include any other text before or after the JSON.
+{avoid}
+Example Output:
+[
+  {{"question": "What is an Operating System?", "answer": "Software that manages computer hardware and software resources."}},
+  {{"question": "Name two types of OS.", "answer": "Batch OS, Real-time OS"}}
+]
+
+Text:
+---
+{text_chunk}
+---
+"""
+
+QUIZ_PROMPT = """
+You are a quiz generator.
+Make {count} multiple-choice questions from this text.
+Each question must have 4 options and one correct answer.
+Return output *only* in a valid JSON list format.
+{avoid}
+Example Output:
+[
+  {{"question": "Which of the following is an OS?", "options": [ "Compiler", "Assembler", "Batch", "Linker"], "answer": "Batch"}}
+]
+
+Text:
+---
+{text_chunk}
+---
+"""
+
+DOUBT_PROMPT = """
+You are a helpful study assistant.
+Answer the user's question based *only* on the provided context.
+If the answer is not in the context, say "I'm sorry, I don't have information on that topic from your notes."
+
+Context:
+---
+{context}
+---
+
+Question: {query}
+
+Answer:
+"""
+
+
+STUDY_PACK_PROMPT = """
+You are a study material generator.
+For EACH numbered section of text below, create:
+- {flashcard_count} flashcard question-answer pairs
+- {quiz_count} multiple-choice questions, each with 4 options and one correct answer
+Return output *only* in a valid JSON list format, with one object per section.
+Use the section's number as "section". Do not include any other text before or after the JSON.
+
+Example Output:
+[
+  {{"section": 1,
+    "flashcards": [{{"question": "What is an Operating System?", "answer": "Software that manages computer hardware and software resources."}}],
+    "quizzes": [{{"question": "Which of the following is an OS?", "options": [ "Compiler", "Assembler", "Batch", "Linker"], "answer": "Batch"}}]
+  }}
+]
+
+{sections}
+"""
+
+STUDY_PACK_SECTION = """Section {number}:
+---
+{text_chunk}
+---
+"""
+
+# Added to a follow-up request for items missing from an earlier response
+AVOID_QUESTIONS = """Do not repeat any of these questions:
+{questions}
+"""
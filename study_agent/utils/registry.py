@@ -0,0 +1,97 @@
+# utils/registry.py
+# Process-wide registry of heavy, shareable resources: the embedding model,
+# the FAISS vector store and the Gemini client. Each is loaded at most once
+# per process, on first use, and every agent / Streamlit session gets the
+# same reference. torch, faiss and google.generativeai are imported lazily.
+import os
+import threading
+from dotenv import load_dotenv
+from utils.vector_store import VectorStore
+
+load_dotenv()
+
+LLM_MODEL_NAME = 'gemini-pro'
+# Set LLM_BACKEND=fake to use the local FakeLLM (utils/fake_llm.py) instead of Gemini
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "gemini")
+# Set EMBEDDING_BACKEND=fake to use the local FakeEmbedder (utils/fake_embedder.py)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "sentence-transformers")
+# Fake embeddings get their own name, so they are never cached as the real model's
+FAKE_EMBEDDING_PREFIX = 'fake:'
+EMBEDDING_MODEL_NAME = (FAKE_EMBEDDING_PREFIX if EMBEDDING_BACKEND == "fake" else '') + 'all-MiniLM-L6-v2'
+
+# One lock per resource, so loading the embedding model doesn't block the LLM
+_embedding_lock = threading.Lock()
+_vector_store_lock = threading.Lock()
+_llm_lock = threading.Lock()
+
+_embedding_models = {}
+_vector_store = {"version": None, "store": None}
+_llm = {"loaded": False, "model": None}
+
+def get_embedding_model(model_name=EMBEDDING_MODEL_NAME):
+    """Returns the shared SentenceTransformer (or FakeEmbedder for 'fake:' names), loading it on first use."""
+    with _embedding_lock:
+        if model_name not in _embedding_models:
+            if model_name.startswith(FAKE_EMBEDDING_PREFIX):
+                from utils.fake_embedder import FakeEmbedder
+                _embedding_models[model_name] = FakeEmbedder()
+                print("Registry: Using the local fake embedding model.")
+            else:
+                from sentence_transformers import SentenceTransformer  # Pulls in torch
+                _embedding_models[model_name] = SentenceTransformer(model_name)
+                print(f"Registry: Loaded embedding model '{model_name}'.")
+        return _embedding_models[model_name]
+
+def _load_vector_store():
+    """The shared VectorStore, reloaded only when a newer index has been saved."""
+    with _vector_store_lock:
+        version = VectorStore.current_version()
+        if version is None:
+            if not VectorStore.has_legacy_files():
+                return None
+            # Old chunks.pkl layout: load() migrates it to the database once
+            VectorStore.load()
+            version = VectorStore.current_version()
+        if version != _vector_store["version"]:
+            _vector_store.update(version=version, store=VectorStore.load())
+            print("Registry: Loaded vector store.")
+        return _vector_store["store"]
+
+def get_vector_store():
+    """
+    Returns the shared VectorStore for the whole library, or None if no
+    study material has been processed yet. Only the FAISS index is held in
+    memory; chunk text is fetched from the database per search hit.
+    """
+    return _load_vector_store()
+
+def list_documents():
+    """[(document name, number of chunks)] currently in the library."""
+    store = _load_vector_store()
+    return store.list_documents() if store else []
+
+def get_llm_model():
+    """Returns the shared Gemini model (or None if it couldn't be configured)."""
+    with _llm_lock:
+        if not _llm["loaded"]:
+            _llm["loaded"] = True
+            if LLM_BACKEND == "fake":
+                from utils.fake_llm import FakeLLM
+                _llm["model"] = FakeLLM()
+                print("LLM Client: Using the local fake LLM.")
+                return _llm["model"]
+            # --- OPTION 2: Google Gemini (NOW ACTIVE) ---
+            try:
+                api_key = os.environ.get("GOOGLE_API_KEY")
+                if not api_key:
+                    raise ValueError("GOOGLE_API_KEY not found. Have you created a .env file?")
+
+                import google.generativeai as genai
+                genai.configure(api_key=api_key)
+                _llm["model"] = genai.GenerativeModel(LLM_MODEL_NAME)
+
+                print("LLM Client: Configured Gemini successfully from .env file.")
+            except Exception as e:
+                print(f"LLM Client Error: {e}")
+                _llm["model"] = None
+        return _llm["model"]
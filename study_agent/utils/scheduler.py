@@ -0,0 +1,41 @@
+# utils/scheduler.py
+# SM-2 spaced-repetition scheduling. Pure functions only; the schedule
+# itself is stored in the review_schedule table (see utils/database.py).
+import os
+
+DAY = 24 * 3600  # seconds
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+# Max days between reviews, so nothing disappears from the queue for years
+MAX_INTERVAL_DAYS = float(os.environ.get("REVIEW_MAX_INTERVAL_DAYS", 365))
+
+# Quiz answers are right/wrong; map them onto SM-2's 0-5 grades
+QUALITY_CORRECT = 4
+QUALITY_INCORRECT = 1
+
+def quality_from_result(is_correct):
+    return QUALITY_CORRECT if is_correct else QUALITY_INCORRECT
+
+def sm2_review(repetitions, interval_days, ease, lapses, quality, now):
+    """
+    Applies one review with the given quality (0-5) to an item's state.
+    Returns (repetitions, interval_days, ease, lapses, next_due), with
+    next_due as a Unix timestamp.
+    """
+    if quality >= 3:
+        if repetitions == 0:
+            interval_days = 1.0
+        elif repetitions == 1:
+            interval_days = 6.0
+        else:
+            interval_days = interval_days * ease
+        repetitions += 1
+    else:
+        # Forgotten: start over with short intervals
+        repetitions = 0
+        interval_days = 1.0
+        lapses += 1
+
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    interval_days = min(interval_days, MAX_INTERVAL_DAYS)
+    return repetitions, interval_days, ease, lapses, now + interval_days * DAY
@@ -0,0 +1,426 @@
+# utils/vector_store.py
+import os
+import math
+import json
+import time
+import pickle
+import contextlib
+import numpy as np
+from utils.page_cache import content_hash
+from utils.database import db_pool
+
+VECTOR_STORE_DIR = "vector_store"
+# Pre-SQLite format, migrated automatically on first load
+LEGACY_INDEX_PATH = "vector_store/study_material.index"
+LEGACY_CHUNKS_PATH = "vector_store/chunks.pkl"
+LEGACY_DOCUMENT = "(earlier upload)"
+
+# Corpus sizes (in chunks) at which the index switches from exact search
+# to approximate HNSW, and from HNSW to IVF
+HNSW_THRESHOLD = int(os.environ.get("VECTOR_INDEX_HNSW_THRESHOLD", 50_000))
+IVF_THRESHOLD = int(os.environ.get("VECTOR_INDEX_IVF_THRESHOLD", 1_000_000))
+
+SQL_BATCH = 500  # Max IDs per "IN (...)" query
+
+def ivf_nlist(ntotal):
+    """
+    ~4*sqrt(n) IVF lists, rounded to a power of two, but no more than
+    n / 39: faiss wants at least 39 training vectors per list, and fewer
+    gives poorly placed centroids (or fails to train below one per list).
+    """
+    nlist = 2 ** round(math.log2(4 * math.sqrt(max(1, ntotal))))
+    return max(1, min(nlist, ntotal // 39))
+
+def choose_index_params(ntotal):
+    """Picks the index type and its build/search parameters for a corpus size."""
+    if ntotal < HNSW_THRESHOLD:
+        return {"type": "flat"}
+    if ntotal < IVF_THRESHOLD:
+        return {"type": "hnsw", "M": 32, "ef_construction": 200, "ef_search": 128}
+    # Probe ~1/64 of the lists
+    nlist = ivf_nlist(ntotal)
+    return {"type": "ivf", "nlist": nlist, "nprobe": max(8, nlist // 64)}
+
+def apply_search_params(index, params):
+    """Sets the query-time parameters, which faiss doesn't reliably persist."""
+    import faiss
+    if params["type"] == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = params["ef_search"]
+    elif params["type"] == "ivf":
+        index.nprobe = params["nprobe"]
+
+def build_index(params, dimension, vectors=None, ids=None):
+    """
+    Builds an ID-addressable index of the given type, adding vectors if given.
+    - flat: exact IndexFlatL2 (in an IndexIDMap2)
+    - hnsw: IndexHNSWFlat (in an IndexIDMap2); doesn't support removal
+    - ivf:  IndexIVFFlat with native IDs, trained on (a sample of) vectors
+    """
+    import faiss
+    if params["type"] == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dimension, params["M"])
+        hnsw.hnsw.efConstruction = params["ef_construction"]
+        index = faiss.IndexIDMap2(hnsw)
+    elif params["type"] == "ivf":
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFFlat(quantizer, dimension, params["nlist"])
+        sample_size = min(len(vectors), params["nlist"] * 256)
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+        index.train(sample)
+        # A hashtable direct map allows reconstruct() and remove_ids() by chunk ID
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    else:
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+    apply_search_params(index, params)
+    if vectors is not None and len(vectors):
+        index.add_with_ids(vectors, ids)
+    return index
+
+def _batched(items, size=SQL_BATCH):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _placeholders(items):
+    return ','.join('?' * len(items))
+
+def _ensure_schema(conn):
+    # Chunk text lives here, keyed by FAISS ID, instead of a pickled list
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chunks (
+        id INTEGER PRIMARY KEY, -- Same as the chunk's FAISS ID
+        chunk_hash TEXT UNIQUE,
+        content TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE,
+        uploaded_at TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS document_chunks (
+        document_id INTEGER,
+        chunk_id INTEGER,
+        position INTEGER,
+        PRIMARY KEY (document_id, chunk_id),
+        FOREIGN KEY (document_id) REFERENCES documents (id),
+        FOREIGN KEY (chunk_id) REFERENCES chunks (id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_document_chunks_chunk ON document_chunks (chunk_id)")
+    conn.execute("CREATE TABLE IF NOT EXISTS vector_store_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+_schema_ready = False
+
+@contextlib.contextmanager
+def _connect(write=False):
+    """A pooled connection (a write transaction if write=True), with the tables created on first use."""
+    global _schema_ready
+    with (db_pool.transaction() if write else db_pool.connection()) as conn:
+        if not _schema_ready:
+            _ensure_schema(conn)
+            _schema_ready = True
+        yield conn
+
+class VectorStore:
+    """
+    Append-only, multi-document FAISS store.
+    Every distinct chunk gets a stable ID, used both as its FAISS ID and as
+    its row ID in the SQLite `chunks` table, so a search only fetches the
+    text of its k hits. Each document maps to the IDs of its chunks. Adding
+    a document only encodes chunks the library hasn't seen; re-uploading a
+    document replaces its old version; deleting it removes the chunks no
+    other document uses.
+
+    Changes stay in memory until save(), which writes a new index file and
+    then switches the database over to it in a single transaction.
+    """
+    def __init__(self):
+        self.index = None        # FAISS index addressed by chunk ID, created on first add
+        self.index_params = {"type": "flat"}
+        self.index_file = None
+        self.next_id = 0
+        self._new_chunks = {}    # chunk_hash -> (chunk_id, text), not saved yet
+        self._pending = {}       # document name -> chunk IDs added in this upload
+        self._documents = {}     # document name -> chunk IDs (None = deleted), not saved yet
+        self._removed = set()    # chunk IDs removed from the index, not saved yet
+
+    @staticmethod
+    def current_version():
+        """Identifies the saved index (file name + mtime), or None if there is none."""
+        with _connect() as conn:
+            row = conn.execute("SELECT value FROM vector_store_meta WHERE key = 'index_file'").fetchone()
+        try:
+            return (row[0], os.stat(row[0]).st_mtime_ns) if row else None
+        except OSError:
+            return None
+
+    @staticmethod
+    def has_legacy_files():
+        return os.path.exists(LEGACY_INDEX_PATH) and os.path.exists(LEGACY_CHUNKS_PATH)
+
+    @classmethod
+    def load(cls):
+        """Loads the saved index (but no chunk text), or returns an empty store."""
+        import faiss
+        store = cls()
+        with _connect() as conn:
+            meta = {row[0]: row[1] for row in conn.execute("SELECT key, value FROM vector_store_meta")}
+
+        if "index_file" in meta and os.path.exists(meta["index_file"]):
+            store.index_file = meta["index_file"]
+            store.index = faiss.read_index(store.index_file)
+            store.next_id = int(meta["next_id"])
+            store.index_params = json.loads(meta["index_params"])
+            apply_search_params(store.index, store.index_params)
+        elif cls.has_legacy_files():
+            store._migrate_legacy()
+        return store
+
+    def _migrate_legacy(self):
+        """One-time import of the old index + chunks.pkl into the SQLite chunk store."""
+        import faiss
+        index = faiss.read_index(LEGACY_INDEX_PATH)
+        with open(LEGACY_CHUNKS_PATH, 'rb') as f:
+            meta = pickle.load(f)
+
+        if isinstance(meta, list):
+            # Single-document format: a plain flat index + a list of chunks
+            vectors = index.reconstruct_n(0, index.ntotal)
+            ids = np.arange(len(meta), dtype='int64')
+            self.index = build_index(self.index_params, vectors.shape[1], vectors, ids)
+            chunks = dict(zip(ids.tolist(), meta))
+            self._documents = {LEGACY_DOCUMENT: ids.tolist()}
+            self.next_id = len(meta)
+        else:
+            # Multi-document pickle format
+            self.index = index
+            self.index_params = meta.get("index_params", {"type": "flat"})
+            apply_search_params(self.index, self.index_params)
+            chunks = meta["chunks"]
+            self._documents = dict(meta["documents"])
+            self.next_id = meta["next_id"]
+
+        self._new_chunks = {content_hash(text): (chunk_id, text) for chunk_id, text in chunks.items()}
+        self.save()
+        os.remove(LEGACY_CHUNKS_PATH)
+        os.remove(LEGACY_INDEX_PATH)
+        print(f"VectorStore: Migrated {len(chunks)} chunks from chunks.pkl to the database.")
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    def _lookup_ids(self, chunk_hashes):
+        """{chunk_hash: chunk_id} for chunks already in the library."""
+        found, missing = {}, []
+        for chunk_hash in set(chunk_hashes):
+            if chunk_hash in self._new_chunks:
+                found[chunk_hash] = self._new_chunks[chunk_hash][0]
+            else:
+                missing.append(chunk_hash)
+        with _connect() as conn:
+            for batch in _batched(missing):
+                rows = conn.execute(f"SELECT chunk_hash, id FROM chunks WHERE chunk_hash IN ({_placeholders(batch)})", batch)
+                found.update({row[0]: row[1] for row in rows if row[1] not in self._removed})
+        return found
+
+    def get_chunk_map(self, chunk_ids):
+        """
+        Fetches the text of just these chunks as {chunk_id: text}. IDs that
+        are gone (e.g. their document was deleted by another process since
+        this index was loaded) are left out.
+        """
+        chunk_ids = list({int(chunk_id) for chunk_id in chunk_ids if chunk_id != -1})
+        texts = {}
+        with _connect() as conn:
+            for batch in _batched(chunk_ids):
+                rows = conn.execute(f"SELECT id, content FROM chunks WHERE id IN ({_placeholders(batch)})", batch)
+                texts.update({row[0]: row[1] for row in rows})
+        return texts
+
+    def get_chunks(self, chunk_ids):
+        """Fetches the text of just these chunks, in the given order (unknown IDs are skipped)."""
+        texts = self.get_chunk_map(chunk_ids)
+        return [texts[int(chunk_id)] for chunk_id in chunk_ids if int(chunk_id) in texts]
+
+    def add_chunks(self, document, chunks, embed_fn):
+        """
+        Adds a batch of a document's chunks. Only chunks new to the library
+        are passed to embed_fn (texts -> float32 array) and added to FAISS.
+        """
+        pending = self._pending.setdefault(document, [])
+        hashes = [content_hash(chunk) for chunk in chunks]
+        known = self._lookup_ids(hashes)
+
+        new_chunks = {}
+        for chunk_hash, chunk in zip(hashes, chunks):
+            if chunk_hash not in known and chunk_hash not in new_chunks:
+                new_chunks[chunk_hash] = chunk
+
+        if new_chunks:
+            vectors = embed_fn(list(new_chunks.values()))
+            if self.index is None:
+                self.index = build_index(self.index_params, vectors.shape[1])
+            ids = np.arange(self.next_id, self.next_id + len(new_chunks), dtype='int64')
+            self.index.add_with_ids(vectors, ids)
+            for chunk_id, (chunk_hash, chunk) in zip(ids.tolist(), new_chunks.items()):
+                self._new_chunks[chunk_hash] = (chunk_id, chunk)
+                known[chunk_hash] = chunk_id
+            self.next_id += len(new_chunks)
+
+        pending.extend(known[chunk_hash] for chunk_hash in hashes)
+        return len(new_chunks)
+
+    def _document_chunk_ids(self, document):
+        if document in self._documents:
+            return self._documents[document] or []
+        with _connect() as conn:
+            rows = conn.execute("""
+                SELECT dc.chunk_id FROM document_chunks dc
+                JOIN documents d ON d.id = dc.document_id
+                WHERE d.name = ?
+            """, (document,)).fetchall()
+        return [row[0] for row in rows]
+
+    def commit_document(self, document):
+        """Makes the chunks added in this upload the document's current version."""
+        old_ids = set(self._document_chunk_ids(document))
+        self._documents[document] = list(dict.fromkeys(self._pending.pop(document, [])))
+        self._remove_orphans(old_ids - set(self._documents[document]))
+        self._maybe_rebuild()
+
+    def delete_document(self, document):
+        """Removes a document; chunks shared with other documents are kept."""
+        old_ids = set(self._document_chunk_ids(document))
+        self._documents[document] = None
+        self._remove_orphans(old_ids)
+        self._maybe_rebuild()
+        return len(old_ids)
+
+    def _remove_orphans(self, candidate_ids):
+        if not candidate_ids:
+            return
+        # Still used by a document changed in this session...
+        still_used = set()
+        for chunk_ids in self._documents.values():
+            still_used.update(chunk_ids or [])
+        # ...or by any other saved document
+        changed = list(self._documents)
+        with _connect() as conn:
+            for batch in _batched(candidate_ids):
+                rows = conn.execute(f"""
+                    SELECT DISTINCT dc.chunk_id FROM document_chunks dc
+                    JOIN documents d ON d.id = dc.document_id
+                    WHERE dc.chunk_id IN ({_placeholders(batch)}) AND d.name NOT IN ({_placeholders(changed)})
+                """, batch + changed)
+                still_used.update(row[0] for row in rows)
+
+        orphans = {chunk_id for chunk_id in candidate_ids if chunk_id not in still_used}
+        if not orphans:
+            return
+        self._removed.update(orphans)
+        self._new_chunks = {h: (i, text) for h, (i, text) in self._new_chunks.items() if i not in orphans}
+        if self.index_params["type"] == "hnsw":
+            # HNSW graphs can't delete vectors, so rebuild without them
+            self._rebuild(self.index_params, exclude=orphans)
+        else:
+            self.index.remove_ids(np.array(sorted(orphans), dtype='int64'))
+
+    def _all_vectors(self):
+        """(chunk IDs, vectors) of everything in the index."""
+        import faiss
+        if self.index_params["type"] == "ivf":
+            with _connect() as conn:
+                saved_ids = [row[0] for row in conn.execute("SELECT id FROM chunks")]
+            ids = [i for i in saved_ids if i not in self._removed] + [i for i, _ in self._new_chunks.values()]
+            ids = np.array(ids, dtype='int64')
+            return ids, self.index.reconstruct_batch(ids)
+        ids = faiss.vector_to_array(self.index.id_map)
+        return ids, self.index.index.reconstruct_n(0, self.index.ntotal)
+
+    def _rebuild(self, params, exclude=()):
+        ids, vectors = self._all_vectors()
+        if exclude:
+            keep = np.array([chunk_id not in exclude for chunk_id in ids], dtype=bool)
+            ids, vectors = ids[keep], vectors[keep]
+        self.index = build_index(params, vectors.shape[1], vectors, ids)
+        self.index_params = params
+
+    def _maybe_rebuild(self):
+        """Switches index type when the corpus crosses a size threshold (and retrains a grown IVF)."""
+        if self.index is None:
+            return
+        params = choose_index_params(self.ntotal)
+        current = self.index_params
+        grown_ivf = current["type"] == "ivf" and params.get("nlist", 0) >= 2 * current["nlist"]
+        if params["type"] != current["type"] or grown_ivf:
+            print(f"VectorStore: Rebuilding index as {params['type']} for {self.ntotal} chunks...")
+            self._rebuild(params)
+
+    def save(self):
+        """
+        Writes the index to a new file, then records the chunk rows, document
+        mappings and the new file name in one transaction. Readers keep using
+        the old index until that commit, so they never see a half-saved store.
+        """
+        import faiss
+        if self.index is None:
+            return
+        os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
+        index_file = os.path.join(VECTOR_STORE_DIR, f"study_material.{time.time_ns()}.index")
+        faiss.write_index(self.index, index_file)
+
+        try:
+            with _connect(write=True) as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (id, chunk_hash, content) VALUES (?, ?, ?)",
+                    [(chunk_id, chunk_hash, text) for chunk_hash, (chunk_id, text) in self._new_chunks.items()]
+                )
+                for document, chunk_ids in self._documents.items():
+                    row = conn.execute("SELECT id FROM documents WHERE name = ?", (document,)).fetchone()
+                    if row:
+                        conn.execute("DELETE FROM document_chunks WHERE document_id = ?", (row[0],))
+                    if chunk_ids is None:
+                        conn.execute("DELETE FROM documents WHERE name = ?", (document,))
+                        continue
+                    if row:
+                        document_id = row[0]
+                        conn.execute("UPDATE documents SET uploaded_at = CURRENT_TIMESTAMP WHERE id = ?", (document_id,))
+                    else:
+                        document_id = conn.execute(
+                            "INSERT INTO documents (name, uploaded_at) VALUES (?, CURRENT_TIMESTAMP)", (document,)
+                        ).lastrowid
+                    conn.executemany(
+                        "INSERT INTO document_chunks (document_id, chunk_id, position) VALUES (?, ?, ?)",
+                        [(document_id, chunk_id, position) for position, chunk_id in enumerate(chunk_ids)]
+                    )
+                for batch in _batched(self._removed):
+                    conn.execute(f"DELETE FROM chunks WHERE id IN ({_placeholders(batch)})", batch)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO vector_store_meta (key, value) VALUES (?, ?)",
+                    [("index_file", index_file), ("next_id", str(self.next_id)),
+                     ("index_params", json.dumps(self.index_params))]
+                )
+        except Exception:
+            os.remove(index_file)
+            raise
+
+        if self.index_file and self.index_file != index_file and os.path.exists(self.index_file):
+            os.remove(self.index_file)
+        self.index_file = index_file
+        self._new_chunks, self._documents, self._removed = {}, {}, set()
+
+    def list_documents(self):
+        """[(document name, number of chunks)] for the whole library."""
+        with _connect() as conn:
+            rows = conn.execute("""
+                SELECT d.name, COUNT(dc.chunk_id) FROM documents d
+                LEFT JOIN document_chunks dc ON dc.document_id = d.id
+                GROUP BY d.id ORDER BY d.id
+            """).fetchall()
+        return [(row[0], row[1]) for row in rows]
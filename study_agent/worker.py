@@ -0,0 +1,121 @@
+# worker.py
+# Background workers that run queued pipeline jobs (see utils/jobs.py).
+# The app starts JOB_WORKERS of them itself; to run them separately instead
+# (e.g. on a bigger machine), set JOB_WORKERS=0 for the app and run from the
+# study_agent folder:
+#   python worker.py --workers 4
+import argparse
+import atexit
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from main import iter_study_pipeline
+from utils.database import initialize_database
+from utils.jobs import claim_job, heartbeat, update_job_progress, finish_job
+from utils import metrics
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1.0))  # seconds between checks of an empty queue
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", 10))  # seconds
+
+def run_job(job, worker_id):
+    """
+    Runs one claimed job to completion, persisting every progress event.
+    A job reclaimed after a crash simply runs again: pages, embeddings and
+    LLM responses finished by the earlier attempt come from their caches,
+    so only the unfinished work is redone.
+    """
+    job_id = job["id"]
+    print(f"Worker {worker_id}: Running job {job_id} ({job['document_name']}, attempt {job['attempts']})...")
+
+    # Long stages (OCR, big LLM batches) can go quiet for a while; keep the claim alive
+    stop = threading.Event()
+    def keep_alive():
+        while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+            if not heartbeat(job_id, worker_id):
+                print(f"Worker {worker_id}: Lost job {job_id} to another worker.")
+                return
+    threading.Thread(target=keep_alive, daemon=True).start()
+
+    error = None
+    try:
+        for event in iter_study_pipeline(job["pdf_path"]):
+            update_job_progress(job_id, worker_id, event)
+            if event["stage"] == "error":
+                error = event["message"]
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    finally:
+        stop.set()
+
+    finish_job(job_id, worker_id, error)
+    print(f"Worker {worker_id}: Job {job_id} {'failed: ' + error if error else 'done'}.")
+    return error is None
+
+def run_worker(worker_id=None, poll_interval=JOB_POLL_INTERVAL, stop_event=None, once=False, worker_index=0):
+    """
+    Claims and runs jobs until stop_event is set.
+    With once=True, returns as soon as the queue is empty.
+    With METRICS_PORT set, the worker serves its metrics on METRICS_PORT + 1 + worker_index.
+    """
+    worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    initialize_database()
+    if metrics.METRICS_PORT:
+        metrics.start_metrics_server(metrics.METRICS_PORT + 1 + worker_index)
+    print(f"Worker {worker_id}: Started.")
+    while not (stop_event and stop_event.is_set()):
+        job = claim_job(worker_id)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        if job["attempts"] == 1:
+            metrics.observe("job_queue_wait_seconds", time.time() - job["created_at"])
+        run_job(job, worker_id)
+    print(f"Worker {worker_id}: Stopped.")
+
+def start_workers(count=JOB_WORKERS, once=False):
+    """
+    Starts worker processes. Each has its own models and LLM client pool,
+    so throughput grows with the number of workers (up to CPU and API limits).
+    They are stopped when the process that started them exits; a job cut
+    off that way is picked up again once its heartbeat goes stale.
+    """
+    # Not daemon processes: those can't start the PDF extraction pool
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, kwargs={"once": once, "worker_index": i}) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    atexit.register(lambda: [worker.terminate() for worker in workers if worker.is_alive()])
+    print(f"Worker: Started {count} worker processes.")
+    return workers
+
+def launch_worker_pool(count=JOB_WORKERS):
+    """
+    Runs `worker.py --workers count` as a child process (used by the app;
+    starting processes straight from a Streamlit script would re-run it).
+    The pool is stopped when the calling process exits.
+    """
+    pool = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--workers", str(count)])
+    atexit.register(pool.terminate)
+    return pool
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run queued study pipeline jobs.")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1), help="number of worker processes")
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = parser.parse_args()
+    # Exit normally on SIGTERM, so the worker processes are stopped too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if args.workers == 1:
+        run_worker(once=args.once)
+    else:
+        for worker in start_workers(args.workers, once=args.once):
+            worker.join()